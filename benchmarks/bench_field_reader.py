@@ -0,0 +1,92 @@
+"""Benchmark of the field reader against Ofpp
+
+Reads the large field files of the bundled example case with
+Ofpp.parse_internal_field and with field_reader.read_internal_field,
+checks that both give the same values and prints the time taken by
+each of them (best of several repetitions).
+
+The example case has no vector field, so a volVectorField file is
+also assembled from its Cx, Cy and Cz files in a temporary folder.
+
+Run from the benchmarks folder:
+    python bench_field_reader.py [case_path] [repeat]
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import Ofpp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+import field_reader
+
+DEFAULT_CASE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'examples', 'Resources', 'Catalyst_P-0.15_n-7_nl-2_Re-20')
+
+# Field files of the example case, relative to the case folder:
+FIELD_FILES = [
+    '0/FluidRegion/Cx',
+    '0/FluidRegion/V',
+    '3.000025/FluidRegion/T',
+    '0/FluidRegion/p_rgh',
+    'MomentumSolution/0.500053/static(p)',
+]
+
+
+def best_time(function, fn: str, repeat: int) -> tuple:
+    """Best wall time of repeat calls of function(fn), and its result"""
+
+    best = float('inf')
+    for _ in range(repeat):
+        time1 = time.perf_counter()
+        result = function(fn)
+        best = min(best, time.perf_counter() - time1)
+    return best, result
+
+
+def write_vector_file(case_path: str, fn: str):
+    """Write the cell centres of the fluid region as a vector field"""
+
+    components = [field_reader.read_internal_field(os.path.join(case_path, '0/FluidRegion/C' + c))
+                  for c in 'xyz']
+    with open(fn, 'w') as f:
+        f.write("FoamFile\n{\n    format      ascii;\n    class       volVectorField;\n"
+                "    object      C;\n}\n\ndimensions      [0 1 0 0 0 0 0];\n\n")
+        f.write(f"internalField   nonuniform List<vector> \n{len(components[0])}\n(\n")
+        f.writelines(f"({x:.15g} {y:.15g} {z:.15g})\n" for x, y, z in zip(*components))
+        f.write(")\n;\n\nboundaryField\n{\n}\n")
+
+
+def main(case_path: str = DEFAULT_CASE, repeat: int = 5):
+    tmp_dir = tempfile.TemporaryDirectory()
+    vector_fn = os.path.join(tmp_dir.name, 'C')
+    write_vector_file(case_path, vector_fn)
+
+    print(f"{'file':<40}{'cells':>10}{'Ofpp [s]':>12}{'reader [s]':>12}{'speedup':>10}")
+    total_ofpp = 0.0
+    total_reader = 0.0
+    for name in FIELD_FILES + ['C (vector, from Cx Cy Cz)']:
+        fn = os.path.join(case_path, name)
+        if name not in FIELD_FILES:
+            fn = vector_fn
+        if not os.path.isfile(fn):
+            continue
+        t_ofpp, ref = best_time(Ofpp.parse_internal_field, fn, repeat)
+        t_reader, data = best_time(field_reader.read_internal_field, fn, repeat)
+        if not np.array_equal(np.asarray(ref), data):
+            raise RuntimeError("Values differ from Ofpp for " + fn)
+        total_ofpp += t_ofpp
+        total_reader += t_reader
+        print(f"{name:<40}{len(data):>10}{t_ofpp:>12.4f}{t_reader:>12.4f}{t_ofpp/t_reader:>10.1f}")
+
+    print(f"{'total':<40}{'':>10}{total_ofpp:>12.4f}{total_reader:>12.4f}{total_ofpp/total_reader:>10.1f}")
+    tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CASE,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5)
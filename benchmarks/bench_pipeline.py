@@ -0,0 +1,203 @@
+"""Benchmark of the reading and post-processing pipeline
+
+Generates synthetic cases (see synthetic_case.py) of several sizes
+and numbers of timesteps, and times, on each of them:
+
+    load_case_properties    reading caseConfig.sh
+    read_simulation_data    parsing the meshes and all the timesteps
+                            and saving the joblib file
+    joblib_load             loading the joblib file
+    getAvg_*                each of the averages of
+                            post_processing_functions.py, the first
+                            call (averagers built, "cold") and the
+                            next ones (cached averagers, "warm")
+
+Times are the best of several repetitions, except for
+read_simulation_data, which is run once. The results are printed and
+saved to a JSON file, with the version of the package (git commit)
+and of Python and numpy, so that the results of different versions
+can be compared. With --baseline, the times are also compared with
+those of a previous results file.
+
+Run from the benchmarks folder:
+    python bench_pipeline.py [--cells 1e5 1e6] [--timesteps 1 5]
+        [--repeat 3] [--workers N] [--output FILE] [--baseline FILE]
+        [--cases-dir DIR]
+
+Cases of 10^7 cells take several GB of disk (the files are ASCII) and
+minutes to generate and read.
+
+"""
+
+import os
+import sys
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import joblib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+import data_handling_functions
+import post_processing_functions
+
+import synthetic_case
+
+NUM_ZDOTS = 100
+NUM_RDOTS = 20
+
+# Averages timed, with their arguments after data:
+AVERAGES = {
+    "getAvg_p_rgh": (NUM_ZDOTS,),
+    "getAvg_T_justFluid": (NUM_ZDOTS,),
+    "getAvg_T": (NUM_ZDOTS,),
+    "getAvg_T_radial": (NUM_RDOTS,),
+    "getAvg_T_rz": (NUM_RDOTS, NUM_ZDOTS),
+}
+
+
+def best_time(function, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        time1 = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - time1)
+    return best
+
+
+def git_version() -> dict:
+    """Commit of the package, None if it is not a git repository"""
+
+    def git(*args):
+        try:
+            result = subprocess.run(['git', *args], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        except OSError:
+            return None
+        if result.returncode != 0:
+            return None
+        return result.stdout.strip()
+
+    return {"commit": git('rev-parse', 'HEAD'),
+            "describe": git('describe', '--always', '--dirty')}
+
+
+def bench_case(case_path: str, repeat: int, workers: int = None) -> dict:
+    """Times of the pipeline on a case, {benchmark: time [s]}"""
+
+    times = {}
+    times["load_case_properties"] = best_time(
+        lambda: data_handling_functions.load_case_properties(case_path), repeat)
+
+    # Its own progress output is not part of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        time1 = time.perf_counter()
+        datafilename = data_handling_functions.read_simulation_data(case_path, mode='all', workers=workers)
+        times["read_simulation_data"] = time.perf_counter() - time1
+
+    times["joblib_load"] = best_time(lambda: joblib.load(datafilename), repeat)
+
+    data = joblib.load(datafilename)
+    for name, arguments in AVERAGES.items():
+        function = getattr(post_processing_functions, name)
+        post_processing_functions.clear_averager_cache()
+        times[name + "_cold"] = best_time(lambda: function(data, *arguments), 1)
+        times[name + "_warm"] = best_time(lambda: function(data, *arguments), repeat)
+
+    os.remove(datafilename)
+    post_processing_functions.clear_averager_cache()
+
+    return times
+
+
+def compare(results: list[dict], baseline_fn: str):
+    """Print the ratio of the times to those of a previous results
+    file, for the benchmarks in both"""
+
+    with open(baseline_fn) as f:
+        baseline = json.load(f)
+    previous = {(entry["benchmark"], entry["cells"], entry["timesteps"]): entry["time"]
+                for entry in baseline["results"]}
+
+    print(f"\nCompared with {baseline_fn} ({baseline['metadata']['version']['describe']}):")
+    print(f"{'benchmark':<28}{'cells':>10}{'timesteps':>11}{'before [s]':>12}{'now [s]':>10}{'ratio':>8}")
+    for entry in results:
+        key = (entry["benchmark"], entry["cells"], entry["timesteps"])
+        if key in previous:
+            print(f"{entry['benchmark']:<28}{entry['cells']:>10}{entry['timesteps']:>11}"
+                  f"{previous[key]:>12.4f}{entry['time']:>10.4f}{entry['time']/previous[key]:>8.2f}")
+
+
+def main(   cells: list[int],
+            timesteps: list[int],
+            repeat: int = 3,
+            workers: int = None,
+            output: str = None,
+            baseline: str = None,
+            cases_dir: str = None
+        ):
+    metadata = {"date": datetime.datetime.now().isoformat(timespec='seconds'),
+                "version": git_version(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "repeat": repeat,
+                "workers": workers}
+    if output is None:
+        output = f"bench_pipeline_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+
+    tmp_dir = None
+    if cases_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        cases_dir = tmp_dir.name
+
+    results = []
+    print(f"{'benchmark':<28}{'cells':>10}{'timesteps':>11}{'time [s]':>12}")
+    for num_cells in cells:
+        for num_timesteps in timesteps:
+            case_path = os.path.join(cases_dir, f"Synthetic_{num_cells}_{num_timesteps}") + '/'
+            time1 = time.perf_counter()
+            case = synthetic_case.make_case(case_path, num_cells, num_timesteps, num_timesteps)
+            print(f"{'(generate case)':<28}{num_cells:>10}{num_timesteps:>11}{time.perf_counter() - time1:>12.4f}")
+
+            for benchmark, value in bench_case(case_path, repeat, workers).items():
+                results.append({"benchmark": benchmark, "cells": num_cells, "timesteps": num_timesteps,
+                                "fluid_cells": case["fluid_cells"], "solid_cells": case["solid_cells"],
+                                "time": value})
+                print(f"{benchmark:<28}{num_cells:>10}{num_timesteps:>11}{value:>12.4f}")
+
+    with open(output, 'w') as f:
+        json.dump({"metadata": metadata, "results": results}, f, indent=1)
+    print(f"\nResults saved to {output}")
+
+    if baseline is not None:
+        compare(results, baseline)
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the reading and post-processing of synthetic cases.")
+    parser.add_argument('--cells', type=float, nargs='+', default=[1e5, 1e6],
+                        help="approximate number of cells of the cases")
+    parser.add_argument('--timesteps', type=int, nargs='+', default=[1, 5],
+                        help="number of thermal and momentum timesteps of the cases")
+    parser.add_argument('--repeat', type=int, default=3, help="repetitions of each benchmark")
+    parser.add_argument('--workers', type=int, default=None, help="workers of read_simulation_data")
+    parser.add_argument('--output', default=None, help="JSON file for the results")
+    parser.add_argument('--baseline', default=None, help="JSON file of previous results to compare with")
+    parser.add_argument('--cases-dir', default=None,
+                        help="folder for the cases, kept after the benchmark (by default a temporary one)")
+    args = parser.parse_args()
+
+    main([int(num_cells) for num_cells in args.cells], args.timesteps, args.repeat, args.workers,
+         args.output, args.baseline, args.cases_dir)
@@ -0,0 +1,120 @@
+"""Benchmark of the storage of the fields
+
+Reads the fields of the bundled example case (fluid temperature of
+all the thermal timesteps, static pressure of all the momentum
+timesteps and, as a vector field, the cell centres assembled from
+Cx, Cy and Cz), saves them with every storage option of
+read_simulation_data (joblib file or case store, float64 or float32,
+compressed or not) and prints the size of the saved data and the
+time taken to load all of it into memory (best of several
+repetitions).
+
+The first row saves the fields as lists with one value (or one
+3-element array) per cell, for reference.
+
+Run from the benchmarks folder:
+    python bench_storage.py [case_path] [repeat]
+
+"""
+
+import os
+import sys
+import glob
+import tempfile
+import time
+
+import numpy as np
+import joblib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+import case_store
+import field_reader
+
+DEFAULT_CASE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'examples', 'Resources', 'Catalyst_P-0.15_n-7_nl-2_Re-20')
+
+
+def read_fields(case_path: str) -> dict:
+    """Read the fields of the example case, {field: [arrays]}"""
+
+    # The 0 folders have the initial conditions, not results
+    thermal = sorted(glob.glob(os.path.join(case_path, '[1-9]*', 'FluidRegion', 'T')))
+    momentum = sorted(glob.glob(os.path.join(case_path, 'MomentumSolution', '0.*', 'static(p)')))
+    centres = np.stack([field_reader.read_internal_field(os.path.join(case_path, '0/FluidRegion/C' + c))
+                        for c in 'xyz'], axis=1)
+
+    return {"FluidTemperature": [field_reader.read_internal_field(fn) for fn in thermal],
+            "StaticPressure": [field_reader.read_internal_field(fn) for fn in momentum],
+            "VelocityField": [centres]}
+
+
+def folder_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(dirpath, fn))
+               for dirpath, _, filenames in os.walk(path) for fn in filenames)
+
+
+def write_store(fields: dict, store_path: str, compression: str) -> dict:
+    """Save the fields as the field arrays of a case store, {field:
+    [filenames]}"""
+
+    return {field: [case_store.write_field_timestep(store_path, field, str(i), values, compression)
+                    for i, values in enumerate(timesteps)]
+            for field, timesteps in fields.items()}
+
+
+def load_store(store_path: str, files: dict) -> dict:
+    return {field: [case_store._load_array(store_path, fn, mmap_mode=None) for fn in filenames]
+            for field, filenames in files.items()}
+
+
+def best_time(function, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        time1 = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - time1)
+    return best
+
+
+def main(case_path: str = DEFAULT_CASE, repeat: int = 5):
+    fields = read_fields(case_path)
+    num_arrays = sum(len(timesteps) for timesteps in fields.values())
+    print(f"{num_arrays} arrays, {fields['FluidTemperature'][0].shape[0]} cells")
+
+    options = [("joblib", "lists", "float64", None),
+               ("joblib", "arrays", "float64", None),
+               ("joblib", "arrays", "float32", None),
+               ("joblib", "arrays", "float64", "zlib"),
+               ("store", "arrays", "float64", None),
+               ("store", "arrays", "float32", None)]
+    options += [("store", "arrays", dtype, compression)
+                for compression in case_store.COMPRESSORS for dtype in case_store.FIELD_DTYPES]
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    print(f"{'format':<10}{'fields':<8}{'dtype':<9}{'compression':<13}{'size [MB]':>11}{'load [s]':>10}")
+    for i, (store_format, kind, dtype, compression) in enumerate(options):
+        data = {field: [case_store.normalise_field(values, dtype=dtype) for values in timesteps]
+                for field, timesteps in fields.items()}
+        if kind == "lists":
+            data = {field: [list(values) for values in timesteps] for field, timesteps in data.items()}
+
+        path = os.path.join(tmp_dir.name, str(i))
+        if store_format == "joblib":
+            joblib.dump(data, path, compress=(compression, 1) if compression else 0)
+            # Lists take long to unpickle, one repetition is enough
+            load_time = best_time(lambda: joblib.load(path), 1 if kind == "lists" else repeat)
+        else:
+            files = write_store(data, path, compression)
+            load_time = best_time(lambda: load_store(path, files), repeat)
+
+        print(f"{store_format:<10}{kind:<8}{dtype:<9}{str(compression):<13}"
+              f"{folder_size(path)/1e6:>11.2f}{load_time:>10.4f}")
+
+    tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CASE,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5)
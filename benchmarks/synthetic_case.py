@@ -0,0 +1,427 @@
+"""Synthetic case generator
+
+Writes OpenFOAM cases with the layout of the cases of this package
+(see read_simulation_data), of any number of cells, so that the
+reading and the post-processing can be benchmarked at the scale of
+production meshes (10^5 to 10^7 cells) without running OpenFOAM.
+
+The geometry is that of the bundled example: a cylinder of radius R
+and length Lfront + Lcat + Lback, with a structured catalyst of
+square channels in the middle section. It is meshed with a regular
+grid of hexahedra: the cells of the grid inside the cylinder are
+either in the solid (the walls of the catalyst) or in the fluid (the
+channels, and the whole section before and after the catalyst). Each
+region gets
+
+    constant/<region>/polyMesh (points, faces, owner, neighbour,
+        boundary, with inlet, outlet and walls patches)
+    0/<region>/C, V and T (initial condition)
+
+and every thermal timestep <t>/<region>/T. The momentum simulation
+gets MomentumSolution/<t>/U and static(p) on the fluid mesh (and a
+uniform MomentumSolution/0). The fields are smooth functions of the
+position with some noise, and caseConfig.sh has the parameters of
+the example with the porosity of the generated catalyst.
+
+All the files are ASCII, as in the example. They are written in
+chunks, so the memory needed is that of the mesh arrays.
+
+make_case( 'Synthetic_1e6', 1_000_000, num_thermal=5, num_momentum=5 )
+
+Run from the benchmarks folder:
+    python synthetic_case.py case_path [num_cells] [num_timesteps]
+
+This module requires numpy. It also uses os and sys
+
+"""
+
+import os
+import sys
+
+import numpy as np
+
+FOAM_HEADER = """/*--------------------------------*- C++ -*----------------------------------*\\
+  =========                 |
+  \\\\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox
+   \\\\    /   O peration     | Website:  https://openfoam.org
+    \\\\  /    A nd           | Version:  9
+     \\\\/     M anipulation  |
+\\*---------------------------------------------------------------------------*/
+FoamFile
+{{
+    format      ascii;
+    class       {foam_class};{note}
+    location    "{location}";
+    object      {object_name};
+}}
+// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * //
+
+"""
+
+FOAM_FOOTER = "\n\n// ************************************************************************* //\n"
+
+CASE_CONFIG = """#!/bin/bash
+# Synthetic case, written by synthetic_case.py
+
+# Geometry:
+export R="{R}"
+export Lcat="{Lcat}"
+export Lfront="{Lfront}"
+export Lback="{Lback}"
+export porosity="{porosity}"
+export Rchannels="{Rchannels}"
+
+# Fluid properties:
+export RHO="1.19"
+export MU="1.5e-5"
+export FluidCP="1004.9"
+export FluidPr="0.7"
+export FluidMW="29"
+export FluidHf="0"
+
+# Solid properties:
+export RHO_s="7800"
+export SolidCP="510"
+export SolidK="18"
+export SolidMW="56"
+
+# Case parameters:
+export caseRep="{Rep}"
+export caseOutletp="101325"
+export inletTemp="{inlet_temp}"
+export initTemp="{inlet_temp}"
+export wallTemp="{wall_temp}"
+
+# Simulation parameters:
+export endTMomentum="{end_momentum}"
+export writeIntervalMomentum="{interval_momentum}"
+export endTThermal="{end_thermal}"
+export writeIntervalThermal="{interval_thermal}"
+"""
+
+# Geometry of the bundled example [mm]:
+R = 10.0
+L_FRONT = 40.0
+L_CAT = 100.0
+L_BACK = 40.0
+
+# Channels of the catalyst, in cells of the grid: a channel of
+# CHANNEL_CELLS x CHANNEL_CELLS cells every PITCH_CELLS cells
+PITCH_CELLS = 5
+CHANNEL_CELLS = 2
+
+INLET_TEMP = 500.0
+WALL_TEMP = 300.0
+OUTLET_PRESSURE = 101325.0
+
+# Values written at a time by the writers:
+WRITE_CHUNK = 1_000_000
+
+
+class _Grid:
+    """Regular grid of nx x ny x nz hexahedra over the bounding box of
+    the cylinder, cells numbered with x fastest, then y, then z"""
+
+    def __init__(self, nx: int, nz: int):
+        self.nx, self.ny, self.nz = nx, nx, nz
+        self.edges = (np.linspace(-R, R, nx + 1)*1e-3,
+                      np.linspace(-R, R, nx + 1)*1e-3,
+                      np.linspace(0.0, L_FRONT + L_CAT + L_BACK, nz + 1)*1e-3)
+        self.centres = tuple(0.5*(edges[1:] + edges[:-1]) for edges in self.edges)
+        self.cell_volume = np.prod([edges[1] - edges[0] for edges in self.edges])
+
+    def point_index(self, i, j, k):
+        return i + (self.nx + 1)*(j + (self.ny + 1)*k)
+
+    def points(self, index: np.ndarray) -> np.ndarray:
+        i = index % (self.nx + 1)
+        j = (index // (self.nx + 1)) % (self.ny + 1)
+        k = index // ((self.nx + 1)*(self.ny + 1))
+        return np.stack((self.edges[0][i], self.edges[1][j], self.edges[2][k]), axis=1)
+
+    def regions(self) -> tuple[np.ndarray, np.ndarray]:
+        """Masks of the fluid and solid cells, shape (nz, ny, nx)"""
+
+        x, y = np.meshgrid(self.centres[0], self.centres[1])
+        in_cylinder = x*x + y*y < (R*1e-3)**2
+        i, j = np.meshgrid(np.arange(self.nx), np.arange(self.ny))
+        in_channel = ((i % PITCH_CELLS) < CHANNEL_CELLS) & ((j % PITCH_CELLS) < CHANNEL_CELLS)
+
+        z = self.centres[2]
+        in_catalyst = ((z > L_FRONT*1e-3) & (z < (L_FRONT + L_CAT)*1e-3))[:, None, None]
+        fluid = in_cylinder & (~in_catalyst | in_channel)
+        solid = in_cylinder & in_catalyst & ~in_channel
+
+        return fluid, solid
+
+
+def _grid_size(num_cells: int, aspect_ratio: float) -> tuple[int, int]:
+    """nx and nz of the grid with about num_cells cells in the
+    cylinder, with cells aspect_ratio times longer in z than in x"""
+
+    length_ratio = (L_FRONT + L_CAT + L_BACK)/(2*R)
+    nx = max(int(round((num_cells/(np.pi/4*length_ratio/aspect_ratio))**(1/3))), CHANNEL_CELLS + 1)
+
+    return nx, max(int(round(nx*length_ratio/aspect_ratio)), 3)
+
+
+def _region_faces(grid: _Grid, mask: np.ndarray) -> dict:
+    """Faces of the cells of a region of the grid, in OpenFOAM order:
+    the internal faces sorted by owner and neighbour, then the faces of
+    each patch"""
+
+    local = np.full(mask.size, -1, dtype=np.int64)
+    local[mask.ravel()] = np.arange(np.count_nonzero(mask))
+
+    # Directions of the faces normal to x, y and z: (axis of the mask,
+    # offset of the cell, in-plane offsets (u, v) of the points with
+    # u x v along the normal)
+    directions = [(2, (1, 0, 0), (0, 1, 0), (0, 0, 1)),
+                  (1, (0, 1, 0), (0, 0, 1), (1, 0, 0)),
+                  (0, (0, 0, 1), (1, 0, 0), (0, 1, 0))]
+
+    internal, boundary = [], []
+    for axis, offset, u, v in directions:
+        pad = [(0, 0)]*3
+        pad[axis] = (1, 1)
+        padded = np.pad(mask, pad)
+        lower = np.take(padded, np.arange(padded.shape[axis] - 1), axis=axis)
+        upper = np.take(padded, np.arange(1, padded.shape[axis]), axis=axis)
+
+        for kind, selected in (("internal", lower & upper),
+                               ("lower", lower & ~upper),
+                               ("upper", upper & ~lower)):
+            k, j, i = (index.astype(np.int64) for index in np.nonzero(selected))
+            corners = [grid.point_index(i, j, k),
+                       grid.point_index(i + u[0], j + u[1], k + u[2]),
+                       grid.point_index(i + u[0] + v[0], j + u[1] + v[1], k + u[2] + v[2]),
+                       grid.point_index(i + v[0], j + v[1], k + v[2])]
+            upper_cell = i + grid.nx*(j + grid.ny*k)
+            lower_cell = (i - offset[0]) + grid.nx*((j - offset[1]) + grid.ny*(k - offset[2]))
+
+            if kind == "internal":
+                internal.append((np.stack(corners, axis=1), local[lower_cell], local[upper_cell]))
+                continue
+            if kind == "lower":
+                # Normal along the axis, out of the lower cell
+                faces, owner = np.stack(corners, axis=1), local[lower_cell]
+            else:
+                # Normal against the axis, out of the upper cell
+                faces, owner = np.stack(corners[::-1], axis=1), local[upper_cell]
+            patch = np.full(len(owner), 2, dtype=np.int8)
+            if axis == 0:
+                patch[k == 0] = 0
+                patch[k == grid.nz] = 1
+            boundary.append((faces, owner, patch))
+
+    faces = np.concatenate([entry[0] for entry in internal])
+    owner = np.concatenate([entry[1] for entry in internal])
+    neighbour = np.concatenate([entry[2] for entry in internal])
+    order = np.lexsort((neighbour, owner))
+    faces, owner, neighbour = faces[order], owner[order], neighbour[order]
+
+    boundary_faces = np.concatenate([entry[0] for entry in boundary])
+    boundary_owner = np.concatenate([entry[1] for entry in boundary])
+    patch = np.concatenate([entry[2] for entry in boundary])
+    order = np.lexsort((boundary_owner, patch))
+    patch_sizes = np.bincount(patch, minlength=3)
+
+    faces = np.concatenate((faces, boundary_faces[order]))
+    owner = np.concatenate((owner, boundary_owner[order]))
+
+    # Only the points of the faces of the region, renumbered
+    used = np.zeros((grid.nx + 1)*(grid.ny + 1)*(grid.nz + 1), dtype=bool)
+    used[faces.ravel()] = True
+    point_index = np.cumsum(used) - 1
+
+    return {"points": grid.points(np.flatnonzero(used)),
+            "faces": point_index[faces],
+            "owner": owner,
+            "neighbour": neighbour,
+            "patches": [("inlet", "patch", patch_sizes[0]),
+                        ("outlet", "patch", patch_sizes[1]),
+                        ("walls", "wall", patch_sizes[2])]}
+
+
+def _write_values(f, values: np.ndarray, row_format: str):
+    """Write the rows of values, WRITE_CHUNK at a time"""
+
+    values = values.reshape(len(values), -1)
+    rows = max(WRITE_CHUNK//values.shape[1], 1)
+    for start in range(0, len(values), rows):
+        part = values[start:start + rows]
+        f.write((row_format*len(part)) % tuple(part.ravel().tolist()))
+
+
+def _write_list(    fn: str,
+                    foam_class: str,
+                    values: np.ndarray,
+                    row_format: str,
+                    note: str = None
+                ):
+    """Write a polyMesh file with a list"""
+
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    location = os.path.basename(os.path.dirname(os.path.dirname(fn))) + '/polyMesh'
+    with open(fn, 'w') as f:
+        f.write(FOAM_HEADER.format(foam_class=foam_class, location='constant/' + location,
+                                   object_name=os.path.basename(fn),
+                                   note='' if note is None else f'\n    note        "{note}";'))
+        f.write(f"\n{len(values)}\n(\n")
+        _write_values(f, values, row_format)
+        f.write(")\n" + FOAM_FOOTER)
+
+
+def write_mesh(mesh_path: str, mesh: dict):
+    """Write the polyMesh files of a mesh made by _region_faces"""
+
+    num_cell = int(mesh["owner"].max()) + 1
+    note = (f"nPoints:{len(mesh['points'])}  nCells:{num_cell}  nFaces:{len(mesh['faces'])}  "
+            f"nInternalFaces:{len(mesh['neighbour'])}")
+
+    _write_list(os.path.join(mesh_path, 'points'), 'vectorField', mesh["points"], "(%.10g %.10g %.10g)\n")
+    _write_list(os.path.join(mesh_path, 'faces'), 'faceList', mesh["faces"], "4(%d %d %d %d)\n")
+    _write_list(os.path.join(mesh_path, 'owner'), 'labelList', mesh["owner"], "%d\n", note)
+    _write_list(os.path.join(mesh_path, 'neighbour'), 'labelList', mesh["neighbour"], "%d\n", note)
+
+    start_face = len(mesh["neighbour"])
+    with open(os.path.join(mesh_path, 'boundary'), 'w') as f:
+        f.write(FOAM_HEADER.format(foam_class='polyBoundaryMesh', note='',
+                                   location='constant/' + os.path.basename(os.path.dirname(mesh_path))
+                                   + '/polyMesh', object_name='boundary'))
+        f.write(f"{len(mesh['patches'])}\n(\n")
+        for name, patch_type, num_faces in mesh["patches"]:
+            f.write(f"    {name}\n    {{\n        type            {patch_type};\n"
+                    f"        nFaces          {num_faces};\n        startFace       {start_face};\n    }}\n")
+            start_face += num_faces
+        f.write(")\n" + FOAM_FOOTER)
+
+
+def write_field(    fn: str,
+                    values,
+                    dimensions: str = '[0 0 0 0 0 0 0]'
+                ):
+    """Write a volScalarField (values of shape (cells,), or a number
+    for a uniform field) or a volVectorField (shape (cells, 3))"""
+
+    values = np.asarray(values, dtype=float)
+    vector = values.ndim == 2 or values.size == 3
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    with open(fn, 'w') as f:
+        f.write(FOAM_HEADER.format(foam_class='volVectorField' if vector else 'volScalarField', note='',
+                                   location=os.path.basename(os.path.dirname(fn)),
+                                   object_name=os.path.basename(fn)))
+        f.write(f"dimensions      {dimensions};\n\n")
+        if values.ndim == 0 or (vector and values.ndim == 1):
+            uniform = f"({' '.join(f'{x:.10g}' for x in values)})" if vector else f"{values:.10g}"
+            f.write(f"internalField   uniform {uniform};\n")
+        else:
+            f.write(f"internalField   nonuniform List<{'vector' if vector else 'scalar'}> \n"
+                    f"{len(values)}\n(\n")
+            _write_values(f, values, "(%.10g %.10g %.10g)\n" if vector else "%.10g\n")
+            f.write(")\n;\n")
+        f.write('\nboundaryField\n{\n    ".*"\n    {\n        type            calculated;\n    }\n}\n'
+                + FOAM_FOOTER)
+
+
+def make_case(  case_path: str,
+                num_cells: int = 100_000,
+                num_thermal: int = 1,
+                num_momentum: int = 1,
+                aspect_ratio: float = 3.0,
+                seed: int = 0
+            ) -> dict:
+    """Function for writing a synthetic case
+
+    Parameters
+    ----------
+    case_path : str
+        Path to the case folder (created if needed)
+    num_cells : int
+        Approximate number of cells of both regions
+    num_thermal : int
+        Number of timesteps of the thermal simulation (without the
+        '0' folder)
+    num_momentum : int
+        Number of timesteps of the momentum simulation (without the
+        '0' folder)
+    aspect_ratio : float
+        Length of the cells in z over their length in x and y
+    seed : int
+        Seed of the noise of the fields
+
+    Returns
+    -------
+    dict
+        Number of cells of each region ("fluid_cells",
+        "solid_cells") and the porosity of the catalyst
+
+    """
+
+    rng = np.random.default_rng(seed)
+    grid = _Grid(*_grid_size(num_cells, aspect_ratio))
+    fluid, solid = grid.regions()
+
+    cross_section = fluid[grid.nz//2] | solid[grid.nz//2]
+    porosity = np.count_nonzero(fluid[grid.nz//2])/np.count_nonzero(cross_section)
+    dx = 2*R/grid.nx
+    os.makedirs(case_path, exist_ok=True)
+    with open(os.path.join(case_path, 'caseConfig.sh'), 'w') as f:
+        f.write(CASE_CONFIG.format(R=R, Lcat=L_CAT, Lfront=L_FRONT, Lback=L_BACK,
+                                   porosity=round(porosity, 2),
+                                   Rchannels=CHANNEL_CELLS*dx/np.sqrt(np.pi),
+                                   Rep=20, inlet_temp=INLET_TEMP, wall_temp=WALL_TEMP,
+                                   end_momentum=f"{0.1*max(num_momentum, 1):g}", interval_momentum=0.1,
+                                   end_thermal=3*max(num_thermal, 1), interval_thermal=3))
+
+    thermal_timesteps = [str(3*(s + 1)) for s in range(num_thermal)]
+    momentum_timesteps = [f"{0.1*(s + 1):g}" for s in range(num_momentum)]
+    length = (L_FRONT + L_CAT + L_BACK)*1e-3
+
+    counts = {}
+    for region_name, mask in (('FluidRegion', fluid), ('CatalystRegion', solid)):
+        mesh = _region_faces(grid, mask)
+        write_mesh(os.path.join(case_path, 'constant', region_name, 'polyMesh'), mesh)
+        del mesh
+
+        k, j, i = np.nonzero(mask)
+        centres = np.stack((grid.centres[0][i], grid.centres[1][j], grid.centres[2][k]), axis=1)
+        del k, j, i
+        counts['fluid_cells' if region_name == 'FluidRegion' else 'solid_cells'] = len(centres)
+
+        write_field(os.path.join(case_path, '0', region_name, 'C'), centres, '[0 1 0 0 0 0 0]')
+        write_field(os.path.join(case_path, '0', region_name, 'V'), np.full(len(centres), grid.cell_volume),
+                    '[0 3 0 0 0 0 0]')
+        write_field(os.path.join(case_path, '0', region_name, 'T'), INLET_TEMP, '[0 0 0 1 0 0 0]')
+
+        # Cooled through the wall of the reactor, more as time goes on
+        r2 = (centres[:, 0]**2 + centres[:, 1]**2)/(R*1e-3)**2
+        z = centres[:, 2]/length
+        for s, ts in enumerate(thermal_timesteps):
+            progress = (s + 1)/len(thermal_timesteps)
+            T = INLET_TEMP - (INLET_TEMP - WALL_TEMP)*progress*r2*z + rng.normal(0.0, 0.1, len(z))
+            write_field(os.path.join(case_path, ts, region_name, 'T'), T, '[0 0 0 1 0 0 0]')
+
+        if region_name == 'FluidRegion':
+            momentum_path = os.path.join(case_path, 'MomentumSolution')
+            write_field(os.path.join(momentum_path, '0', 'U'), (0.0, 0.0, 0.0), '[0 1 -1 0 0 0 0]')
+            write_field(os.path.join(momentum_path, '0', 'static(p)'), OUTLET_PRESSURE, '[1 -1 -2 0 0 0 0]')
+            for ts in momentum_timesteps:
+                U = rng.normal(0.0, 1e-3, (len(z), 3))
+                U[:, 2] += 0.2*(1.0 - 0.5*r2)
+                p = OUTLET_PRESSURE + 50.0*(1.0 - z) + rng.normal(0.0, 0.01, len(z))
+                write_field(os.path.join(momentum_path, ts, 'U'), U, '[0 1 -1 0 0 0 0]')
+                write_field(os.path.join(momentum_path, ts, 'static(p)'), p, '[1 -1 -2 0 0 0 0]')
+                del U, p
+
+    counts["porosity"] = porosity
+
+    return counts
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python synthetic_case.py case_path [num_cells] [num_timesteps]")
+    num_timesteps = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    print(make_case(sys.argv[1], int(float(sys.argv[2])) if len(sys.argv) > 2 else 100_000,
+                    num_timesteps, num_timesteps))
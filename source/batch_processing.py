@@ -0,0 +1,345 @@
+"""Batch processing module
+
+This module defines the post-processing of a whole campaign of
+simulations (e.g. a parameter sweep) in one call.
+
+The case folders of a campaign are named
+Catalyst_P-<porosity>_n-<n>_nl-<nl>_Re-<Re>. run_batch finds all of
+them under a root folder and post-processes each one in a pool of
+processes: it reads its parameters, computes the axial profiles and
+the summaries of its fields (streaming.py module, one timestep at a
+time) and saves them in the case folder. Cases with the same mesh
+share it through a mesh cache (mesh_cache.py module), so it is only
+parsed once. Cases whose saved results
+are newer than all their input files are not processed again. A
+failure in one case is recorded in its row and does not stop the
+rest of the batch.
+
+All the results are gathered in one table, a list with one dict
+(row) per case, keyed by the CaseParameters fields, that is saved to
+a joblib file. The scalar columns are also written to a CSV file.
+
+Run from the command line with:
+    python batch_processing.py <root> [--workers N] [--num-zdots N]
+
+This module requires numpy. It also uses os, re, csv, time,
+traceback, argparse, joblib, concurrent.futures
+
+"""
+
+import os
+import re
+import csv
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import joblib
+
+import data_handling_functions
+import decomposed_case
+import streaming
+
+CASE_NAME_PATTERN = re.compile(
+    r'^Catalyst_P-(?P<porosity>[0-9.eE+-]+)_n-(?P<n>\d+)_nl-(?P<nl>\d+)_Re-(?P<Re>[0-9.eE+-]+)$'
+)
+RESULTS_FILE_NAME = 'PostProcessingResults.joblib'
+MESH_CACHE_NAME = 'MeshCache'
+
+
+def parse_case_name(case_name: str) -> dict:
+    """Get the parameters encoded in the name of a case folder
+
+    Parameters
+    ----------
+    case_name : str
+        Name of the case folder, e.g. 'Catalyst_P-0.15_n-7_nl-2_Re-20'
+
+    Returns
+    -------
+    dict or None
+        {"porosity": float, "n": int, "nl": int, "Re": float}, or None
+        if the name does not follow the pattern
+
+    """
+
+    match = CASE_NAME_PATTERN.match(os.path.basename(os.path.normpath(case_name)))
+    if match is None:
+        return None
+
+    return {"porosity": float(match["porosity"]),
+            "n": int(match["n"]),
+            "nl": int(match["nl"]),
+            "Re": float(match["Re"])}
+
+
+def discover_cases(root: str) -> list[str]:
+    """Find the case folders under a root folder
+
+    Parameters
+    ----------
+    root : str
+        Folder to search (recursively)
+
+    Returns
+    -------
+    list[str]
+        Paths of the case folders (ending in '/', as expected by
+        read_simulation_data), sorted
+
+    """
+
+    cases = []
+    for dirpath, dirnames, _ in os.walk(root):
+        for dirname in list(dirnames):
+            if CASE_NAME_PATTERN.match(dirname):
+                cases.append(os.path.join(dirpath, dirname, ''))
+                # Do not look inside cases
+                dirnames.remove(dirname)
+
+    return sorted(cases)
+
+
+def _input_files(   case_path: str,
+                    fluid_region_name: str,
+                    solid_region_name: str,
+                    momentum_simulation_folder: str,
+                    config_file_name: str
+                ) -> list[str]:
+    """Files the results of a case are computed from"""
+
+    _, field_files = data_handling_functions._select_case_files(
+        case_path, fluid_region_name, solid_region_name, momentum_simulation_folder, 'all',
+        verbose=False
+    )
+    files = [os.path.join(case_path, config_file_name)]
+    files += data_handling_functions._mesh_files(case_path, fluid_region_name)
+    files += data_handling_functions._mesh_files(case_path, solid_region_name)
+    for field_list in field_files.values():
+        for source in field_list:
+            files += decomposed_case.source_files(source)
+
+    return files
+
+
+def is_up_to_date(case_path: str, input_files: list[str]) -> bool:
+    """Check if the saved results of a case are newer than its inputs"""
+
+    results_file = os.path.join(case_path, RESULTS_FILE_NAME)
+    if not os.path.isfile(results_file):
+        return False
+
+    results_mtime = os.stat(results_file).st_mtime_ns
+    for fn in input_files:
+        if os.path.isfile(fn) and os.stat(fn).st_mtime_ns > results_mtime:
+            return False
+
+    return True
+
+
+def process_case(   case_path: str,
+                    num_zdots: int = 100,
+                    fluid_region_name: str = 'FluidRegion/',
+                    solid_region_name: str = 'CatalystRegion/',
+                    momentum_simulation_folder: str = 'MomentumSolution/',
+                    config_file_name: str = 'caseConfig.sh',
+                    force: bool = False,
+                    mesh_cache_dir: str = None
+                ) -> dict:
+    """Post-process one case and save its results in the case folder
+
+    Parameters
+    ----------
+    case_path : str
+        Relative path to the case folder
+    num_zdots : int
+        Number of points of the axial profiles
+    fluid_region_name, solid_region_name, momentum_simulation_folder,
+    config_file_name
+        As in read_simulation_data
+    force : bool
+        Process the case even if its saved results are up to date
+    mesh_cache_dir : str
+        Mesh cache directory, as in read_simulation_data
+
+    Returns
+    -------
+    row : dict
+        Results of the case: the CaseParameters fields, the
+        parameters in the case name, "case", "status" ('processed' or
+        'up to date'), the timesteps, the axial profiles
+        ("<field>_<profile>", shape (timesteps, num_zdots)) and
+        their "z_dots", the summaries of every field over time
+        ("<field>_min", "_max", "_mean") and their values in the last
+        timestep ("<field>_<summary>_last").
+
+    """
+
+    input_files = _input_files(case_path, fluid_region_name, solid_region_name,
+                               momentum_simulation_folder, config_file_name)
+    results_file = os.path.join(case_path, RESULTS_FILE_NAME)
+    if not force and is_up_to_date(case_path, input_files):
+        row = joblib.load(results_file)
+        if row.get("num_zdots") == num_zdots:
+            row["status"] = 'up to date'
+            return row
+
+    time1 = time.time()
+    params = data_handling_functions.load_case_properties(case_path, config_file_name)
+    reduced = streaming.reduce_case(case_path, None, num_zdots, fluid_region_name,
+                                    solid_region_name, momentum_simulation_folder,
+                                    mesh_cache_dir=mesh_cache_dir)
+
+    row = {"case": os.path.basename(os.path.normpath(case_path))}
+    row.update(params.as_dict())
+    row.update(parse_case_name(case_path) or {})
+    row["status"] = 'processed'
+    row["num_zdots"] = num_zdots
+    z_dots = reduced.pop("z_dots")
+    row["z_dots"] = z_dots["axial"]
+    row["z_dots_catalyst"] = z_dots["axial_catalyst"]
+    row["ThermalTimesteps"] = reduced["FluidTemperature"]["timesteps"]
+    row["MomentumTimesteps"] = reduced["StaticPressure"]["timesteps"]
+
+    for field, outputs in reduced.items():
+        for name, output in outputs.items():
+            if name == "timesteps":
+                continue
+            row[field + "_" + name] = output
+            if name in ("min", "max", "mean") and len(output) > 0:
+                row[field + "_" + name + "_last"] = output[-1]
+
+    # Pressure drop along the fluid region in the last timestep:
+    if len(row["StaticPressure_axial"]) > 0:
+        row["PressureDrop_last"] = row["StaticPressure_axial"][-1][0] - row["StaticPressure_axial"][-1][-1]
+    row["processing_time"] = time.time() - time1
+
+    joblib.dump(row, results_file)
+
+    return row
+
+
+def _process_case_safe(case_path: str, kwargs: dict) -> dict:
+    """process_case, returning the error in the row if it fails"""
+
+    try:
+        return process_case(case_path, **kwargs)
+    except Exception as error:
+        row = {"case": os.path.basename(os.path.normpath(case_path))}
+        row.update(parse_case_name(case_path) or {})
+        row["status"] = 'failed'
+        row["error"] = f"{type(error).__name__}: {error}"
+        row["traceback"] = traceback.format_exc()
+        return row
+
+
+def _is_scalar(value) -> bool:
+    return isinstance(value, (str, int, float, np.integer, np.floating))
+
+
+def write_table_csv(table: list[dict], filename: str):
+    """Write the scalar columns of a results table to a CSV file"""
+
+    columns = []
+    for row in table:
+        for key, value in row.items():
+            if key not in columns and key != "traceback" and _is_scalar(value):
+                columns.append(key)
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        for row in table:
+            writer.writerow({key: value for key, value in row.items() if key in columns and _is_scalar(value)})
+
+
+def run_batch(  root: str,
+                workers: int = None,
+                num_zdots: int = 100,
+                output_name: str = 'batch_results',
+                force: bool = False,
+                mesh_cache: bool = True,
+                **kwargs
+            ) -> list[dict]:
+    """Post-process all the cases of a campaign
+
+    Parameters
+    ----------
+    root : str
+        Folder with the case folders of the campaign
+    workers : int
+        Number of processes. By default (None) as many as CPUs.
+    num_zdots : int
+        Number of points of the axial profiles
+    output_name : str
+        The table is saved in root as <output_name>.joblib (complete)
+        and <output_name>.csv (scalar columns only). None to not
+        save it.
+    force : bool
+        Process all the cases, even if their results are up to date
+    mesh_cache : bool
+        Parse each distinct mesh only once for the whole campaign, 
+        keeping the parsed meshes in a mesh cache in 
+        root/<MESH_CACHE_NAME> (see mesh_cache.py module). Default 
+        True.
+    **kwargs
+        fluid_region_name, solid_region_name,
+        momentum_simulation_folder and config_file_name, as in
+        read_simulation_data
+
+    Returns
+    -------
+    table : list[dict]
+        One row per case, as returned by process_case. Rows of cases
+        that failed have status 'failed' and the "error".
+
+    """
+
+    cases = discover_cases(root)
+    case_kwargs = dict(kwargs, num_zdots=num_zdots, force=force)
+    if mesh_cache:
+        case_kwargs["mesh_cache_dir"] = os.path.join(root, MESH_CACHE_NAME)
+    if workers is None:
+        workers = os.cpu_count()
+
+    time1 = time.time()
+    if workers <= 1 or len(cases) <= 1:
+        table = [_process_case_safe(case, case_kwargs) for case in cases]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(cases))) as pool:
+            table = list(pool.map(_process_case_safe, cases, [case_kwargs]*len(cases)))
+
+    statuses = [row["status"] for row in table]
+    print("Cases processed: ", statuses.count('processed'),
+          ", up to date: ", statuses.count('up to date'),
+          ", failed: ", statuses.count('failed'),
+          " in ", time.time()-time1, " s")
+    for row in table:
+        if row["status"] == 'failed':
+            print("  ", row["case"], ": ", row["error"])
+
+    if output_name is not None:
+        joblib.dump(table, os.path.join(root, output_name + '.joblib'))
+        write_table_csv(table, os.path.join(root, output_name + '.csv'))
+
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-process all the cases of a campaign.")
+    parser.add_argument('root', help="folder with the case folders")
+    parser.add_argument('--workers', type=int, default=None, help="number of processes (default: all CPUs)")
+    parser.add_argument('--num-zdots', type=int, default=100, help="number of points of the axial profiles")
+    parser.add_argument('--output-name', default='batch_results', help="name of the result table files")
+    parser.add_argument('--force', action='store_true', help="process up to date cases again")
+    parser.add_argument('--no-mesh-cache', action='store_true', help="parse the mesh of every case")
+    args = parser.parse_args()
+
+    run_batch(args.root, args.workers, args.num_zdots, args.output_name, args.force,
+              not args.no_mesh_cache)
+
+
+if __name__ == '__main__':
+    main()
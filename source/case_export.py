@@ -0,0 +1,428 @@
+"""Case export module
+
+This module defines exporters of the data of a simulation (as read by
+read_simulation_data, data_handling_functions.py module) to formats
+that can be opened without this package or Ofpp: HDF5 with an XDMF
+descriptor (ParaView, VisIt, or any HDF5 library), and VTK XML
+unstructured grids (.vtu files and a .pvd collection per region).
+
+The HDF5 file has one group per mesh and one dataset per timestep of
+every field:
+
+    /<FluidMesh|SolidMesh>/points, topology, cell_centres, cell_volumes
+    /<field>/<timestep>
+
+The cells are exported as polyhedra built from the faces of the mesh
+(topology is the XDMF "Mixed" connectivity of the cells). Meshes
+without points and faces (e.g. read only from their C and V files)
+are exported as one vertex per cell, at the cell centres. The field
+datasets are chunked and written straight from the arrays of the
+data; the case parameters are attributes of the root group.
+
+The XDMF file has one temporal collection per field region (fluid,
+solid and momentum, see case_store.FIELD_REGIONS), whose grids refer
+to the datasets of the HDF5 file, so nothing is written twice.
+
+export_hdf5( data, 'case.h5' )                        # everything
+export_hdf5( data, 'T.h5', fields="FluidTemperature", timesteps="9" )
+export_vtk( data, 'case_vtk/' )
+
+This module requires numpy. It also uses os, xml and, for the HDF5
+files, h5py
+
+"""
+
+import os
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+import case_store
+import data_handling_functions
+import mesh_geometry
+
+# Cell types of XDMF (Mixed topology) and VTK:
+XDMF_POLYHEDRON = 16
+VTK_VERTEX = 1
+VTK_POLYHEDRON = 42
+
+
+def has_polyhedra(mesh) -> bool:
+    """Check if a mesh has the points and faces to export its cells as
+    polyhedra"""
+
+    has_faces = getattr(mesh, "face_offsets", None) is not None or getattr(mesh, "faces", None) is not None
+    return getattr(mesh, "points", None) is not None and getattr(mesh, "owner", None) is not None and has_faces
+
+
+def _cell_faces(mesh) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(cell, face, flipped) of every face of every cell, sorted by
+    cell. Faces point out of their owner, so they are flipped for
+    their neighbour."""
+
+    owner = np.asarray(mesh.owner)[:mesh.num_face]
+    neighbour = np.asarray(mesh.neighbour)[:mesh.num_inner_face]
+
+    cells = np.concatenate((owner, neighbour))
+    faces = np.concatenate((np.arange(mesh.num_face), np.arange(mesh.num_inner_face)))
+    flipped = np.concatenate((np.zeros(mesh.num_face, dtype=bool), np.ones(mesh.num_inner_face, dtype=bool)))
+    order = np.argsort(cells, kind='stable')
+
+    return cells[order], faces[order], flipped[order]
+
+
+def polyhedra(mesh, cell_header: tuple = ()) -> dict:
+    """Describe the cells of a mesh as polyhedra
+
+    The faces of every cell are written one after another, each one
+    as its number of points followed by its points (counterclockwise
+    seen from outside of the cell):
+
+        [*cell_header, number of faces, n_0, p_0_0, ..., n_1, p_1_0, ...]
+
+    This is the "faces" array of the VTK polyhedra and, with
+    cell_header=(XDMF_POLYHEDRON,), the XDMF Mixed topology. All
+    the cells are built at once, with no loops in Python.
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+        Mesh with points, faces, owner and neighbour
+    cell_header : tuple
+        Values written at the start of every cell
+
+    Returns
+    -------
+    dict
+        "stream" : the faces of all the cells, as above
+        "stream_ends" : end of every cell in stream, shape (cells,)
+        "connectivity" : points of every cell (each once), one cell
+            after another
+        "offsets" : end of every cell in connectivity, shape (cells,)
+
+    """
+
+    face_offsets, face_points = mesh_geometry.face_arrays(mesh)
+    cells, faces, flipped = _cell_faces(mesh)
+    num_cell = mesh.num_cell
+    num_point = mesh.num_point
+
+    lengths = np.diff(face_offsets)[faces]
+    faces_per_cell = np.bincount(cells, minlength=num_cell)
+    header = len(cell_header) + 1
+
+    # Position of every face and of every cell in the stream:
+    segments = lengths + 1
+    segment_starts = np.cumsum(segments) - segments
+    face_positions = segment_starts + header*(cells + 1)
+    first_face = np.cumsum(faces_per_cell) - faces_per_cell
+    cell_positions = segment_starts[first_face] + header*np.arange(num_cell)
+    stream = np.empty(int(segments.sum()) + header*num_cell, dtype=np.int64)
+
+    for i, value in enumerate(cell_header):
+        stream[cell_positions + i] = value
+    stream[cell_positions + header - 1] = faces_per_cell
+    stream[face_positions] = lengths
+
+    # Points of every face, reversed for the flipped ones:
+    face_of_point = np.repeat(np.arange(len(faces)), lengths)
+    j = np.arange(len(face_of_point)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    start = face_offsets[faces][face_of_point]
+    source = np.where(flipped[face_of_point], start + lengths[face_of_point] - 1 - j, start + j)
+    points = np.asarray(face_points)[source]
+    stream[face_positions[face_of_point] + 1 + j] = points
+
+    # Points of every cell, each once:
+    cell_points = np.unique(cells[face_of_point].astype(np.int64)*num_point + points)
+
+    return {"stream": stream,
+            "stream_ends": np.append(cell_positions[1:], len(stream)),
+            "connectivity": cell_points % num_point,
+            "offsets": np.cumsum(np.bincount(cell_points//num_point, minlength=num_cell))}
+
+
+def _select(data: dict,
+            fields=None,
+            timesteps=None
+        ) -> list[tuple]:
+    """Fields and timesteps to export, grouped by field region:
+    [(region, mesh key, [(timestep, index)], [fields])], without the
+    regions none of whose timesteps are selected"""
+
+    if fields is None:
+        fields = case_store.data_fields(data)
+    elif isinstance(fields, str):
+        fields = [fields]
+    if isinstance(timesteps, str):
+        timesteps = [timesteps]
+
+    groups = []
+    for region, (timesteps_key, mesh_key) in case_store.FIELD_REGIONS.items():
+        region_fields = [field for field in fields if case_store.field_region(field)[0] == region]
+        if len(region_fields) == 0:
+            continue
+        available = list(data[timesteps_key])
+        selected = available if timesteps is None else \
+            data_handling_functions.select_timesteps(available, timesteps=timesteps)
+        if len(selected) == 0:
+            continue
+        groups.append((region, mesh_key, [(ts, available.index(ts)) for ts in selected], region_fields))
+
+    return groups
+
+
+def _dataset_name(name: str) -> str:
+    """Name of a field as an HDF5 dataset ('/' is the separator of
+    groups)"""
+    return name.replace('/', ':')
+
+
+def _data_item(h5_name: str, path: str, array: np.ndarray) -> str:
+    """XDMF DataItem of a dataset of the HDF5 file"""
+
+    number_type = "Float" if array.dtype.kind == 'f' else "Int"
+    dimensions = " ".join(str(n) for n in array.shape)
+    return (f'<DataItem Dimensions="{dimensions}" NumberType="{number_type}" '
+            f'Precision="{array.dtype.itemsize}" Format="HDF">{h5_name}:{path}</DataItem>')
+
+
+def _attribute(name: str, data_item: str, shape: tuple) -> str:
+    attribute_type = "Vector" if len(shape) > 1 and shape[1] == 3 else "Scalar"
+    return (f'<Attribute Name={quoteattr(name)} AttributeType="{attribute_type}" Center="Cell">'
+            f'{data_item}</Attribute>')
+
+
+def export_hdf5(    data: dict,
+                    filename: str,
+                    fields=None,
+                    timesteps=None,
+                    compression: str = None
+                ) -> tuple[str, str]:
+    """Export the data of a simulation to HDF5, with an XDMF descriptor
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    filename : str
+        Path to the HDF5 file (e.g. 'case.h5'). The XDMF file is
+        written next to it, with extension .xdmf.
+    fields : str or list[str]
+        Field or fields to export. By default, all the fields of the
+        data.
+    timesteps : str or list[str]
+        Timestep or timesteps to export, matched as in
+        select_timesteps. By default, all of them. The fields of a
+        region (fluid, solid, momentum) with none of these timesteps
+        are not exported. Timesteps of a field stored as None
+        (missing field files) are skipped: the field is left out of
+        the grid of that timestep.
+    compression : str
+        Compression of the datasets, as in h5py (e.g. 'gzip' or
+        'lzf'). By default (None), not compressed.
+
+    Returns
+    -------
+    tuple[str, str]
+        Paths to the HDF5 and XDMF files
+
+    """
+
+    if h5py is None:
+        raise ImportError("h5py package required to export to HDF5")
+
+    groups = _select(data, fields, timesteps)
+    h5_name = os.path.basename(filename)
+    xdmf_filename = os.path.splitext(filename)[0] + '.xdmf'
+
+    grids = []
+    with h5py.File(filename, 'w') as f:
+        if "Parameters" in data and hasattr(data["Parameters"], "as_dict"):
+            for name, value in data["Parameters"].as_dict().items():
+                f.attrs[name] = value
+
+        # Meshes, once each:
+        mesh_items = {}
+        for mesh_key in dict.fromkeys(mesh_key for _, mesh_key, _, _ in groups):
+            mesh_items[mesh_key] = _write_mesh_hdf5(f, mesh_key, data[mesh_key], h5_name)
+
+        for region, mesh_key, selected, region_fields in groups:
+            steps = []
+            for timestep, index in selected:
+                attributes = []
+                for field in region_fields:
+                    values = data[field][index]
+                    if values is None:
+                        # Missing field file, left out of the grid
+                        continue
+                    values = np.ascontiguousarray(values)
+                    path = f'/{_dataset_name(field)}/{timestep}'
+                    f.create_dataset(path, data=values, chunks=True, compression=compression)
+                    attributes.append(_attribute(field, _data_item(h5_name, path, values), values.shape))
+                steps.append(f'<Grid Name="{region}_{timestep}" GridType="Uniform">'
+                             f'<Time Value="{float(timestep)!r}"/>{mesh_items[mesh_key]}'
+                             f'{"".join(attributes)}</Grid>')
+            grids.append(f'<Grid Name="{region}" GridType="Collection" CollectionType="Temporal">\n'
+                         + "\n".join(steps) + '\n</Grid>')
+
+    with open(xdmf_filename, 'w') as f:
+        f.write('<?xml version="1.0" ?>\n<Xdmf Version="3.0">\n<Domain>\n')
+        f.write("\n".join(grids))
+        f.write('\n</Domain>\n</Xdmf>\n')
+
+    return filename, xdmf_filename
+
+
+def _write_mesh_hdf5(f, mesh_key: str, mesh, h5_name: str) -> str:
+    """Write a mesh to an HDF5 file, return its XDMF Topology,
+    Geometry and volume Attribute"""
+
+    group = f.create_group(mesh_key)
+    cell_centres = np.ascontiguousarray(mesh.cell_centres)
+    cell_volumes = np.ascontiguousarray(mesh.cell_volumes)
+    group.create_dataset("cell_centres", data=cell_centres)
+    group.create_dataset("cell_volumes", data=cell_volumes)
+    num_cell = len(cell_volumes)
+
+    if has_polyhedra(mesh):
+        points = np.ascontiguousarray(mesh.points)
+        topology = polyhedra(mesh, (XDMF_POLYHEDRON,))["stream"]
+        group.create_dataset("points", data=points)
+        group.create_dataset("topology", data=topology)
+        items = (f'<Topology TopologyType="Mixed" NumberOfElements="{num_cell}">'
+                 f'{_data_item(h5_name, f"/{mesh_key}/topology", topology)}</Topology>'
+                 f'<Geometry GeometryType="XYZ">{_data_item(h5_name, f"/{mesh_key}/points", points)}</Geometry>')
+    else:
+        items = (f'<Topology TopologyType="Polyvertex" NumberOfElements="{num_cell}" NodesPerElement="1"/>'
+                 f'<Geometry GeometryType="XYZ">'
+                 f'{_data_item(h5_name, f"/{mesh_key}/cell_centres", cell_centres)}</Geometry>')
+
+    volumes_item = _data_item(h5_name, f"/{mesh_key}/cell_volumes", cell_volumes)
+    return items + _attribute("CellVolume", volumes_item, cell_volumes.shape)
+
+
+def _vtk_mesh_arrays(mesh) -> tuple[np.ndarray, list]:
+    """Points and cell arrays of the VTK unstructured grid of a mesh"""
+
+    if has_polyhedra(mesh):
+        cells = polyhedra(mesh)
+        num_cell = len(cells["offsets"])
+        return np.asarray(mesh.points, dtype=float), [
+            ("connectivity", cells["connectivity"]),
+            ("offsets", cells["offsets"]),
+            ("types", np.full(num_cell, VTK_POLYHEDRON, dtype=np.uint8)),
+            ("faces", cells["stream"]),
+            ("faceoffsets", cells["stream_ends"]),
+        ]
+
+    num_cell = len(mesh.cell_volumes)
+    return np.asarray(mesh.cell_centres, dtype=float), [
+        ("connectivity", np.arange(num_cell, dtype=np.int64)),
+        ("offsets", np.arange(1, num_cell + 1, dtype=np.int64)),
+        ("types", np.full(num_cell, VTK_VERTEX, dtype=np.uint8)),
+    ]
+
+
+# VTK names of the numpy types:
+_VTK_TYPES = {"float32": "Float32", "float64": "Float64", "int32": "Int32", "int64": "Int64", "uint8": "UInt8"}
+
+
+def _write_vtu(filename: str, points: np.ndarray, cell_arrays: list, cell_data: list):
+    """Write a VTK XML unstructured grid, with all the arrays appended
+    as raw binary (each one after its size, as UInt64)"""
+
+    arrays = [points] + [array for _, array in cell_arrays] + [array for _, array in cell_data]
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    offsets = np.cumsum([0] + [8 + array.nbytes for array in arrays])
+
+    def data_array(name, array, offset):
+        components = f' NumberOfComponents="{array.shape[1]}"' if array.ndim > 1 else ''
+        return (f'<DataArray type="{_VTK_TYPES[array.dtype.name]}" Name={quoteattr(name)}{components} '
+                f'format="appended" offset="{offset}"/>\n')
+
+    num_cell = len(dict(cell_arrays)["types"])
+    header = ['<?xml version="1.0"?>\n',
+              '<VTKFile type="UnstructuredGrid" version="1.0" byte_order="LittleEndian" header_type="UInt64">\n',
+              f'<UnstructuredGrid>\n<Piece NumberOfPoints="{len(points)}" NumberOfCells="{num_cell}">\n',
+              '<Points>\n', data_array("Points", arrays[0], offsets[0]), '</Points>\n<Cells>\n']
+    for i, (name, _) in enumerate(cell_arrays):
+        header.append(data_array(name, arrays[1 + i], offsets[1 + i]))
+    header.append('</Cells>\n<CellData>\n')
+    for i, (name, _) in enumerate(cell_data):
+        header.append(data_array(name, arrays[1 + len(cell_arrays) + i], offsets[1 + len(cell_arrays) + i]))
+    header.append('</CellData>\n</Piece>\n</UnstructuredGrid>\n<AppendedData encoding="raw">\n_')
+
+    with open(filename, 'wb') as f:
+        f.write("".join(header).encode())
+        for array in arrays:
+            f.write(np.uint64(array.nbytes).tobytes())
+            f.write(array.data if array.flags.c_contiguous else array.tobytes())
+        f.write(b'\n</AppendedData>\n</VTKFile>\n')
+
+
+def export_vtk(     data: dict,
+                    folder: str,
+                    fields=None,
+                    timesteps=None
+                ) -> list[str]:
+    """Export the data of a simulation to VTK XML files
+
+    For every field region (fluid, solid, momentum) and timestep, an
+    unstructured grid <folder>/<region>_<timestep>.vtu is written with
+    the mesh and the fields of the timestep as cell data (and the
+    volume of the cells, CellVolume), and every region gets a
+    collection <folder>/<region>.pvd with all its timesteps.
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    folder : str
+        Path to the output folder. It is created if it does not exist.
+    fields, timesteps
+        As in export_hdf5. Timesteps of a field stored as None are
+        left out of the .vtu of that timestep.
+
+    Returns
+    -------
+    list[str]
+        Paths to the .pvd files
+
+    """
+
+    os.makedirs(folder, exist_ok=True)
+    groups = _select(data, fields, timesteps)
+
+    mesh_arrays = {}
+    collections = []
+    for region, mesh_key, selected, region_fields in groups:
+        if mesh_key not in mesh_arrays:
+            mesh_arrays[mesh_key] = _vtk_mesh_arrays(data[mesh_key])
+        points, cell_arrays = mesh_arrays[mesh_key]
+        cell_volumes = np.asarray(data[mesh_key].cell_volumes)
+
+        datasets = []
+        for timestep, index in selected:
+            vtu_name = f'{region}_{timestep}.vtu'
+            cell_data = [(field, data[field][index]) for field in region_fields]
+            # Missing field files (None) are left out of the .vtu
+            cell_data = [(field, np.asarray(values)) for field, values in cell_data if values is not None]
+            _write_vtu(os.path.join(folder, vtu_name), points, cell_arrays,
+                       cell_data + [("CellVolume", cell_volumes)])
+            datasets.append(f'<DataSet timestep="{float(timestep)!r}" file={quoteattr(vtu_name)}/>')
+
+        pvd_filename = os.path.join(folder, f'{region}.pvd')
+        with open(pvd_filename, 'w') as f:
+            f.write('<?xml version="1.0"?>\n<VTKFile type="Collection" version="1.0">\n<Collection>\n')
+            f.write("\n".join(datasets))
+            f.write('\n</Collection>\n</VTKFile>\n')
+        collections.append(pvd_filename)
+
+    return collections
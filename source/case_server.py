@@ -0,0 +1,623 @@
+"""Case server module
+
+This module defines a local server that holds the data of simulations
+in shared memory, so that several processes on the same host (e.g.
+the notebooks of several analysts) use one copy of a case instead of
+loading it each.
+
+The server loads nothing when it starts. A case (joblib file or case
+store, as saved by read_simulation_data) is loaded when it is first
+requested, and each of its fields is copied to a shared memory block,
+with all its timesteps stacked in one array (timesteps, cells), when
+it is first requested. The cell centres and volumes of the meshes are
+shared as well. Cases without requests for idle_timeout seconds are
+evicted: their blocks are unlinked, so their memory is freed as soon
+as the clients that attached to them let them go.
+
+Clients talk to the server through a local socket
+(multiprocessing.connection). By default it is in a folder only the
+user can access (XDG_RUNTIME_DIR, or a folder of the temporary
+directory named after the user id), so sharing is single-user: each
+user runs their own server. The shared memory blocks are created
+with mode 0600 as well, so the processes of other users could not
+attach to them anyway. They can attach to the arrays of a case
+as read-only numpy views of the shared memory (no copies), or ask the
+server for reductions, so that only the result is sent: axial
+averages, values at some points, and slices of a timestep.
+
+data = CaseClient().open_case('Case_P0.15_Re20.0_DATA.joblib')
+z_dots, avg_T = post_processing_functions.getAvg_T_justFluid( data, 100 )
+
+A RemoteCase can be used wherever the data dict is. If no server is
+running, the client starts one (in the background, with the default
+options).
+
+Run the server from the command line with:
+    python case_server.py [--address PATH] [--idle-timeout S]
+
+This module requires numpy. It also uses os, sys, stat, time,
+tempfile, argparse, threading, subprocess, multiprocessing
+
+"""
+
+import os
+import sys
+import stat
+import time
+import tempfile
+import argparse
+import threading
+import subprocess
+from multiprocessing import connection, resource_tracker, shared_memory
+from collections.abc import Mapping
+
+import numpy as np
+
+import case_store
+import data_handling_functions
+import post_processing_functions
+import spatial_index
+
+
+def _default_address() -> str:
+    """Address of the server of this user: a Unix socket in
+    XDG_RUNTIME_DIR or, if it is not set, in a folder of the temporary
+    directory named after the user id"""
+
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'catalyst_case_server.sock')
+    return os.path.join(tempfile.gettempdir(), f'catalyst_case_server-{os.getuid()}', 'server.sock')
+
+
+# Default address of the server (a Unix socket, private to the user):
+DEFAULT_ADDRESS = _default_address()
+
+# Default time after which a case without requests is evicted [s]:
+DEFAULT_IDLE_TIMEOUT = 1800.0
+
+# Mesh arrays shared with the clients:
+SHARED_MESH_ARRAYS = ("cell_centres", "cell_volumes")
+
+# Names of the shared memory blocks created by a server in this process:
+_created_blocks = set()
+
+
+def _check_address(address: str):
+    """Check that only this user can access the folder of the default
+    address (creating it if needed), so that no other user can put a
+    server of their own there
+
+    Other addresses are left to the caller (see the authkey of
+    CaseServer).
+
+    """
+
+    if address != DEFAULT_ADDRESS:
+        return
+
+    folder = os.path.dirname(address)
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    info = os.lstat(folder)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"{folder} must be a folder that only this user can access")
+
+
+def _new_shared_array(  shape: tuple,
+                        dtype
+                    ) -> tuple[shared_memory.SharedMemory, np.ndarray, dict]:
+    """Create a shared memory block for an array, return the block, the
+    array and the description a client needs to attach to it"""
+
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape))*dtype.itemsize, 1))
+    array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    _created_blocks.add(block.name)
+
+    return block, array, {"name": block.name, "shape": tuple(shape), "dtype": dtype.str}
+
+
+def _attach(description: dict) -> tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Attach to a shared array, as a read-only view"""
+
+    try:
+        block = shared_memory.SharedMemory(name=description["name"], track=False)
+    except TypeError:
+        # Before Python 3.13 attached blocks are tracked too, and
+        # unlinked when the client exits (unless the server is in this
+        # process, and tracks them already)
+        block = shared_memory.SharedMemory(name=description["name"])
+        if block.name not in _created_blocks:
+            resource_tracker.unregister(block._name, "shared_memory")
+
+    array = np.ndarray(description["shape"], dtype=np.dtype(description["dtype"]), buffer=block.buf)
+    array.flags.writeable = False
+
+    return block, array
+
+
+class _ServedCase:
+    """Data of a case held by the server, with its fields in shared
+    memory"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = data_handling_functions.load_simulation_data(path)
+        self.fields = {}
+        self.blocks = []
+        self.descriptions = {}
+        self.last_access = time.monotonic()
+        self.active = 0
+
+        self.meshes = {}
+        for mesh_key in case_store.MESH_KEYS:
+            mesh = self.data.get(mesh_key)
+            if mesh is None:
+                continue
+            self.meshes[mesh_key] = {}
+            for name in SHARED_MESH_ARRAYS:
+                values = np.asarray(getattr(mesh, name))
+                block, array, description = _new_shared_array(values.shape, values.dtype)
+                array[...] = values
+                self.blocks.append(block)
+                self.meshes[mesh_key][name] = description
+
+    def field(self, field: str) -> np.ndarray:
+        """All the timesteps of a field, in shared memory"""
+
+        if field not in self.fields:
+            if field not in case_store.data_fields(self.data):
+                raise KeyError(f"{self.path} has no field {field}")
+            timesteps = self.data[field]
+            if len(timesteps) > 0:
+                first = np.asarray(timesteps[0])
+                shape, dtype = (len(timesteps),) + first.shape, first.dtype
+            else:
+                mesh_key = case_store.field_keys(field)[1]
+                shape, dtype = (0, len(self.data[mesh_key].cell_volumes)), np.float64
+
+            # Copied one timestep at a time, with no stacked copy
+            block, array, description = _new_shared_array(shape, dtype)
+            for ts, values in enumerate(timesteps):
+                array[ts] = values
+            self.blocks.append(block)
+            self.descriptions[field] = description
+            self.fields[field] = array
+            # The private copy is no longer needed
+            self.data[field] = array
+
+        return self.fields[field]
+
+    def info(self) -> dict:
+        return {"Parameters": self.data.get("Parameters"),
+                "ThermalTimesteps": list(self.data["ThermalTimesteps"]),
+                "MomentumTimesteps": list(self.data["MomentumTimesteps"]),
+                "fields": case_store.data_fields(self.data),
+                "meshes": self.meshes}
+
+    def release(self):
+        """Unlink the shared memory blocks of the case"""
+
+        self.fields.clear()
+        self.data = None
+        for block in self.blocks:
+            _created_blocks.discard(block.name)
+            block.unlink()
+            try:
+                block.close()
+            except BufferError:
+                # Still used by a request, unmapped when it ends
+                pass
+        self.blocks = []
+
+
+class CaseServer:
+    """Server of the data of simulations in shared memory.
+
+    Attributes
+    ----------
+    address : str
+        Address of the socket
+    idle_timeout : float
+        Time after which a case without requests is evicted [s]
+
+    Methods
+    -------
+    serve_forever(self)
+        Accept and answer requests until a shutdown request.
+    evict_idle(self)
+        Evict the cases without requests for idle_timeout.
+    shutdown(self)
+        Stop serving and release all the cases.
+
+    """
+
+    def __init__(   self,
+                    address: str = DEFAULT_ADDRESS,
+                    authkey: bytes = None,
+                    idle_timeout: float = DEFAULT_IDLE_TIMEOUT
+                ):
+        """
+        Parameters
+        ----------
+        address : str
+            Address of the socket. A stale socket file (left by a
+            server that did not stop cleanly) is replaced, but if a
+            server is running at address, a RuntimeError is raised.
+            The folder of the default address is checked to be
+            private to the user (PermissionError otherwise).
+        authkey : bytes
+            Key the clients must have, as in
+            multiprocessing.connection. By default (None), any local
+            process allowed to open the socket file can connect, so
+            an address other than the default one must be in a
+            folder that other users cannot write to, or have an
+            authkey.
+        idle_timeout : float
+            Time after which a case without requests is evicted [s]
+        """
+        self.address = address
+        self.idle_timeout = idle_timeout
+        self._authkey = authkey
+        self._cases = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._running = False
+
+        _check_address(address)
+        if os.path.exists(address):
+            try:
+                connection.Client(address, family='AF_UNIX', authkey=authkey).close()
+            except ConnectionRefusedError:
+                # Nobody listening: left by a server that did not stop
+                os.remove(address)
+            except (OSError, EOFError, connection.AuthenticationError):
+                raise RuntimeError(f"{address} is in use by another process")
+            else:
+                raise RuntimeError(f"A case server is already running at {address}")
+        self._listener = connection.Listener(address, family='AF_UNIX', authkey=authkey)
+
+    def _case(self, path: str) -> _ServedCase:
+        """Get a case, loading it if needed, and mark it as active
+
+        The case is loaded holding only its own lock, so the requests
+        for other cases are answered meanwhile, and concurrent
+        requests for it wait for a single load."""
+
+        path = os.path.abspath(path)
+        with self._lock:
+            case = self._cases.get(path)
+            if case is not None:
+                case.active += 1
+                case.last_access = time.monotonic()
+                return case
+            load_lock = self._loading.setdefault(path, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                case = self._cases.get(path)
+                if case is not None:
+                    # Loaded by another request meanwhile
+                    case.active += 1
+                    case.last_access = time.monotonic()
+                    return case
+            try:
+                case = _ServedCase(path)
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(path, None)
+                raise
+            with self._lock:
+                self._loading.pop(path, None)
+                if self._listener is None:
+                    # Shut down while loading
+                    case.release()
+                    raise RuntimeError("The case server is shutting down")
+                case.active += 1
+                case.last_access = time.monotonic()
+                self._cases[path] = case
+
+        return case
+
+    def _done(self, case: _ServedCase):
+        with self._lock:
+            case.active -= 1
+            case.last_access = time.monotonic()
+
+    def evict_idle(self) -> list[str]:
+        """Evict the cases without requests for idle_timeout
+
+        Returns
+        -------
+        list[str]
+            Paths of the cases evicted
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = [path for path, case in self._cases.items()
+                    if case.active == 0 and now - case.last_access > self.idle_timeout]
+            for path in idle:
+                self._cases.pop(path).release()
+
+        return idle
+
+    def handle(self, request: dict):
+        """Answer a request, a dict with the operation ("op"), the path
+        to the case ("case") and the arguments of the operation"""
+
+        op = request["op"]
+        if op == "status":
+            with self._lock:
+                return {path: {"fields": list(case.fields), "idle": time.monotonic() - case.last_access}
+                        for path, case in self._cases.items()}
+
+        case = self._case(request["case"])
+        try:
+            if op == "info":
+                return case.info()
+            if op == "attach":
+                case.field(request["field"])
+                return case.descriptions[request["field"]]
+
+            field = case.field(request["field"])
+            mesh = case.data[case_store.field_keys(request["field"])[1]]
+            if op == "average":
+                averager = post_processing_functions.get_axial_averager(
+                    mesh, request["num_zdots"], request.get("z_range"), request.get("chunk_size"))
+                if field.ndim == 3:
+                    # Vector fields: every component, shape (timesteps, 3, num_zdots)
+                    return averager.z_dots, np.stack([averager.average(field[:, :, i]) for i in range(3)],
+                                                     axis=1)
+                return averager.z_dots, averager.average(field)
+            if op == "probe":
+                return spatial_index.get_cell_locator(mesh).probe(field, request["points"],
+                                                                  request.get("max_distance"))
+            if op == "slice":
+                timesteps = [float(ts) for ts in case.data[case_store.field_keys(request["field"])[0]]]
+                values = field[timesteps.index(float(request["timestep"]))]
+                cells = request.get("cells")
+                return np.array(values if cells is None else values[cells])
+        finally:
+            self._done(case)
+
+        raise ValueError(f"Unknown operation {op!r}")
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if request.get("op") == "shutdown":
+                    conn.send({"ok": True, "result": None})
+                    self.shutdown()
+                    return
+                try:
+                    conn.send({"ok": True, "result": self.handle(request)})
+                except Exception as e:
+                    conn.send({"ok": False, "error": f"{type(e).__name__}: {e}",
+                               "type": type(e).__name__})
+
+    def _evict_loop(self):
+        while self._running:
+            time.sleep(min(max(self.idle_timeout/4, 0.1), 30.0))
+            self.evict_idle()
+
+    def serve_forever(self):
+        """Accept connections (one thread each) until a shutdown
+        request"""
+        listener = self._listener
+        self._running = True
+        threading.Thread(target=self._evict_loop, daemon=True).start()
+        try:
+            while self._running:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, connection.AuthenticationError):
+                    continue
+                if not self._running:
+                    conn.close()
+                    break
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Stop serving and release all the cases"""
+        with self._lock:
+            if self._listener is None:
+                return
+            listener, self._listener = self._listener, None
+            serving, self._running = self._running, False
+            for case in self._cases.values():
+                case.release()
+            self._cases.clear()
+        if serving:
+            # Wake up serve_forever, waiting for a connection
+            try:
+                connection.Client(self.address, family='AF_UNIX', authkey=self._authkey).close()
+            except (OSError, EOFError, connection.AuthenticationError):
+                pass
+        # Also removes the socket file
+        listener.close()
+
+
+class SharedMesh:
+    """Mesh of a case served by a CaseServer, with its cell centres
+    and volumes as views of the shared memory (enough for the
+    averages, profiles and probes of this package)"""
+
+    def __init__(self, arrays: dict):
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.num_cell = len(self.cell_volumes)
+        self.points = None
+
+
+class RemoteCase(Mapping):
+    """Data of a case served by a CaseServer.
+
+    It has the keys of the data dict (see read_simulation_data). The
+    fields are attached when they are first accessed: data[field] is
+    a read-only array of shape (timesteps, cells) or (timesteps,
+    cells, 3) in shared memory, so data[field][ts] is a timestep as
+    in the data dict.
+
+    Methods
+    -------
+    average(self, field, num_zdots, z_range=None)
+        Axial averages computed by the server.
+    probe(self, field, points, max_distance=None)
+        Values at some points, found by the server.
+    field_slice(self, field, timestep, cells=None)
+        Values of some cells in a timestep, sent by the server.
+
+    """
+
+    def __init__(self, client: "CaseClient", path: str):
+        self._client = client
+        self.path = os.path.abspath(path)
+        info = client.request("info", case=self.path)
+        self._blocks = []
+        self._data = {"Parameters": info["Parameters"],
+                      "ThermalTimesteps": info["ThermalTimesteps"],
+                      "MomentumTimesteps": info["MomentumTimesteps"]}
+        for mesh_key, descriptions in info["meshes"].items():
+            arrays = {}
+            for name, description in descriptions.items():
+                block, arrays[name] = _attach(description)
+                self._blocks.append(block)
+            self._data[mesh_key] = SharedMesh(arrays)
+        self._fields = list(info["fields"])
+
+    def __getitem__(self, key):
+        if key not in self._data and key in self._fields:
+            block, self._data[key] = _attach(self._client.request("attach", case=self.path, field=key))
+            self._blocks.append(block)
+        return self._data[key]
+
+    def __iter__(self):
+        yield from (key for key in self._data if key not in self._fields)
+        yield from self._fields
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+    def __repr__(self) -> str:
+        return f"RemoteCase({self.path!r}, fields={self._fields})"
+
+    def average(self, field: str, num_zdots: int, z_range: tuple[float, float] = None):
+        """z_dots and axial averages of a field, as the getAvg_*
+        functions"""
+        return self._client.request("average", case=self.path, field=field, num_zdots=num_zdots,
+                                    z_range=z_range)
+
+    def probe(self, field: str, points: np.ndarray, max_distance: float = None) -> np.ndarray:
+        """Values of a field at some points, as CellLocator.probe"""
+        return self._client.request("probe", case=self.path, field=field,
+                                    points=np.asarray(points, dtype=float), max_distance=max_distance)
+
+    def field_slice(self, field: str, timestep: str, cells: np.ndarray = None) -> np.ndarray:
+        """Values of some cells (all by default) of a timestep of a
+        field"""
+        return self._client.request("slice", case=self.path, field=field, timestep=timestep, cells=cells)
+
+
+class CaseClient:
+    """Client of a CaseServer.
+
+    Methods
+    -------
+    request(self, op, **arguments)
+        Send a request and return its result.
+    open_case(self, path) -> RemoteCase
+        Get the data of a case from the server.
+
+    """
+
+    def __init__(   self,
+                    address: str = DEFAULT_ADDRESS,
+                    authkey: bytes = None,
+                    start_server: bool = True,
+                    timeout: float = 10.0
+                ):
+        """
+        Connect to a server, starting it if it is not running.
+
+        Parameters
+        ----------
+        address : str
+            Address of the server. The folder of the default address
+            is checked to be private to the user (PermissionError
+            otherwise), since the responses of the server are
+            unpickled.
+        authkey : bytes
+            As in CaseServer
+        start_server : bool
+            If no server is running at address, start one in the
+            background (True, default) or raise ConnectionError.
+        timeout : float
+            Time to wait for a server just started [s]
+        """
+        self.address = address
+        self._lock = threading.Lock()
+        _check_address(address)
+        try:
+            self._conn = connection.Client(address, family='AF_UNIX', authkey=authkey)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not start_server:
+                raise ConnectionError(f"No case server at {address}")
+            start_server_process(address)
+            self._conn = _wait_for_server(address, authkey, timeout)
+
+    def request(self, op: str, **arguments):
+        with self._lock:
+            self._conn.send({"op": op, **arguments})
+            response = self._conn.recv()
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def open_case(self, path: str) -> RemoteCase:
+        return RemoteCase(self, path)
+
+    def close(self):
+        self._conn.close()
+
+
+def start_server_process(   address: str = DEFAULT_ADDRESS,
+                            idle_timeout: float = DEFAULT_IDLE_TIMEOUT
+                        ) -> subprocess.Popen:
+    """Start a server in a new background process (without an
+    authkey), which outlives the process that started it"""
+
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--address', address,
+                             '--idle-timeout', str(idle_timeout)],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+
+def _wait_for_server(address: str, authkey: bytes, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return connection.Client(address, family='AF_UNIX', authkey=authkey)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise ConnectionError(f"The case server at {address} did not start")
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the data of simulations in shared memory.")
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help="path to the socket")
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="evict the cases without requests for this time [s]")
+    args = parser.parse_args()
+
+    CaseServer(args.address, idle_timeout=args.idle_timeout).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
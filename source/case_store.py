@@ -0,0 +1,689 @@
+"""Case store module
+
+This module defines a columnar on-disk format for the data extracted
+from a simulation by read_simulation_data (data_handling_functions.py
+module), as an alternative to the single joblib file.
+
+The joblib file is one pickled dict, so reading any field means
+unpickling all of them, meshes included. A case store is a directory
+in which every array is saved in its own .npy file:
+
+    <store>/manifest.json
+    <store>/meshes/<FluidMesh|SolidMesh>/<array>.npy
+    <store>/fields/<field>/<timestep>.npy
+
+The manifest is a small JSON file with the case parameters, the
+timesteps and the names of the array files. Meshes taken from a mesh
+cache (mesh_cache.py module) are not copied in the store, the
+manifest refers to them. Arrays are opened with
+numpy memory maps, so reading one timestep of one field only reads
+the pages of that array from disk.
+
+Every timestep of a field is a contiguous array of shape (N,) for
+scalar fields or (N, 3) for vector fields, N being the number of
+cells of its mesh (uniform fields are expanded to all the cells), in
+float64 or, to halve the size, float32. Field arrays can also be
+compressed one by one, with zlib or, if the lz4 package is installed,
+lz4 (<timestep>.npy.zlib, <timestep>.npy.lz4). Compressed arrays
+are smaller but are read into memory instead of memory-mapped.
+
+This module requires numpy and Ofpp. It also uses os, io, json, zlib
+and, optionally, lz4
+
+"""
+
+import os
+import io
+import json
+import zlib
+
+import numpy as np
+from Ofpp.mesh_parser import Boundary
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+import data_handling_functions
+
+MANIFEST_NAME = 'manifest.json'
+CACHED_MESH_ENTRY_NAME = 'mesh.json'
+# Version 2: field arrays may be compressed
+STORE_FORMAT_VERSION = 2
+
+# Meshes of the case, and fields with the key of their timesteps:
+MESH_KEYS = ("FluidMesh", "SolidMesh")
+FIELD_TIMESTEPS = {
+    "FluidTemperature": "ThermalTimesteps",
+    "SolidTemperature": "ThermalTimesteps",
+    "StaticPressure": "MomentumTimesteps",
+    "VelocityField": "MomentumTimesteps",
+}
+# Region and file name of every field. The timesteps of the fluid and
+# solid regions are those of the thermal simulation, the momentum
+# simulation is solved on the fluid mesh.
+FIELD_FILES = {
+    "FluidTemperature": ("fluid", "T"),
+    "SolidTemperature": ("solid", "T"),
+    "StaticPressure": ("momentum", "static(p)"),
+    "VelocityField": ("momentum", "U"),
+}
+FIELD_REGIONS = {
+    "fluid": ("ThermalTimesteps", "FluidMesh"),
+    "solid": ("ThermalTimesteps", "SolidMesh"),
+    "momentum": ("MomentumTimesteps", "FluidMesh"),
+}
+# Keys of the data of a simulation that are not fields:
+_DATA_KEYS = ("Parameters",) + MESH_KEYS + ("MomentumTimesteps", "ThermalTimesteps")
+FIELD_DTYPES = ("float64", "float32")
+
+# Compressors of field arrays, {name: (file extension, compress,
+# decompress)}. Only those whose package is installed.
+COMPRESSIONS = ("zlib", "lz4")
+COMPRESSORS = {"zlib": ('.zlib', lambda data: zlib.compress(data, 1), zlib.decompress)}
+if lz4_frame is not None:
+    COMPRESSORS["lz4"] = ('.lz4', lz4_frame.compress, lz4_frame.decompress)
+
+# Mesh arrays stored as they are. Faces are stored as a flat array of
+# point labels plus the offsets of each face in it.
+_MESH_ARRAYS = ("points", "owner", "neighbour", "cell_centres", "cell_volumes")
+
+
+class StoredMesh:
+    """Mesh read from a case store.
+
+    Holds the same data as the Ofpp.FoamMesh saved in the store,
+    with every array memory-mapped from its .npy file. It can be used
+    wherever the post-processing functions expect a FoamMesh.
+
+    Attributes
+    ----------
+    points : numpy.ndarray
+        Coordinates of the points of the mesh, shape (num_point, 3)
+    face_offsets : numpy.ndarray
+        Start of every face in face_points, plus the total length,
+        shape (num_face+1,)
+    face_points : numpy.ndarray
+        Point labels of all the faces, one face after another
+    owner : numpy.ndarray
+        Owner cell of every face
+    neighbour : numpy.ndarray
+        Neighbour cell of every face. As in Ofpp, boundary faces
+        have the (negative) id of their boundary patch.
+    cell_centres : numpy.ndarray
+        Coordinates of the centre of every cell, shape (num_cell, 3)
+    cell_volumes : numpy.ndarray
+        Volume of every cell, shape (num_cell,)
+    boundary : dict
+        Boundary patches, as in Ofpp ({name: Boundary(type, num,
+        start, id)}, with names and types as bytes)
+    num_point, num_face, num_inner_face, num_cell : int
+        Sizes of the mesh
+
+    Methods
+    -------
+    faces -> list[numpy.ndarray]
+        Point labels of every face, as in Ofpp.FoamMesh.faces
+        (built on first access)
+
+    """
+
+    def __init__(   self,
+                    store_path: str,
+                    mesh_manifest: dict,
+                    mmap_mode: str = 'r'
+                ):
+        """
+        Open the arrays of a mesh of a case store.
+
+        Parameters
+        ----------
+        store_path : str
+            Path to the case store directory
+        mesh_manifest : dict
+            Entry of the mesh in the manifest of the store
+        mmap_mode : str
+            Memory-map mode passed to numpy.load (default 'r'). None
+            reads the arrays into memory.
+        """
+        self.path = store_path
+        for name in _MESH_ARRAYS + ("face_offsets", "face_points"):
+            filename = mesh_manifest["arrays"].get(name)
+            array = None
+            if filename is not None:
+                array = np.load(os.path.join(store_path, filename), mmap_mode=mmap_mode)
+            setattr(self, name, array)
+
+        self.boundary = {
+            name.encode(): Boundary(patch["type"].encode(), patch["num"], patch["start"], patch["id"])
+            for name, patch in mesh_manifest["boundary"].items()
+        }
+        self.num_point = mesh_manifest["num_point"]
+        self.num_face = mesh_manifest["num_face"]
+        self.num_inner_face = mesh_manifest["num_inner_face"]
+        self.num_cell = mesh_manifest["num_cell"]
+        self._faces = None
+
+    @property
+    def faces(self) -> list:
+        if self._faces is None and self.face_offsets is not None:
+            self._faces = np.split(np.asarray(self.face_points), np.asarray(self.face_offsets)[1:-1])
+        return self._faces
+
+
+class CachedMesh(StoredMesh):
+    """Mesh of a mesh cache (mesh_cache.py module).
+
+    A StoredMesh whose arrays are in a mesh cache shared by many
+    cases. When pickled (e.g. in the joblib file of
+    read_simulation_data) only its location in the cache is saved,
+    not its arrays; it is opened from the cache again when unpickled.
+
+    Attributes
+    ----------
+    cache_dir : str
+        Absolute path to the mesh cache directory
+    key : str
+        Key of the mesh in the cache (hash of its files)
+
+    """
+
+    def __init__(   self,
+                    cache_dir: str,
+                    key: str,
+                    mmap_mode: str = 'r'
+                ):
+        """
+        Open a mesh of a mesh cache.
+
+        Parameters
+        ----------
+        cache_dir : str
+            Path to the mesh cache directory
+        key : str
+            Key of the mesh in the cache
+        mmap_mode : str
+            Memory-map mode passed to numpy.load (default 'r')
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.key = key
+        self.mmap_mode = mmap_mode
+        with open(cached_mesh_entry(self.cache_dir, key)) as f:
+            mesh_manifest = json.load(f)
+        super().__init__(self.cache_dir, mesh_manifest, mmap_mode)
+
+    def __reduce__(self):
+        return (self.__class__, (self.cache_dir, self.key, self.mmap_mode))
+
+
+def cached_mesh_entry(cache_dir: str, key: str) -> str:
+    """Path to the manifest entry of a mesh of a mesh cache"""
+
+    return os.path.join(cache_dir, 'meshes', key, CACHED_MESH_ENTRY_NAME)
+
+
+def open_mesh(store_path: str, mesh_manifest: dict, mmap_mode: str = 'r') -> StoredMesh:
+    """Open a mesh of a case store, saved in it or in a mesh cache"""
+
+    if "cache_key" in mesh_manifest:
+        return CachedMesh(mesh_manifest["cache_dir"], mesh_manifest["cache_key"], mmap_mode)
+
+    return StoredMesh(store_path, mesh_manifest, mmap_mode)
+
+
+def _mesh_arrays(mesh) -> dict:
+    """Get the arrays to store from a FoamMesh (or StoredMesh)"""
+
+    arrays = {}
+    for name in _MESH_ARRAYS:
+        value = getattr(mesh, name, None)
+        if value is not None:
+            arrays[name] = np.asarray(value)
+
+    if isinstance(mesh, StoredMesh):
+        if mesh.face_offsets is not None:
+            arrays["face_offsets"] = np.asarray(mesh.face_offsets)
+            arrays["face_points"] = np.asarray(mesh.face_points)
+    elif getattr(mesh, "faces", None) is not None:
+        lengths = np.fromiter((len(face) for face in mesh.faces), dtype=np.int64, count=len(mesh.faces))
+        arrays["face_offsets"] = np.concatenate(([0], np.cumsum(lengths)))
+        arrays["face_points"] = np.fromiter(
+            (label for face in mesh.faces for label in face), dtype=np.int32, count=int(lengths.sum())
+        )
+
+    for name in ("owner", "neighbour", "face_points"):
+        if name in arrays:
+            arrays[name] = arrays[name].astype(np.int32, copy=False)
+
+    return arrays
+
+
+def _write_mesh(store_path: str, key: str, mesh) -> dict:
+    """Save the arrays of a mesh and return its manifest entry
+
+    Meshes of a mesh cache are not copied, the entry refers to them.
+
+    """
+
+    if isinstance(mesh, CachedMesh):
+        return {"cache_dir": mesh.cache_dir, "cache_key": mesh.key}
+
+    mesh_dir = os.path.join('meshes', key)
+    os.makedirs(os.path.join(store_path, mesh_dir), exist_ok=True)
+
+    files = {}
+    for name, array in _mesh_arrays(mesh).items():
+        files[name] = os.path.join(mesh_dir, name + '.npy')
+        np.save(os.path.join(store_path, files[name]), array)
+
+    boundary = {}
+    for name, patch in (mesh.boundary or {}).items():
+        boundary[_as_str(name)] = {"type": _as_str(patch.type), "num": int(patch.num), "start": int(patch.start), "id": int(patch.id)}
+
+    return {"arrays": files,
+            "boundary": boundary,
+            "num_point": int(mesh.num_point),
+            "num_face": int(mesh.num_face),
+            "num_inner_face": int(mesh.num_inner_face),
+            "num_cell": int(mesh.num_cell)}
+
+
+def _as_str(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+def field_region(field: str) -> tuple[str, str]:
+    """Get the region and the file name of a field
+
+    Parameters
+    ----------
+    field : str
+        One of FIELD_FILES (e.g. "StaticPressure"), or any other field
+        file named as '<region>/<file name>', region being one of
+        FIELD_REGIONS (e.g. 'fluid/p_rgh', 'momentum/p')
+
+    Raises
+    ------
+    ValueError
+        If the name does not follow any of both forms
+
+    Returns
+    -------
+    region : str
+        "fluid", "solid" or "momentum"
+    file_name : str
+        Name of the field file in the timestep folders
+
+    """
+
+    if field in FIELD_FILES:
+        return FIELD_FILES[field]
+
+    region, _, file_name = field.partition('/')
+    if region not in FIELD_REGIONS or not file_name or '/' in file_name:
+        raise ValueError(f"Unknown field {field!r}: fields are one of {list(FIELD_FILES)} "
+                         f"or '<region>/<file name>' with region one of {list(FIELD_REGIONS)}")
+
+    return region, file_name
+
+
+def field_keys(field: str) -> tuple[str, str]:
+    """Get the keys of the timesteps and of the mesh of a field (e.g.
+    ("ThermalTimesteps", "FluidMesh")), see field_region"""
+
+    return FIELD_REGIONS[field_region(field)[0]]
+
+
+def data_fields(sim_data) -> list[str]:
+    """Get the names of the fields in the data of a simulation"""
+
+    return [key for key in sim_data if key not in _DATA_KEYS]
+
+
+def normalise_field(values, num_cell: int = None, dtype: str = None, uniform: bool = None):
+    """Get a timestep of a field as a contiguous array
+
+    Parameters
+    ----------
+    values : numpy.ndarray, list, float or None
+        Value of the field at every cell, as read from its file: an
+        array, a list of values (or of 3-element arrays), or a single
+        value (or its components) for uniform fields
+    num_cell : int
+        Number of cells of the mesh of the field. Uniform values are
+        expanded to all of them. By default (None) they are not.
+    dtype : str
+        Data type of the array (e.g. "float32"). By default (None)
+        the type of values is kept.
+    uniform : bool
+        Whether values is a uniform value, as returned by 
+        field_reader.read_internal_field with return_uniform. By
+        default (None), values that are not one per cell are taken
+        as uniform.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        Contiguous array of shape (num_cell,) for scalar fields or
+        (num_cell, 3) for vector fields. None if values is None (the
+        field file did not exist).
+
+    """
+
+    if values is None:
+        return None
+
+    values = np.asarray(values, dtype=dtype)
+    if uniform is None:
+        uniform = values.ndim == 0 or values.ndim == 1 and len(values) != num_cell
+    if num_cell is not None and uniform:
+        # Uniform value, or the components of a uniform vector
+        values = np.broadcast_to(values, (num_cell,) + values.shape)
+
+    return np.ascontiguousarray(values)
+
+
+def normalise_fields(sim_data: dict, dtype: str = None) -> dict:
+    """Get all the fields of a simulation as contiguous arrays
+
+    Replaces every timestep of every field of sim_data (as created by
+    read_simulation_data) with normalise_field( values, num_cell,
+    dtype ), num_cell being the number of cells of its mesh.
+
+    Returns
+    -------
+    sim_data : dict
+        The same dict, modified in place
+
+    """
+
+    for field in data_fields(sim_data):
+        num_cell = getattr(sim_data.get(field_keys(field)[1]), "num_cell", None)
+        sim_data[field] = [normalise_field(values, num_cell, dtype) for values in sim_data[field]]
+
+    return sim_data
+
+
+def has_dtype(values, dtype: str) -> bool:
+    """Check if a timestep of a field is stored with a data type
+    (missing timesteps, None, have any)"""
+
+    return values is None or np.dtype(getattr(values, "dtype", None)) == np.dtype(dtype)
+
+
+def check_storage_options(dtype: str = 'float64', compression: str = None):
+    """Check the data type and compression of the field arrays
+
+    Raises
+    ------
+    ValueError
+        If dtype is not one of FIELD_DTYPES or compression is not None
+        or one of COMPRESSIONS
+    ImportError
+        If the package of the compression is not installed
+
+    """
+
+    if dtype not in FIELD_DTYPES:
+        raise ValueError(f"dtype must be one of {FIELD_DTYPES}, not {dtype!r}")
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"compression must be None or one of {COMPRESSIONS}, not {compression!r}")
+    if compression is not None and compression not in COMPRESSORS:
+        raise ImportError(f"{compression} compression requires the {compression} package")
+
+
+def _decompressor(filename: str):
+    """Decompress function of a compressed array file, None if the
+    file is not compressed"""
+
+    for name in COMPRESSIONS:
+        if filename.endswith('.npy.' + name):
+            if name not in COMPRESSORS:
+                raise ImportError(f"{name} package required to read {filename}")
+            return COMPRESSORS[name][2]
+    return None
+
+
+def _load_array(store_path: str, filename: str, mmap_mode: str = 'r'):
+    if filename is None:
+        return None
+
+    decompress = _decompressor(filename)
+    if decompress is None:
+        return np.load(os.path.join(store_path, filename), mmap_mode=mmap_mode)
+
+    # Compressed arrays can not be memory-mapped
+    with open(os.path.join(store_path, filename), 'rb') as f:
+        return np.load(io.BytesIO(decompress(f.read())))
+
+
+def _field_filename(field: str, timestep: str, compression: str = None) -> str:
+    filename = os.path.join('fields', field, timestep + '.npy')
+    if compression is not None:
+        filename += COMPRESSORS[compression][0]
+    return filename
+
+
+def write_field_timestep(   store_path: str,
+                            field: str,
+                            timestep: str,
+                            values,
+                            compression: str = None
+                        ) -> str:
+    """Save one timestep of one field in a case store
+
+    The array is saved contiguously, with the data type of values.
+    The manifest is not modified.
+
+    Parameters
+    ----------
+    store_path : str
+        Path to the case store directory
+    field : str
+        Name of the field (e.g. "FluidTemperature")
+    timestep : str
+        Name of the timestep folder
+    values : numpy.ndarray
+        Value of the field at every cell
+    compression : str
+        Compress the array with one of COMPRESSORS ("zlib" or
+        "lz4"). By default (None) it is not compressed.
+
+    Returns
+    -------
+    filename : str
+        Path of the array file, relative to the store. None if values
+        is None (the field file did not exist), which is recorded as
+        null in the manifest.
+
+    """
+
+    if values is None:
+        return None
+
+    filename = _field_filename(field, timestep, compression)
+    os.makedirs(os.path.join(store_path, os.path.dirname(filename)), exist_ok=True)
+    if compression is None:
+        np.save(os.path.join(store_path, filename), np.ascontiguousarray(values))
+    else:
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(values))
+        with open(os.path.join(store_path, filename), 'wb') as f:
+            f.write(COMPRESSORS[compression][1](buffer.getbuffer()))
+
+    return filename
+
+
+def write_manifest(store_path: str, manifest: dict):
+    """Write the manifest of a case store
+
+    The manifest is first written to a temporary file that then
+    replaces the old one, so readers never see a partial manifest.
+
+    """
+
+    tmp_name = os.path.join(store_path, MANIFEST_NAME + '.tmp')
+    with open(tmp_name, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_name, os.path.join(store_path, MANIFEST_NAME))
+
+
+def read_manifest(store_path: str) -> dict:
+    """Read the manifest of a case store"""
+
+    with open(os.path.join(store_path, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def is_case_store(path: str) -> bool:
+    """Check if path is a case store directory"""
+
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+
+def write_case_store(   sim_data: dict,
+                        store_path: str,
+                        unchanged: set = None,
+                        compression: str = None
+                    ) -> str:
+    """Save the data of a simulation as a case store
+
+    Parameters
+    ----------
+    sim_data : dict
+        Dictionary with the results from the simulation, as created
+        by read_simulation_data
+    store_path : str
+        Path to the case store directory. It is created if it does
+        not exist.
+    unchanged : set
+        Data that is already saved in the store and does not have to
+        be written again: mesh keys (e.g. "FluidMesh") and (field,
+        timestep) tuples. By default everything is written. Field
+        arrays saved with another compression are written again.
+    compression : str
+        Compression of the field arrays, as in write_field_timestep
+
+    Returns
+    -------
+    store_path : str
+        Path to the case store directory
+
+    """
+
+    os.makedirs(store_path, exist_ok=True)
+    unchanged = unchanged or set()
+    previous_manifest = read_manifest(store_path) if unchanged else None
+
+    manifest = {"format_version": STORE_FORMAT_VERSION,
+                "Parameters": sim_data["Parameters"].as_dict(),
+                "MomentumTimesteps": list(sim_data["MomentumTimesteps"]),
+                "ThermalTimesteps": list(sim_data["ThermalTimesteps"]),
+                "compression": compression,
+                "meshes": {},
+                "fields": {}}
+
+    for key in MESH_KEYS:
+        if key in unchanged:
+            manifest["meshes"][key] = previous_manifest["meshes"][key]
+        elif key in sim_data:
+            manifest["meshes"][key] = _write_mesh(store_path, key, sim_data[key])
+
+    for field in data_fields(sim_data):
+        timesteps_key = field_keys(field)[0]
+        previous_files = {}
+        if previous_manifest is not None and field in previous_manifest["fields"]:
+            previous_files = dict(zip(previous_manifest[timesteps_key],
+                                      previous_manifest["fields"][field]["files"]))
+        files = []
+        for ts, values in zip(manifest[timesteps_key], sim_data[field]):
+            previous_file = previous_files.get(ts)
+            if (field, ts) in unchanged and (previous_file is None
+                                             or previous_file == _field_filename(field, ts, compression)):
+                files.append(previous_file)
+            else:
+                files.append(write_field_timestep(store_path, field, ts, values, compression))
+                if previous_file is not None and previous_file != files[-1]:
+                    # Saved before with another compression
+                    os.remove(os.path.join(store_path, previous_file))
+        manifest["fields"][field] = {"timesteps": timesteps_key, "files": files}
+
+    write_manifest(store_path, manifest)
+
+    return store_path
+
+
+def read_case_store(store_path: str, mmap_mode: str = 'r') -> dict:
+    """Read a case store
+
+    Returns the same dict as the joblib file of read_simulation_data,
+    with every array memory-mapped, so nothing but the manifest is
+    actually read until the arrays are used.
+
+    Parameters
+    ----------
+    store_path : str
+        Path to the case store directory
+    mmap_mode : str
+        Memory-map mode passed to numpy.load (default 'r', read
+        only). None reads all the arrays into memory.
+
+    Returns
+    -------
+    sim_data : dict
+        Dictionary with the results from the simulation, with the
+        same keys as described in read_simulation_data. The meshes
+        are StoredMesh objects.
+
+    """
+
+    manifest = read_manifest(store_path)
+
+    sim_data = {"Parameters": data_handling_functions.CaseParameters(**manifest["Parameters"])}
+    for key, mesh_manifest in manifest["meshes"].items():
+        sim_data[key] = open_mesh(store_path, mesh_manifest, mmap_mode)
+    sim_data["MomentumTimesteps"] = manifest["MomentumTimesteps"]
+    sim_data["ThermalTimesteps"] = manifest["ThermalTimesteps"]
+
+    for field in manifest["fields"]:
+        sim_data[field] = [_load_array(store_path, filename, mmap_mode)
+                           for filename in manifest["fields"][field]["files"]]
+
+    return sim_data
+
+
+def read_field_timestep(    store_path: str,
+                            field: str,
+                            timestep: str,
+                            mmap_mode: str = 'r'
+                        ) -> np.ndarray:
+    """Read one timestep of one field of a case store
+
+    Parameters
+    ----------
+    store_path : str
+        Path to the case store directory
+    field : str
+        Name of the field (e.g. "FluidTemperature")
+    timestep : str
+        Name of the timestep folder
+    mmap_mode : str
+        Memory-map mode passed to numpy.load (default 'r'). Ignored
+        for compressed arrays, which are read into memory.
+
+    Returns
+    -------
+    numpy.ndarray
+        Value of the field at every cell, None if the field file did
+        not exist
+
+    """
+
+    manifest = read_manifest(store_path)
+    timesteps = manifest[manifest["fields"][field]["timesteps"]]
+    filename = manifest["fields"][field]["files"][timesteps.index(timestep)]
+
+    return _load_array(store_path, filename, mmap_mode)
@@ -0,0 +1,351 @@
+"""Channels module
+
+This module defines the analysis of the flow through each channel of
+a structured catalyst, to quantify the maldistribution of the flow
+between them.
+
+The channels are not marked in the mesh: they are found from its
+connectivity. Within the catalyst section (the z-range of the solid
+region), the fluid cells of different channels are separated by the
+solid, so each channel is a connected component of the graph of the
+internal faces (owner, neighbour) between fluid cells of the section.
+The components are found with scipy.sparse.csgraph, with no loops
+over cells or faces in Python, and the labelling is cached per mesh
+(with the averagers of the mesh, see get_axial_averager in
+post_processing_functions.py module). The cells can be restricted to
+a cellZone of the mesh (see field_reader.read_cell_zones).
+
+Channels are numbered by the distance of their centre to the axis of
+the reactor, and then by their angle. The fluid between the monolith
+and the wall of the reactor, if any, is one more channel.
+
+For every channel, with its cells between z_min and z_max and the
+axial velocity u_z:
+
+    flow_rate = sum(u_z*V)/(z_max - z_min)    (volumetric, averaged along the channel)
+    u_mean = sum(u_z*V)/sum(V)
+    T_bulk = sum(u_z*T*V)/sum(u_z*V)
+
+quantities = channel_quantities( data )
+plt.bar(quantities["channel"], quantities["flow_fraction"][-1])
+
+This module requires numpy and scipy. It also uses hashlib
+
+"""
+
+import hashlib
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+import post_processing_functions
+from chunked_averaging import column_range
+
+
+class ChannelLabels:
+    """Channel of every cell of a fluid mesh.
+
+    Use get_channel_labels to get the (cached) labels of a mesh.
+
+    Attributes
+    ----------
+    labels : numpy.ndarray
+        Channel of every cell, -1 for the cells outside of the
+        catalyst section (or of the zone)
+    num_channels : int
+        Number of channels
+    num_cell : int
+        Number of cells of the mesh
+    z_range : tuple[float, float]
+        (min_z, max_z) of the catalyst section
+    volumes : numpy.ndarray
+        Volume of every channel, shape (num_channels,)
+    centres : numpy.ndarray
+        Volume-weighted centre of every channel, shape
+        (num_channels, 3)
+    num_cells : numpy.ndarray
+        Number of cells of every channel
+
+    Methods
+    -------
+    from_mesh(mesh, z_range, zone_cells=None, centre=(0, 0))
+        Label the channels of an Ofpp mesh.
+    sums(self, values, scale=None) -> numpy.ndarray
+        Volume-weighted sum of a field in every channel.
+
+    """
+
+    def __init__(   self,
+                    owner: np.ndarray,
+                    neighbour: np.ndarray,
+                    cell_centres: np.ndarray,
+                    cell_volumes: np.ndarray,
+                    in_section: np.ndarray,
+                    z_range: tuple[float, float],
+                    centre: tuple[float, float] = (0.0, 0.0)
+                ):
+        """
+        Find the connected components of the cells of the section.
+
+        Parameters
+        ----------
+        owner, neighbour : numpy.ndarray
+            Owner and neighbour cell of every internal face
+        cell_centres : numpy.ndarray
+            Coordinates of the centre of every cell, shape (cells, 3)
+        cell_volumes : numpy.ndarray
+            Volume of every cell, shape (cells,)
+        in_section : numpy.ndarray
+            True for the cells to label, shape (cells,)
+        z_range : tuple[float, float]
+            (min_z, max_z) of the section, used for the flow rates
+        centre : tuple[float, float]
+            (x, y) of the axis of the reactor, used to number the
+            channels
+        """
+        self.num_cell = len(cell_volumes)
+        self.z_range = (float(z_range[0]), float(z_range[1]))
+
+        # Graph of the faces between cells of the section:
+        owner = np.asarray(owner, dtype=np.int64)
+        neighbour = np.asarray(neighbour, dtype=np.int64)
+        inner = in_section[owner] & in_section[neighbour]
+        graph = sparse.csr_matrix(
+            (np.ones(np.count_nonzero(inner), dtype=np.int8), (owner[inner], neighbour[inner])),
+            shape=(self.num_cell, self.num_cell)
+        )
+        _, components = csgraph.connected_components(graph, directed=False)
+
+        # Cells out of the section are components of their own; the
+        # channels are the components of the cells in the section:
+        cells = np.flatnonzero(in_section)
+        channel_ids, channels = np.unique(components[cells], return_inverse=True)
+        num_channels = len(channel_ids)
+
+        cell_volumes = np.asarray(cell_volumes, dtype=float)[cells]
+        cell_centres = np.asarray(cell_centres, dtype=float)[cells]
+        volumes = np.bincount(channels, weights=cell_volumes, minlength=num_channels)
+        centres = np.stack([np.bincount(channels, weights=cell_volumes*cell_centres[:, i],
+                                        minlength=num_channels) for i in range(3)], axis=1)/volumes[:, None]
+
+        # Number the channels by radius, then angle (radii rounded so
+        # that channels of the same ring are ordered by their angle):
+        r_theta = post_processing_functions.cylindrical_coordinates(centres, centre)
+        r = np.round(r_theta[:, 0]/max(r_theta[:, 0].max(), np.finfo(float).tiny), 6)
+        order = np.lexsort((r_theta[:, 1], r))
+        rank = np.empty(num_channels, dtype=np.int64)
+        rank[order] = np.arange(num_channels)
+
+        self.num_channels = num_channels
+        self.labels = np.full(self.num_cell, -1, dtype=np.int64)
+        self.labels[cells] = rank[channels]
+        self.volumes = volumes[order]
+        self.centres = centres[order]
+        self.num_cells = np.bincount(rank[channels], minlength=num_channels)
+
+        self._cells = cells
+        self._channels = rank[channels]
+        self._cell_volumes = cell_volumes
+
+    @classmethod
+    def from_mesh(  cls,
+                    mesh,
+                    z_range: tuple[float, float],
+                    zone_cells: np.ndarray = None,
+                    centre: tuple[float, float] = (0.0, 0.0)
+                ) -> "ChannelLabels":
+        """
+        Label the channels of a fluid mesh.
+
+        Parameters
+        ----------
+        mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+            Mesh with owner, neighbour, cell_centres and cell_volumes
+        z_range : tuple[float, float]
+            (min_z, max_z) of the catalyst section. Only the cells
+            whose centre is within it are labelled.
+        zone_cells : numpy.ndarray
+            Labels of the cells of a cellZone. If given, only the
+            cells of the zone are labelled.
+        centre : tuple[float, float]
+            (x, y) of the axis of the reactor. By default the z axis.
+
+        Returns
+        -------
+        ChannelLabels
+        """
+        num_inner_face = mesh.num_inner_face
+        cell_centres = np.asarray(mesh.cell_centres)
+        z_centres = cell_centres[:, 2]
+        in_section = (z_centres >= z_range[0]) & (z_centres <= z_range[1])
+        if zone_cells is not None:
+            in_zone = np.zeros(len(in_section), dtype=bool)
+            in_zone[np.asarray(zone_cells)] = True
+            in_section &= in_zone
+
+        return cls(np.asarray(mesh.owner)[:num_inner_face], np.asarray(mesh.neighbour)[:num_inner_face],
+                   cell_centres, mesh.cell_volumes, in_section, z_range, centre)
+
+    def sums(self, values, scale: np.ndarray = None) -> np.ndarray:
+        """
+        Sum of volume times value (times scale) of the cells of every
+        channel.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            Value of a field at every cell, shape (cells,), or None
+            for 1
+        scale : numpy.ndarray
+            Multiply the values by scale, given at every cell, shape
+            (cells,) (e.g. the axial velocity). By default (None), 1.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sum for every channel, shape (num_channels,)
+        """
+        weights = self._cell_volumes
+        if values is not None:
+            weights = weights*np.asarray(np.asarray(values)[self._cells], dtype=float)
+        if scale is not None:
+            weights = weights*np.asarray(np.asarray(scale)[self._cells], dtype=float)
+
+        return np.bincount(self._channels, weights=weights, minlength=self.num_channels)
+
+
+def get_channel_labels( mesh,
+                        z_range: tuple[float, float],
+                        zone_cells: np.ndarray = None,
+                        centre: tuple[float, float] = (0.0, 0.0)
+                    ) -> ChannelLabels:
+    """Get the ChannelLabels of a mesh, reusing them if possible
+
+    Labels are cached with the averagers of the mesh (see
+    get_axial_averager, post_processing_functions.py module), per
+    (z_range, zone_cells, centre).
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+        Mesh of the fluid region
+    z_range, zone_cells, centre
+        As in ChannelLabels.from_mesh
+
+    Returns
+    -------
+    ChannelLabels
+
+    """
+
+    z_range = (float(z_range[0]), float(z_range[1]))
+    centre = (float(centre[0]), float(centre[1]))
+    zone_key = None
+    if zone_cells is not None:
+        zone_key = hashlib.sha1(np.ascontiguousarray(zone_cells, dtype=np.int64).tobytes()).hexdigest()
+
+    return post_processing_functions._cached_averager(
+        mesh, ("channels", z_range, zone_key, centre),
+        lambda: ChannelLabels.from_mesh(mesh, z_range, zone_cells, centre)
+    )
+
+
+def _axial_component(velocity, num_cell: int) -> np.ndarray:
+    """Axial component of a timestep of the velocity at every cell"""
+
+    velocity = np.asarray(velocity)
+    if velocity.ndim == 1:
+        # Uniform velocity
+        return np.full(num_cell, float(velocity[2]))
+
+    return velocity[:, 2]
+
+
+def channel_quantities( data: dict,
+                        z_range: tuple[float, float] = None,
+                        zone_cells: np.ndarray = None,
+                        centre: tuple[float, float] = (0.0, 0.0)
+                    ) -> dict:
+    """Compute the flow through each channel of the catalyst
+
+    channel_quantities( data )["maldistribution"] -> std/mean of the
+    flow rate of the channels, for every momentum timestep
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    z_range : tuple[float, float]
+        (min_z, max_z) of the catalyst section. By default, the
+        minimum and maximum z-coordinate of the cells of the solid
+        region.
+    zone_cells : numpy.ndarray
+        Labels of the cells of a cellZone of the fluid mesh, to
+        restrict the channels to it (see field_reader.read_cell_zones)
+    centre : tuple[float, float]
+        (x, y) of the axis of the reactor. By default the z axis.
+
+    Returns
+    -------
+    quantities : dict
+        "channel" : number of every channel, shape (channels,)
+        "centre" : volume-weighted centre of every channel, shape
+            (channels, 3)
+        "r", "theta" : cylindrical coordinates of the centres
+        "volume" : fluid volume of every channel [m3]
+        "ThermalTimesteps", "MomentumTimesteps" : timesteps of the
+            rows of the arrays below
+        With shape (momentum timesteps, channels):
+        "flow_rate" : volumetric flow rate [m3/s]
+        "flow_fraction" : flow rate over the total of the channels
+        "u_mean" : mean axial velocity [m/s]
+        With shape (momentum timesteps,):
+        "maldistribution" : standard deviation of the flow rates
+            over their mean [-]
+        With shape (thermal timesteps, channels), from the velocity
+        of the last momentum timestep:
+        "T_bulk" : flow-weighted average temperature [K]
+
+    """
+
+    fluidmesh = data["FluidMesh"]
+    if z_range is None:
+        z_range = column_range(np.asarray(data["SolidMesh"].cell_centres), 2)
+    channels = get_channel_labels(fluidmesh, z_range, zone_cells, centre)
+    length = channels.z_range[1] - channels.z_range[0]
+    num_cell = channels.num_cell
+
+    r_theta = post_processing_functions.cylindrical_coordinates(channels.centres, centre)
+    quantities = {"channel": np.arange(channels.num_channels),
+                  "centre": channels.centres,
+                  "r": r_theta[:, 0],
+                  "theta": r_theta[:, 1],
+                  "volume": channels.volumes,
+                  "ThermalTimesteps": list(data["ThermalTimesteps"]),
+                  "MomentumTimesteps": list(data["MomentumTimesteps"])}
+
+    # Flow of every momentum timestep:
+    flux = np.empty((len(data["VelocityField"]), channels.num_channels))
+    u_z = None
+    for ts, velocity in enumerate(data["VelocityField"]):
+        u_z = _axial_component(velocity, num_cell)
+        flux[ts] = channels.sums(u_z)
+
+    flow_rate = flux/length
+    quantities["flow_rate"] = flow_rate
+    with np.errstate(invalid='ignore', divide='ignore'):
+        quantities["flow_fraction"] = flow_rate/flow_rate.sum(axis=1, keepdims=True)
+        quantities["u_mean"] = flux/channels.volumes
+        quantities["maldistribution"] = flow_rate.std(axis=1)/flow_rate.mean(axis=1)
+
+    # Bulk temperature of every thermal timestep:
+    T_bulk = np.full((len(data["FluidTemperature"]), channels.num_channels), np.nan)
+    if u_z is not None:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for ts, temperature in enumerate(data["FluidTemperature"]):
+                T_bulk[ts] = channels.sums(temperature, scale=u_z)/flux[-1]
+    quantities["T_bulk"] = T_bulk
+
+    return quantities
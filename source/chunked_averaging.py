@@ -0,0 +1,470 @@
+"""Chunked averaging module
+
+This module defines out-of-core versions of the averagers of the
+post_processing_functions.py module, for meshes too large to hold
+their averaging operators (and a whole timestep of every field
+involved) in memory.
+
+AxialAverager and ProfileAverager store a sparse matrix with one
+element per cell (or more), built from the cell centres of the whole
+mesh at once. The chunked averagers store nothing per cell: the cells
+are processed in chunks of chunk_size consecutive cells, finding the
+bins of the cells of each chunk from their centres and adding up the
+partial sums of every bin (volume, and volume times value) with
+numpy.bincount. Only the slices [start:stop] of the cell centres,
+volumes and fields are read for each chunk, so with memory-mapped
+arrays (a case store or a mesh cache, see case_store.py module) the
+memory used is proportional to chunk_size instead of to the number
+of cells. The results are the same as those of the in-memory
+averagers, up to the rounding of the sums.
+
+averager = ChunkedAxialAverager.from_mesh( mesh, num_zdots, chunk_size=10**6 )
+avg_T = averager.average( data["FluidTemperature"] )
+
+They are usually obtained with get_axial_averager or
+get_profile_averager (post_processing_functions.py module), passing a
+chunk_size.
+
+This module requires numpy. It also uses abc
+
+"""
+
+import abc
+
+import numpy as np
+
+import post_processing_functions
+
+# Default number of cells per chunk:
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+
+def cell_chunks(num_cell: int, chunk_size: int = None):
+    """Split the cells of a mesh in chunks
+
+    Parameters
+    ----------
+    num_cell : int
+        Number of cells
+    chunk_size : int
+        Number of cells per chunk. By default (None), all the cells
+        in one chunk.
+
+    Yields
+    ------
+    start, stop : int
+        Range of the cells of the chunk
+
+    """
+
+    if chunk_size is None:
+        chunk_size = max(num_cell, 1)
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+
+    for start in range(0, num_cell, chunk_size):
+        yield start, min(start + chunk_size, num_cell)
+
+
+def column_range(   array: np.ndarray,
+                    column: int,
+                    chunk_size: int = None
+                ) -> tuple[float, float]:
+    """Minimum and maximum of a column of an array, read in chunks
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        Array of shape (N, columns), e.g. the cell centres of a mesh
+    column : int
+        Index of the column
+    chunk_size : int
+        Number of rows read at a time, as in cell_chunks
+
+    Returns
+    -------
+    tuple[float, float]
+        (min, max) of the column
+
+    """
+
+    low, high = np.inf, -np.inf
+    for start, stop in cell_chunks(len(array), chunk_size):
+        values = np.asarray(array[start:stop, column])
+        low = min(low, float(values.min()))
+        high = max(high, float(values.max()))
+
+    return low, high
+
+
+def cylindrical_range(  points: np.ndarray,
+                        coordinate: str,
+                        centre: tuple[float, float] = (0.0, 0.0),
+                        chunk_size: int = None
+                    ) -> tuple[float, float]:
+    """Minimum and maximum of a cylindrical coordinate of some points,
+    read in chunks
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Cartesian coordinates, shape (N, 3)
+    coordinate : str
+        'r', 'theta' or 'z'
+    centre : tuple[float, float]
+        (x, y) of the axis of the reactor
+    chunk_size : int
+        Number of points read at a time, as in cell_chunks
+
+    Returns
+    -------
+    tuple[float, float]
+        (min, max) of the coordinate
+
+    """
+
+    column = {"r": 0, "theta": 1, "z": 2}[coordinate]
+    if column == 2:
+        return column_range(points, 2, chunk_size)
+
+    low, high = np.inf, -np.inf
+    for start, stop in cell_chunks(len(points), chunk_size):
+        values = post_processing_functions.cylindrical_coordinates(points[start:stop], centre)[:, column]
+        low = min(low, float(values.min()))
+        high = max(high, float(values.max()))
+
+    return low, high
+
+
+class ChunkedAverager(abc.ABC):
+    """Volume-weighted bin averages computed in chunks of cells.
+
+    Base class of ChunkedAxialAverager and ChunkedProfileAverager,
+    which define the bins of the cells of each chunk (_pairs).
+
+    Attributes
+    ----------
+    num_cell : int
+        Number of cells of the mesh
+    num_bins : int
+        Number of bins
+    chunk_size : int
+        Number of cells per chunk
+    volumes : numpy.ndarray
+        Total volume of the cells of every bin, shape (num_bins,)
+
+    Methods
+    -------
+    sums(self, field, scale=None) -> numpy.ndarray
+        Sum of volume times value in every bin, for every timestep.
+    average(self, field, scale=None) -> numpy.ndarray
+        Average a field for all its timesteps.
+
+    """
+
+    # Average of the bins without cells:
+    empty_value = 0.0
+
+    def __init__(   self,
+                    cell_volumes: np.ndarray,
+                    num_bins: int,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE
+                ):
+        """
+        Add up the volume of every bin, one chunk at a time.
+
+        Parameters
+        ----------
+        cell_volumes : numpy.ndarray
+            Volume of every cell, shape (cells,). It is kept (not
+            copied), so it can be a memory map.
+        num_bins : int
+            Number of bins
+        chunk_size : int
+            Number of cells per chunk
+        """
+        self.cell_volumes = cell_volumes
+        self.num_cell = len(cell_volumes)
+        self.num_bins = num_bins
+        self.chunk_size = chunk_size
+        # A timestep of None is 1 at every cell
+        self.volumes = self.sums([None])[0]
+
+    @abc.abstractmethod
+    def _pairs(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        """(cell, bin) pairs of the cells of a chunk, with the cells
+        counted from start"""
+
+    def _timesteps(self, field) -> list:
+        """Timesteps of a field, without reading them"""
+
+        if isinstance(field, np.ndarray):
+            return list(field.reshape(-1, self.num_cell))
+        if isinstance(field, (list, tuple)):
+            if len(field) > 0 and field[0] is not None and np.ndim(field[0]) == 0:
+                # A single timestep as a list of values
+                return [np.asarray(field)]
+            return list(field)
+        return None
+
+    def sums(self, field, scale: np.ndarray = None) -> np.ndarray:
+        """
+        Sum of volume times value (times scale) of the cells of every
+        bin.
+
+        Parameters
+        ----------
+        field, scale
+            As in average
+
+        Returns
+        -------
+        numpy.ndarray
+            Sums for every timestep, shape (timesteps, num_bins)
+        """
+        timesteps = self._timesteps(field)
+        if timesteps is None:
+            # Other sequences: one timestep at a time
+            sums = np.empty((len(field), self.num_bins))
+            for ts, values in enumerate(field):
+                sums[ts] = self.sums([values], scale)[0]
+            return sums
+
+        sums = np.zeros((len(timesteps), self.num_bins))
+        for start, stop in cell_chunks(self.num_cell, self.chunk_size):
+            cells, bins = self._pairs(start, stop)
+            weights = np.asarray(self.cell_volumes[start:stop], dtype=float)[cells]
+            if scale is not None:
+                weights *= np.asarray(scale[start:stop], dtype=float)[cells]
+            for ts, values in enumerate(timesteps):
+                if values is None:
+                    chunk_values = 1.0
+                else:
+                    chunk_values = np.asarray(values[start:stop], dtype=float)[cells]
+                sums[ts] += np.bincount(bins, weights*chunk_values, minlength=self.num_bins)
+
+        return sums
+
+    def average(self, field, scale: np.ndarray = None) -> np.ndarray:
+        """
+        Average a field in each bin.
+
+        Parameters
+        ----------
+        field : numpy.ndarray
+            Value of the field at every cell for every timestep,
+            shape (timesteps, cells), as in AxialAverager.average.
+            Arrays and lists of arrays (e.g. memory maps) are read one
+            chunk at a time, other sequences one timestep at a time.
+        scale : numpy.ndarray
+            As in AxialAverager.average, read one chunk at a time too
+
+        Returns
+        -------
+        avg : numpy.ndarray
+            Average of the field in each bin for each timestep, shape
+            (timesteps, num_bins)
+        """
+        sums = self.sums(field, scale)
+        empty = self.volumes == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg = sums/self.volumes
+        avg[:, empty] = self.empty_value
+
+        return avg
+
+
+class ChunkedAxialAverager(ChunkedAverager):
+    """Chunked version of AxialAverager (post_processing_functions.py
+    module), with the same slices and the same results.
+
+    Attributes
+    ----------
+    z_dots : numpy.ndarray
+        z-coordinate of the centre of every slice
+    slice_volumes : numpy.ndarray
+        Total volume of the cells of every slice
+
+    """
+
+    def __init__(   self,
+                    z_centres: np.ndarray,
+                    cell_volumes: np.ndarray,
+                    z_dots: np.ndarray,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE
+                ):
+        """
+        Parameters
+        ----------
+        z_centres : numpy.ndarray
+            z-coordinate of the centre of every cell, shape (cells,).
+            It is kept (not copied), so it can be a memory map (e.g.
+            mesh.cell_centres[:, 2]).
+        cell_volumes : numpy.ndarray
+            Volume of every cell, shape (cells,)
+        z_dots : numpy.ndarray
+            z-coordinate of the centre of every slice (equally
+            spaced)
+        chunk_size : int
+            Number of cells per chunk
+        """
+        self.z_centres = z_centres
+        self.z_dots = np.asarray(z_dots, dtype=float)
+        super().__init__(cell_volumes, len(self.z_dots), chunk_size)
+        self.slice_volumes = self.volumes
+
+    def _pairs(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        z_centres = np.asarray(self.z_centres[start:stop], dtype=float)
+        return post_processing_functions._axial_slice_membership(z_centres, self.z_dots)
+
+    @classmethod
+    def from_mesh(  cls,
+                    mesh,
+                    num_zdots: int,
+                    z_range: tuple[float, float] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE
+                ) -> "ChunkedAxialAverager":
+        """
+        Build the averager of a mesh, as AxialAverager.from_mesh.
+
+        Parameters
+        ----------
+        mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+            Mesh with cell_centres and cell_volumes already read (or
+            memory-mapped)
+        num_zdots : int
+            Number of points to divide the lenght of the reactor in.
+        z_range : tuple[float, float]
+            (min_z, max_z) of the z_dots. By default, the minimum and
+            maximum z-coordinate of the cells of the mesh.
+        chunk_size : int
+            Number of cells per chunk
+
+        Returns
+        -------
+        ChunkedAxialAverager
+        """
+        cell_centres = np.asarray(mesh.cell_centres)
+        if z_range is None:
+            z_range = column_range(cell_centres, 2, chunk_size)
+        z_dots = np.linspace(z_range[0], z_range[1], num_zdots)
+
+        return cls(cell_centres[:, 2], mesh.cell_volumes, z_dots, chunk_size)
+
+
+class ChunkedProfileAverager(ChunkedAverager):
+    """Chunked version of ProfileAverager (post_processing_functions.py
+    module), with the same bins and the same results.
+
+    Attributes
+    ----------
+    coordinates, edges, centres, shape, bin_volumes
+        As in ProfileAverager
+
+    """
+
+    empty_value = np.nan
+
+    def __init__(   self,
+                    cell_centres: np.ndarray,
+                    cell_volumes: np.ndarray,
+                    coordinates: tuple[str],
+                    edges: list[np.ndarray],
+                    centre: tuple[float, float] = (0.0, 0.0),
+                    chunk_size: int = DEFAULT_CHUNK_SIZE
+                ):
+        """
+        Parameters
+        ----------
+        cell_centres : numpy.ndarray
+            Cartesian coordinates of the centre of every cell, shape
+            (cells, 3). It is kept (not copied), so it can be a
+            memory map.
+        cell_volumes : numpy.ndarray
+            Volume of every cell, shape (cells,)
+        coordinates : tuple[str]
+            Cylindrical coordinates of the bins, from 'r', 'theta'
+            and 'z'
+        edges : list[numpy.ndarray]
+            Edges of the bins for each coordinate, as in
+            ProfileAverager
+        centre : tuple[float, float]
+            (x, y) of the axis of the reactor
+        chunk_size : int
+            Number of cells per chunk
+        """
+        self.cell_centres = cell_centres
+        self.centre = centre
+        self.coordinates = tuple(coordinates)
+        self._columns = [{"r": 0, "theta": 1, "z": 2}[name] for name in self.coordinates]
+        self.edges = tuple(np.asarray(e, dtype=float) for e in edges)
+        self.centres = tuple((e[1:] + e[:-1])/2 for e in self.edges)
+        self.shape = tuple(len(e) - 1 for e in self.edges)
+        super().__init__(cell_volumes, int(np.prod(self.shape)), chunk_size)
+        self.bin_volumes = self.volumes.reshape(self.shape)
+
+    def _pairs(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        cell_coordinates = post_processing_functions.cylindrical_coordinates(
+            self.cell_centres[start:stop], self.centre
+        )[:, self._columns]
+        bin_index = post_processing_functions._profile_bin_index(cell_coordinates, self.edges)
+        cells = np.flatnonzero(bin_index >= 0)
+        return cells, bin_index[cells]
+
+    def average(self, field, scale: np.ndarray = None) -> np.ndarray:
+        """
+        Average a field in each bin.
+
+        Parameters
+        ----------
+        field, scale
+            As in ChunkedAverager.average
+
+        Returns
+        -------
+        avg : numpy.ndarray
+            Average of the field in each bin for each timestep, shape
+            (timesteps,) + shape. Bins without cells are NaN.
+        """
+        avg = super().average(field, scale)
+        return avg.reshape((len(avg),) + self.shape)
+
+    @classmethod
+    def from_mesh(  cls,
+                    mesh,
+                    coordinates: tuple[str],
+                    bins: tuple[int],
+                    ranges: dict = None,
+                    centre: tuple[float, float] = (0.0, 0.0),
+                    chunk_size: int = DEFAULT_CHUNK_SIZE
+                ) -> "ChunkedProfileAverager":
+        """
+        Build the averager of a mesh, as ProfileAverager.from_mesh.
+
+        Parameters
+        ----------
+        mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+            Mesh with cell_centres and cell_volumes already read (or
+            memory-mapped)
+        coordinates, bins, ranges, centre
+            As in ProfileAverager.from_mesh
+        chunk_size : int
+            Number of cells (and points) per chunk
+
+        Returns
+        -------
+        ChunkedProfileAverager
+        """
+        ranges = dict(ranges or {})
+        points = getattr(mesh, "points", None)
+        points = np.asarray(points if points is not None else mesh.cell_centres)
+
+        edges = []
+        for name, num_bins in zip(coordinates, bins):
+            if name not in ranges:
+                low, high = cylindrical_range(points, name, centre, chunk_size)
+                ranges[name] = (0.0 if name == "r" else low, high)
+            edges.append(np.linspace(ranges[name][0], ranges[name][1], num_bins + 1))
+
+        return cls(np.asarray(mesh.cell_centres), mesh.cell_volumes, coordinates, edges,
+                   centre, chunk_size)
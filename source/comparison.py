@@ -0,0 +1,364 @@
+"""Comparison module
+
+This module defines the comparison of the fields of two simulations
+that share a mesh (e.g. the cases of a sweep over the Reynolds number
+at fixed porosity), or of two timesteps of the same simulation (e.g.
+to check convergence).
+
+Meshes are compared by a hash of their cell centres and volumes
+(mesh_fingerprint, computed once per mesh), so comparing two cases
+never compares their arrays cell by cell. The difference of every
+pair of timesteps is computed once, and all its measures are taken
+from it with numpy: the volume-weighted norms
+
+    L1 = sum(V*|a - b|)/sum(V)
+    L2 = sqrt(sum(V*(a - b)**2)/sum(V))
+    Linf = max(|a - b|)
+    L2_relative = L2/sqrt(sum(V*b**2)/sum(V))
+
+(with |a - b| the magnitude of the difference for vector fields) and,
+optionally, the axial profile of the difference (the profile of a
+minus the profile of b, see get_axial_averager in
+post_processing_functions.py module).
+
+diff = compare_cases( data_Re20, data_Re100, num_zdots=100 )
+history = convergence_history( data )
+table = compare_batch( 'Re20_DATA.joblib', ['Re50_DATA.joblib', 'Re100_DATA.joblib'], workers=2 )
+
+This module requires numpy. It also uses hashlib
+
+"""
+
+import hashlib
+
+import numpy as np
+
+import case_store
+import data_handling_functions
+import post_processing_functions
+
+# Measures of the difference of two fields, for every timestep:
+NORMS = ("L1", "L2", "Linf", "L2_relative")
+
+
+def mesh_fingerprint(mesh) -> str:
+    """Get the hash of the cell centres and volumes of a mesh
+
+    The hash is cached with the averagers of the mesh (see
+    get_axial_averager), so it is only computed once per mesh.
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+        Mesh with cell_centres and cell_volumes already read
+
+    Returns
+    -------
+    str
+        SHA-1 hash of the cell centres and volumes, as float64
+
+    """
+
+    def fingerprint():
+        sha1 = hashlib.sha1()
+        sha1.update(np.ascontiguousarray(mesh.cell_centres, dtype=np.float64).tobytes())
+        sha1.update(np.ascontiguousarray(mesh.cell_volumes, dtype=np.float64).tobytes())
+        return sha1.hexdigest()
+
+    return post_processing_functions._cached_averager(mesh, ("fingerprint",), fingerprint)
+
+
+def meshes_compatible(mesh_a, mesh_b) -> bool:
+    """Check if two meshes have the same cells (same centres and
+    volumes, in the same order)"""
+
+    if mesh_a is mesh_b:
+        return True
+    if len(mesh_a.cell_volumes) != len(mesh_b.cell_volumes):
+        return False
+
+    return mesh_fingerprint(mesh_a) == mesh_fingerprint(mesh_b)
+
+
+def _check_compatible(data_a: dict, data_b: dict, fields: list[str]):
+    """Raise a ValueError if the mesh of a field is not the same in
+    both data"""
+
+    mesh_keys = dict.fromkeys(case_store.field_keys(field)[1] for field in fields)
+    for mesh_key in mesh_keys:
+        if not meshes_compatible(data_a[mesh_key], data_b[mesh_key]):
+            raise ValueError(f"The {mesh_key} of the simulations is not the same, their fields cannot be compared")
+
+
+def _compare_pairs( pairs,
+                    mesh,
+                    num_zdots: int = None,
+                    z_range: tuple[float, float] = None
+                ) -> dict:
+    """Measures of the difference a - b of every (a, b) pair of
+    timesteps of a field of mesh"""
+
+    cell_volumes = np.asarray(mesh.cell_volumes, dtype=float)
+    total_volume = cell_volumes.sum()
+    averager = None
+    if num_zdots is not None:
+        averager = post_processing_functions.get_axial_averager(mesh, num_zdots, z_range)
+
+    results = {name: [] for name in NORMS}
+    axial = []
+    for values_a, values_b in pairs:
+        values_b = np.asarray(values_b, dtype=float)
+        difference = np.asarray(values_a, dtype=float) - values_b
+        if difference.ndim > 1:
+            # Vector fields: magnitude of the difference
+            magnitude = np.sqrt(np.einsum('ij,ij->i', difference, difference))
+            reference = np.einsum('ij,ij->i', values_b, values_b)
+        else:
+            magnitude = np.abs(difference)
+            reference = values_b*values_b
+
+        L2 = np.sqrt(cell_volumes @ (magnitude*magnitude)/total_volume)
+        results["L1"].append(cell_volumes @ magnitude/total_volume)
+        results["L2"].append(L2)
+        results["Linf"].append(magnitude.max())
+        with np.errstate(invalid='ignore', divide='ignore'):
+            results["L2_relative"].append(L2/np.sqrt(cell_volumes @ reference/total_volume))
+
+        if averager is not None:
+            # Profile of every component (rows) of the difference:
+            profile = averager.average(difference.T.reshape(-1, len(cell_volumes)))
+            axial.append(profile[0] if difference.ndim == 1 else profile)
+
+    results = {name: np.asarray(values, dtype=float) for name, values in results.items()}
+    if averager is not None:
+        results["z"] = averager.z_dots
+        results["axial"] = np.asarray(axial) if len(axial) > 0 else np.empty((0, num_zdots))
+
+    return results
+
+
+def _common_timesteps(timesteps_a: list[str], timesteps_b: list[str]) -> list[tuple]:
+    """(timestep, index in a, index in b) of the timesteps of a that
+    are also in b, matched by their value"""
+
+    index_b = {float(ts): i for i, ts in enumerate(timesteps_b)}
+    return [(ts, i, index_b[float(ts)]) for i, ts in enumerate(timesteps_a) if float(ts) in index_b]
+
+
+def _fields(data: dict, fields) -> list[str]:
+    if fields is None:
+        return case_store.data_fields(data)
+    if isinstance(fields, str):
+        return [fields]
+    return list(fields)
+
+
+def compare_cases(  data_a: dict,
+                    data_b: dict,
+                    fields=None,
+                    timesteps=None,
+                    num_zdots: int = None,
+                    z_range: tuple[float, float] = None
+                ) -> dict:
+    """Compare the fields of two simulations with the same meshes
+
+    The timesteps of both simulations with the same time are
+    compared, and the differences are a - b (b is the reference for
+    L2_relative).
+
+    Parameters
+    ----------
+    data_a, data_b : dict
+        dictionaries with the results from the simulations (or
+        SimulationData)
+    fields : str or list[str]
+        Field or fields to compare. By default, all the fields of
+        data_a.
+    timesteps : str or list[str]
+        Timesteps to compare, matched as in select_timesteps. By
+        default, all the timesteps in both simulations.
+    num_zdots : int
+        If given, also compute the axial profile of the differences,
+        with num_zdots points.
+    z_range : tuple[float, float]
+        (min_z, max_z) of the axial profiles, as in
+        get_axial_averager
+
+    Returns
+    -------
+    comparison : dict
+        {field: {"timesteps": timesteps compared, "L1", "L2", "Linf",
+        "L2_relative": shape (timesteps,), and with num_zdots "z" and
+        "axial": shape (timesteps, num_zdots), or (timesteps, 3,
+        num_zdots) for vector fields}}
+
+    Raises
+    ------
+    ValueError
+        If the mesh of a field is not the same in both simulations
+
+    """
+
+    fields = _fields(data_a, fields)
+    _check_compatible(data_a, data_b, fields)
+    if isinstance(timesteps, str):
+        timesteps = [timesteps]
+
+    comparison = {}
+    for field in fields:
+        timesteps_key, mesh_key = case_store.field_keys(field)
+        common = _common_timesteps(list(data_a[timesteps_key]), list(data_b[timesteps_key]))
+        if timesteps is not None:
+            selected = set(data_handling_functions.select_timesteps([ts for ts, _, _ in common],
+                                                                    timesteps=timesteps))
+            common = [entry for entry in common if entry[0] in selected]
+
+        pairs = ((data_a[field][i], data_b[field][j]) for _, i, j in common)
+        comparison[field] = {"timesteps": [ts for ts, _, _ in common],
+                             **_compare_pairs(pairs, data_a[mesh_key], num_zdots, z_range)}
+
+    return comparison
+
+
+def compare_timesteps(  data: dict,
+                        timestep_a: str,
+                        timestep_b: str,
+                        fields=None,
+                        num_zdots: int = None,
+                        z_range: tuple[float, float] = None
+                    ) -> dict:
+    """Compare the fields of two timesteps of a simulation
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    timestep_a, timestep_b : str
+        Timesteps to compare (the difference is a - b). Fields
+        without both timesteps are skipped.
+    fields, num_zdots, z_range
+        As in compare_cases
+
+    Returns
+    -------
+    comparison : dict
+        {field: measures of the difference}, as in compare_cases,
+        with shape (1,) (or (1, num_zdots))
+
+    """
+
+    comparison = {}
+    for field in _fields(data, fields):
+        timesteps_key, mesh_key = case_store.field_keys(field)
+        values = {float(ts): i for i, ts in enumerate(data[timesteps_key])}
+        if float(timestep_a) not in values or float(timestep_b) not in values:
+            continue
+
+        pairs = [(data[field][values[float(timestep_a)]], data[field][values[float(timestep_b)]])]
+        comparison[field] = {"timesteps": [timestep_a],
+                             **_compare_pairs(pairs, data[mesh_key], num_zdots, z_range)}
+
+    return comparison
+
+
+def convergence_history(    data: dict,
+                            fields=None,
+                            num_zdots: int = None,
+                            z_range: tuple[float, float] = None
+                        ) -> dict:
+    """Compute the change of the fields between consecutive timesteps
+
+    For every timestep but the first one, the difference with the
+    previous timestep. Each timestep is read once, so it works with
+    the lazy fields of a SimulationData.
+
+    history = convergence_history( data, "FluidTemperature" )
+    plt.semilogy(history["FluidTemperature"]["timesteps"], history["FluidTemperature"]["L2_relative"])
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    fields, num_zdots, z_range
+        As in compare_cases
+
+    Returns
+    -------
+    history : dict
+        {field: {"timesteps": timesteps but the first one, and the
+        measures of their difference with the previous one, as in
+        compare_cases}}
+
+    """
+
+    def consecutive(field):
+        previous = None
+        for values in data[field]:
+            if previous is not None:
+                yield values, previous
+            previous = values
+
+    history = {}
+    for field in _fields(data, fields):
+        timesteps_key, mesh_key = case_store.field_keys(field)
+        history[field] = {"timesteps": list(data[timesteps_key])[1:],
+                          **_compare_pairs(consecutive(field), data[mesh_key], num_zdots, z_range)}
+
+    return history
+
+
+def _load(data) -> dict:
+    """Data of a simulation, loaded if it is the name of a joblib file
+    or case store"""
+
+    if isinstance(data, str):
+        return data_handling_functions.load_simulation_data(data)
+    return data
+
+
+def _compare_task(reference, case, fields, timesteps, num_zdots, z_range) -> dict:
+    return compare_cases(_load(case), _load(reference), fields, timesteps, num_zdots, z_range)
+
+
+def compare_batch(  reference,
+                    cases: list,
+                    fields=None,
+                    timesteps=None,
+                    num_zdots: int = None,
+                    z_range: tuple[float, float] = None,
+                    workers: int = None
+                ) -> list[dict]:
+    """Compare several simulations with a reference, maybe in parallel
+
+    Parameters
+    ----------
+    reference : str or dict
+        Reference simulation: the name of its joblib file or case
+        store (see load_simulation_data), or its data
+    cases : list
+        Simulations to compare, as reference. With workers, names are
+        better than data, since they are loaded by every process
+        instead of being sent to it (case stores are memory-mapped,
+        so they are loaded at almost no cost).
+    fields, timesteps, num_zdots, z_range
+        As in compare_cases
+    workers : int
+        Number of processes. By default (None), the cases are
+        compared one after another in this process.
+
+    Returns
+    -------
+    list[dict]
+        compare_cases(case, reference) for every case, in the same
+        order. The differences are case - reference.
+
+    """
+
+    if workers is None or workers <= 1:
+        reference = _load(reference)
+
+    tasks = [(_compare_task, reference, case, fields, timesteps, num_zdots, z_range) for case in cases]
+
+    return data_handling_functions._run_tasks(tasks, workers)
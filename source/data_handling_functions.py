@@ -6,8 +6,12 @@ to work with the simulations generated automatically by the
 associated program (at time of writing, not yet included as a GitHub
 project, but it will be!).
 
-This module requires the module Ofpp (OpenFOAM Post Processing).
-It also uses os, subprocess, warnings, joblib
+This module requires the module Ofpp (OpenFOAM Post Processing). 
+Field files are read with the faster reader of field_reader.py.
+Cell centres and volumes missing from the case are computed with
+mesh_geometry.py.
+It also uses os, re, subprocess, warnings, joblib, json, hashlib, 
+concurrent.futures
 
 """
 
@@ -15,9 +19,19 @@ It also uses os, subprocess, warnings, joblib
 import Ofpp
 import time
 import os
+import re
 import subprocess
 import warnings
 import joblib
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import case_store
+import decomposed_case
+import field_reader
+import mesh_cache
+import mesh_geometry
 
 class CaseParameters:
     """Container class to store the parameters of a simulation.
@@ -178,7 +192,9 @@ class CaseParameters:
             "solid_cp": self.solid_cp,
             "fluid_Pr": self.fluid_Pr,
             "fluid_k": self.fluid_k,
+            "solid_k": self.solid_k,
             "fluid_mu": self.fluid_mu,
+            "porosity": self.porosity,
             "R": self.R,
             "Rchannels": self.Rchannels,
             "Rep": self.Rep,
@@ -187,8 +203,218 @@ class CaseParameters:
         }
 
 
+# Names of the env variables with the parameters of the simulation:
+CONFIG_VAR_NAMES = ['RHO', 'FluidCP', 'RHO_s', 'SolidCP', 'porosity', 'wallTemp', 'R', 'FluidPr', 'SolidK', 'MU', 'inletTemp', 'Rchannels', 'caseRep']
+
+# Ways of reading the config file in load_case_properties:
+CONFIG_METHODS = ('python', 'bash', 'auto')
+
+_ASSIGNMENT = re.compile(r'(?P<export>export\s+)?(?P<name>[A-Za-z_]\w*)=')
+_EXPORT = re.compile(r'export((?:\s+[A-Za-z_]\w*)+)\s*(?:#.*)?$')
+_VARIABLE = re.compile(r'\{([A-Za-z_]\w*)\}|([A-Za-z_]\w*)')
+# Characters with a meaning for bash that the parser does not handle:
+_UNSUPPORTED = set('`;&|<>()')
+
+
+class ConfigParseError(ValueError):
+    """The case config file uses bash features parse_case_config does
+    not handle. load_case_properties(method='bash') can read it."""
+
+
+def _expand_variable(text: str, pos: int, variables: dict) -> tuple[str, int]:
+    """Expand the $NAME or ${NAME} starting at text[pos] (the '$')"""
+
+    match = _VARIABLE.match(text, pos + 1)
+    if match is None:
+        if text.startswith(('${', '$('), pos) or text[pos+1:pos+2] in ('?', '#', '@', '*', '!', '$', '-') \
+                or text[pos+1:pos+2].isdigit():
+            raise ConfigParseError(f"unsupported expansion in {text!r}")
+        # A '$' not followed by a name is kept as is
+        return '$', pos + 1
+
+    name = match.group(1) or match.group(2)
+    # As in bash, undefined variables expand to nothing
+    return variables.get(name, ''), match.end()
+
+
+def _parse_value(text: str, variables: dict) -> str:
+    """Value of the right-hand side of an assignment, as bash gives it"""
+
+    value = []
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if char.isspace():
+            # Only a comment can follow the value
+            rest = text[pos:].strip()
+            if rest and not rest.startswith('#'):
+                raise ConfigParseError(f"unsupported command after assignment: {text!r}")
+            break
+        elif char == "'":
+            end = text.find("'", pos + 1)
+            if end < 0:
+                raise ConfigParseError(f"unterminated quote in {text!r}")
+            value.append(text[pos+1:end])
+            pos = end + 1
+        elif char == '"':
+            pos += 1
+            while True:
+                if pos >= len(text):
+                    raise ConfigParseError(f"unterminated quote in {text!r}")
+                char = text[pos]
+                if char == '"':
+                    pos += 1
+                    break
+                elif char == '\\' and text[pos+1:pos+2] in ('$', '`', '"', '\\'):
+                    value.append(text[pos+1])
+                    pos += 2
+                elif char == '$':
+                    expanded, pos = _expand_variable(text, pos, variables)
+                    value.append(expanded)
+                elif char == '`':
+                    raise ConfigParseError(f"unsupported command substitution in {text!r}")
+                else:
+                    value.append(char)
+                    pos += 1
+        elif char == '\\':
+            if pos + 1 >= len(text):
+                raise ConfigParseError(f"unsupported line continuation in {text!r}")
+            value.append(text[pos+1])
+            pos += 2
+        elif char == '$':
+            expanded, pos = _expand_variable(text, pos, variables)
+            value.append(expanded)
+        elif char in _UNSUPPORTED:
+            raise ConfigParseError(f"unsupported character {char!r} in {text!r}")
+        else:
+            value.append(char)
+            pos += 1
+
+    return ''.join(value)
+
+
+def parse_case_config(config_path: str, environ: dict = None) -> dict:
+    """Read the variables exported by a case config file, without bash
+
+    Handles the assignments of caseConfig.sh files,
+    export NAME="value" (also with 'single' quotes, unquoted, or
+    NAME=value followed by export NAME), with $NAME and ${NAME}
+    references to variables set earlier in the file or in the
+    environment, and comments. Anything else (other commands,
+    command substitutions, ${NAME:-default}...) raises a
+    ConfigParseError.
+
+    Parameters
+    ----------
+    config_path : str
+        Path to the config file
+    environ : dict
+        Environment the $NAME references are resolved in when the
+        file does not set NAME. By default, os.environ.
+
+    Returns
+    -------
+    exported : dict
+        {name: value} (str) of the variables exported by the file, as
+        seen by the programs run after sourcing it
+
+    """
+
+    variables = dict(os.environ if environ is None else environ)
+    exported = {}
+    exported_names = set()
+
+    with open(config_path, 'r') as f:
+        lines = f.read().splitlines()
+
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        try:
+            match = _ASSIGNMENT.match(line)
+            if match is not None:
+                name = match.group('name')
+                variables[name] = _parse_value(line[match.end():], variables)
+                if match.group('export') or name in exported_names:
+                    exported_names.add(name)
+                    exported[name] = variables[name]
+                continue
+
+            match = _EXPORT.match(line)
+            if match is not None:
+                for name in match.group(1).split():
+                    exported_names.add(name)
+                    if name in variables:
+                        exported[name] = variables[name]
+                continue
+
+            raise ConfigParseError(f"unsupported command {line!r}")
+        except ConfigParseError as error:
+            raise ConfigParseError(f"{config_path}, line {line_number}: {error}") from None
+
+    return exported
+
+
+def _read_config_bash(config_paths: list[str]) -> list[dict]:
+    """Environment after sourcing each config file, in one bash process"""
+
+    # Each file is sourced in a subshell, so that its variables do
+    # not leak into the next one
+    separator = '__END_OF_CASE_CONFIG__'
+    script = f'for f in "$@"; do (source "$f" > /dev/null && env); echo {separator}; done'
+    result = subprocess.run(['/bin/bash', '-c', script, 'bash'] + list(config_paths),
+                            stdout=subprocess.PIPE, text=True)
+
+    env_vars = [{}]
+    for line in result.stdout.splitlines():
+        if line == separator:
+            env_vars.append({})
+            continue
+        key, _, value = line.partition('=')
+        env_vars[-1][key] = value
+
+    return env_vars[:len(config_paths)]
+
+
+def _case_parameters(env_vars: dict, config_path: str) -> CaseParameters:
+    """CaseParameters from the variables of a config file"""
+
+    missing = [name for name in CONFIG_VAR_NAMES if name not in env_vars]
+    if missing:
+        raise ConfigParseError(f"{config_path} does not define {', '.join(missing)}")
+
+    # The conductivity of the fluid is not declared as a parameter, 
+    # must be calculated from the Prandtl number:
+    Pr = float(env_vars['FluidPr'])
+    mu = float(env_vars['MU'])
+    cp_fluid = float(env_vars['FluidCP'])
+    fluid_k = cp_fluid*mu/Pr
+
+    params = CaseParameters(
+        float(env_vars['RHO']),
+        float(env_vars['RHO_s']),
+        cp_fluid,
+        float(env_vars['SolidCP']),
+        Pr,
+        fluid_k,
+        float(env_vars['SolidK']),
+        mu,
+        float(env_vars['porosity']),
+        float(env_vars['R'])*0.001,
+        float(env_vars['Rchannels'])*0.001,
+        float(env_vars['caseRep']),
+        float(env_vars['wallTemp']),
+        float(env_vars['inletTemp'])
+    )
+
+    return params
+
+
 def load_case_properties(   case_path: str, 
-                            config_file_name: str = 'caseConfig.sh' 
+                            config_file_name: str = 'caseConfig.sh',
+                            method: str = 'python'
                         ) -> CaseParameters:
     """Function for reading simulation parameters from config file
 
@@ -203,6 +429,13 @@ def load_case_properties(   case_path: str,
         Relative path to the case folder
     config_file_name : str
         Name of the case config file (default name 'caseConfig.sh')
+    method : str
+        How the config file is read:
+        'python': (default) with parse_case_config, in this process.
+        'bash': by sourcing it with bash, for config files with
+        commands the parser does not handle.
+        'auto': with parse_case_config, falling back to bash if it
+        raises a ConfigParseError.
 
     Returns
     -------
@@ -211,48 +444,59 @@ def load_case_properties(   case_path: str,
 
     """
 
-    # The parameters of the simulation are saved in a bash file and 
-    # exported as environment variables. It is done this way because
-    # OpenFOAM dictionaries can read environment variables directly.
+    return load_case_properties_batch([case_path], config_file_name, method)[0]
 
-    # To get the values, we source that bash file and get the env 
-    # variables.
-    command = f'source {os.path.join(case_path, config_file_name)} && env'
 
-    # These are the names of the env variables
-    var_names = ['RHO', 'FluidCP', 'RHO_s', 'SolidCP', 'porosity', 'wallTemp', 'R', 'FluidPr', 'SolidK', 'MU', 'inletTemp', 'Rchannels', 'caseRep']
-    result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, executable='/bin/bash', text=True)
+def load_case_properties_batch( case_paths: list[str],
+                                config_file_name: str = 'caseConfig.sh',
+                                method: str = 'python'
+                            ) -> list[CaseParameters]:
+    """Read the simulation parameters of many cases in one call
 
-    # Parse the output to find only the desired variables
-    env_vars = {}
-    for line in result.stdout.splitlines():
-        key, _, value = line.partition('=')
-        if key in var_names:
-            env_vars[key] = value
+    As load_case_properties for every case. With method 'bash' (or
+    'auto', for the files the parser cannot read), all the config
+    files are sourced in a single bash process.
 
-    # The conductivity of the fluid is not declared as a parameter, 
-    # must be calculated from the Prandtl number:
-    Pr = float(env_vars.get('FluidPr', None))
-    mu = float(env_vars.get('MU', None))
-    cp_fluid = float(env_vars.get('FluidCP', None))
-    fluid_k = cp_fluid*mu/Pr
+    Parameters
+    ----------
+    case_paths : list[str]
+        Relative paths to the case folders
+    config_file_name, method
+        As in load_case_properties
 
-    params = CaseParameters(
-        float(env_vars.get('RHO', None)),
-        float(env_vars.get('RHO_s', None)),
-        cp_fluid,
-        float(env_vars.get('SolidCP', None)),
-        Pr,
-        fluid_k,
-        float(env_vars.get('SolidK', None)),
-        mu,
-        float(env_vars.get('porosity', None)),
-        float(env_vars.get('R', None))*0.001,
-        float(env_vars.get('Rchannels', None))*0.001,
-        float(env_vars.get('caseRep', None)),
-        float(env_vars.get('wallTemp', None)),
-        float(env_vars.get('inletTemp', None))
-    )
+    Returns
+    -------
+    list[CaseParameters]
+        Parameters of each case, in the same order as case_paths
+
+    """
+
+    if method not in CONFIG_METHODS:
+        raise ValueError(f"method must be one of {CONFIG_METHODS}, not {method!r}")
+
+    # The parameters of the simulation are saved in a bash file and 
+    # exported as environment variables. It is done this way because
+    # OpenFOAM dictionaries can read environment variables directly.
+    config_paths = [os.path.join(case_path, config_file_name) for case_path in case_paths]
+    params = [None]*len(config_paths)
+
+    # Files left to be sourced with bash:
+    pending = []
+    for i, config_path in enumerate(config_paths):
+        if method == 'bash':
+            pending.append(i)
+            continue
+        try:
+            params[i] = _case_parameters(parse_case_config(config_path), config_path)
+        except ConfigParseError:
+            if method == 'python':
+                raise
+            pending.append(i)
+
+    if pending:
+        env_vars = _read_config_bash([config_paths[i] for i in pending])
+        for i, case_vars in zip(pending, env_vars):
+            params[i] = _case_parameters(case_vars, config_paths[i])
 
     return params
 
@@ -310,12 +554,443 @@ def get_timestep_folders(case_path: str) -> list[str]:
     return sorted(timestep_folders, key=lambda x: float(x))
 
 
+def _read_mesh(case_path: str, region_name: str, mesh_cache_dir: str = None) -> Ofpp.FoamMesh:
+    """Read the mesh of a region, with its cell centres and volumes
+
+    With a mesh_cache_dir, the mesh is taken from that mesh cache (or
+    parsed and added to it), see mesh_cache.py module.
+
+    """
+
+    if mesh_cache_dir is not None:
+        return mesh_cache.load_mesh(case_path, region_name, mesh_cache_dir)
+
+    mesh = Ofpp.FoamMesh(case_path, region_name)
+
+    # Read the coordinates of the centers of cells and their volumes
+    # from the 'C' and 'V' mesh files of the region. These files are
+    # created by OpenFOAM's own postprocessing utilities. If they
+    # have not been generated, they are computed from the polyMesh.
+    mesh.cell_centres = None
+    mesh.cell_volumes = None
+    if os.path.isfile(case_path+'0/'+region_name+'C'):
+        mesh.cell_centres = field_reader.read_internal_field(case_path+'0/'+region_name+'C')
+    if os.path.isfile(case_path+'0/'+region_name+'V'):
+        mesh.cell_volumes = field_reader.read_internal_field(case_path+'0/'+region_name+'V')
+    if mesh.cell_centres is None or mesh.cell_volumes is None:
+        cell_centres, cell_volumes = mesh_geometry.compute_cell_geometry(mesh)
+        if mesh.cell_centres is None:
+            mesh.cell_centres = cell_centres
+        if mesh.cell_volumes is None:
+            mesh.cell_volumes = cell_volumes
+
+    return mesh
+
+
+def _case_timesteps(case_path: str, decomposed: bool = None) -> tuple[list[str], list[str], set]:
+    """Timesteps of a case, also those only in processor directories
+
+    Returns
+    -------
+    timesteps : list[str]
+        Names of the timestep folders, sorted numerically
+    processors : list[str]
+        Names of the processor directories ([] if they are not used)
+    from_processors : set
+        Timesteps to read from the processor directories
+
+    """
+
+    processors = decomposed_case.processor_folders(case_path) if decomposed is not False else []
+    if not processors:
+        return get_timestep_folders(case_path), [], set()
+
+    # Timesteps that have been reconstructed are read from the case 
+    # folder (unless decomposed=True), the rest from the processors
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        reconstructed = get_timestep_folders(case_path) if decomposed is None else []
+        from_processors = set(get_timestep_folders(case_path + processors[0] + '/')) - set(reconstructed)
+    timesteps = sorted(set(reconstructed) | from_processors, key=lambda x: float(x))
+
+    if len(timesteps) <= 1:
+        warnmessage = "No timestep folders found in " + case_path + " nor in its processor directories"
+        warnings.warn(warnmessage)
+
+    return timesteps, processors, from_processors
+
+
+def select_timesteps(   available: list[str],
+                        mode: str = 'all',
+                        timesteps: list = None,
+                        time_window: tuple[float, float] = None,
+                        stride: int = 1,
+                        latest: int = None
+                    ) -> list[str]:
+    """Select timesteps of a simulation
+
+    The filters are applied in this order: timesteps, time_window, 
+    stride, latest, and then mode.
+
+    selected = select_timesteps( timesteps, time_window=(5, 15), stride=2 )
+
+    Parameters
+    ----------
+    available : list[str]
+        Names of the timestep folders of the simulation, sorted, 
+        including the '0' folder (which is never selected), as 
+        returned by get_timestep_folders
+    mode : str
+        'all' (default) keeps all the timesteps selected by the rest
+        of the filters, 'last' only the last of them.
+    timesteps : list
+        Only the timesteps in this list, by name or by time (e.g. 
+        ['6.0000491', 12]). By default (None), all of them.
+    time_window : tuple[float, float]
+        (min_time, max_time), only the timesteps in between, both 
+        included. Any of them can be None for no limit.
+    stride : int
+        Only every stride-th timestep, starting from the first one. 
+        By default (1), all of them.
+    latest : int
+        Only the last latest timesteps. By default (None), all of 
+        them.
+
+    Raises
+    ------
+    ValueError
+        If mode is not 'all' or 'last', or stride or latest are not
+        positive
+
+    Returns
+    -------
+    selected : list[str]
+        Names of the selected timestep folders, sorted
+
+    """
+
+    if mode not in ('all', 'last'):
+        raise ValueError("mode argument must be either 'all' or 'last'")
+    if stride < 1 or (latest is not None and latest < 1):
+        raise ValueError("stride and latest must be positive")
+
+    # Timestep [0] is the '0' folder, skip that one.
+    selected = list(available[1:])
+    if timesteps is not None:
+        times = {float(ts) for ts in timesteps}
+        selected = [ts for ts in selected if float(ts) in times]
+    if time_window is not None:
+        min_time, max_time = time_window
+        selected = [ts for ts in selected
+                    if (min_time is None or float(ts) >= min_time) and (max_time is None or float(ts) <= max_time)]
+    selected = selected[::stride]
+    if latest is not None:
+        selected = selected[-latest:]
+    if mode == 'last':
+        selected = selected[-1:]
+
+    return selected
+
+
+def _select_fields( fields: list[str] = None,
+                    regions: list[str] = None
+                ) -> tuple[list[str], list[str]]:
+    """Fields and meshes to read
+
+    Parameters
+    ----------
+    fields, regions
+        As in read_simulation_data
+
+    Returns
+    -------
+    fields : list[str]
+        Names of the fields to read
+    mesh_keys : list[str]
+        Keys of the meshes to read (e.g. "FluidMesh")
+
+    """
+
+    if regions is not None:
+        unknown = set(regions) - {"fluid", "solid"}
+        if unknown:
+            raise ValueError(f"Unknown regions {sorted(unknown)}, regions must be 'fluid' or 'solid'")
+        mesh_keys = [key for region, key in (("fluid", "FluidMesh"), ("solid", "SolidMesh"))
+                     if region in regions]
+
+    if fields is None:
+        # The fields of the selected regions (all by default)
+        fields = [field for field in case_store.FIELD_TIMESTEPS
+                  if regions is None or case_store.field_keys(field)[1] in mesh_keys]
+    fields = list(dict.fromkeys(fields))
+
+    field_meshes = [case_store.field_keys(field)[1] for field in fields]
+    if regions is None:
+        mesh_keys = [key for key in case_store.MESH_KEYS if key in field_meshes or not fields]
+    elif not set(field_meshes) <= set(mesh_keys):
+        raise ValueError("The regions of the selected fields must be in regions")
+
+    return fields, mesh_keys
+
+
+def _select_case_files(    case_path: str,
+                            fluid_region_name: str = 'FluidRegion/',
+                            solid_region_name: str = 'CatalystRegion/',
+                            momentum_simulation_folder: str = 'MomentumSolution/',
+                            mode: str = 'last',
+                            decomposed: bool = None,
+                            fields: list[str] = None,
+                            verbose: bool = True,
+                            **selection
+                        ) -> tuple[dict, dict]:
+    """Select the timesteps to read and the file of each field
+
+    Parameters
+    ----------
+    case_path, fluid_region_name, solid_region_name, 
+    momentum_simulation_folder, mode, decomposed
+        As in read_simulation_data
+    fields : list[str]
+        Names of the fields (see case_store.field_region). By default
+        (None), the four fields of case_store.FIELD_TIMESTEPS. The 
+        timestep folders of a simulation are only listed if some of 
+        its fields are selected.
+    verbose : bool
+        Print the timesteps found (default True)
+    **selection
+        timesteps, time_window, stride and latest, as in 
+        select_timesteps
+
+    Returns
+    -------
+    field_timesteps : dict
+        Timesteps to read, as {"ThermalTimesteps": list[str], 
+        "MomentumTimesteps": list[str]}
+    field_files : dict
+        For each field (e.g. "FluidTemperature"), the list of the 
+        files of its timesteps, in the same order. Timesteps read 
+        from processor directories are given by a 
+        decomposed_case.DecomposedField instead of a file.
+
+    """
+
+    if fields is None:
+        fields = list(case_store.FIELD_TIMESTEPS)
+    field_regions = {field: case_store.field_region(field) for field in fields}
+    timesteps_keys = {case_store.field_keys(field)[0] for field in fields}
+
+    # Since the simulations for momentum and temperature are decoupled,
+    # we have different timesteps for each of the simulations:
+    momentum_path = case_path + momentum_simulation_folder
+    timesteps_momentum, processors_momentum, from_processors_momentum = [], [], set()
+    timesteps_thermal, processors_thermal, from_processors_thermal = [], [], set()
+    if "MomentumTimesteps" in timesteps_keys:
+        timesteps_momentum, processors_momentum, from_processors_momentum = _case_timesteps(momentum_path, decomposed)
+        if verbose:
+            print("Timesteps momentum simulation: ",timesteps_momentum)
+    if "ThermalTimesteps" in timesteps_keys:
+        timesteps_thermal, processors_thermal, from_processors_thermal = _case_timesteps(case_path, decomposed)
+        if verbose:
+            print("Timesteps thermal simulation: ",timesteps_thermal)
+
+    field_timesteps = {"ThermalTimesteps": select_timesteps(timesteps_thermal, mode, **selection),
+                       "MomentumTimesteps": select_timesteps(timesteps_momentum, mode, **selection)}
+
+    def thermal_file(ts, region_name, field_name):
+        if ts in from_processors_thermal:
+            return decomposed_case.decomposed_field(case_path, processors_thermal, ts, region_name, field_name)
+        return case_path + ts + '/' + region_name + field_name
+
+    def momentum_file(ts, field_name):
+        if ts in from_processors_momentum:
+            return decomposed_case.decomposed_field(momentum_path, processors_momentum, ts, '', field_name)
+        return momentum_path + ts + '/' + field_name
+
+    # Files each timestep of each field is read from:
+    field_files = {}
+    for field, (region, field_name) in field_regions.items():
+        if region == "momentum":
+            field_files[field] = [momentum_file(ts, field_name) for ts in field_timesteps["MomentumTimesteps"]]
+        else:
+            region_name = fluid_region_name if region == "fluid" else solid_region_name
+            field_files[field] = [thermal_file(ts, region_name, field_name)
+                                  for ts in field_timesteps["ThermalTimesteps"]]
+
+    return field_timesteps, field_files
+
+
+def _mesh_files(case_path: str, region_name: str) -> list[str]:
+    """Files the mesh of a region (and its C and V) is read from"""
+
+    mesh_path = os.path.join(case_path, 'constant', region_name, 'polyMesh')
+    files = [os.path.join(mesh_path, name) for name in ('boundary', 'points', 'faces', 'owner', 'neighbour')]
+    files += [case_path+'0/'+region_name+'C', case_path+'0/'+region_name+'V']
+
+    return files
+
+
+def _file_signature(fn: str, hash_files: bool = False, previous: dict = None) -> dict:
+    """Size, modification time and (optionally) hash of a file
+
+    The hash of a file whose size and modification time are the same
+    as in the previous signature is not computed again.
+
+    """
+
+    if not os.path.isfile(fn):
+        return None
+
+    stat = os.stat(fn)
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if hash_files:
+        if previous is not None and "sha1" in previous and previous["size"] == stat.st_size \
+                and previous["mtime_ns"] == stat.st_mtime_ns:
+            signature["sha1"] = previous["sha1"]
+        else:
+            sha1 = hashlib.sha1()
+            with open(fn, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha1.update(block)
+            signature["sha1"] = sha1.hexdigest()
+
+    return signature
+
+
+def _same_file(previous: dict, current: dict) -> bool:
+    """Check if a file has not changed since it was last read
+
+    The file is the same if it has the same size and either the same
+    modification time or, when both are known, the same hash.
+
+    """
+
+    if previous is None or current is None or previous["size"] != current["size"]:
+        return False
+    if previous["mtime_ns"] == current["mtime_ns"]:
+        return True
+    return "sha1" in previous and previous.get("sha1") == current.get("sha1")
+
+
+def _check_files(   files: list[str],
+                    case_path: str,
+                    sources: dict,
+                    previous_sources: dict,
+                    hash_files: bool = False
+                ) -> bool:
+    """Record the signatures of some files and check if they changed
+
+    Parameters
+    ----------
+    files : list[str]
+        Files to check
+    case_path : str
+        Relative path to the case folder. Files are recorded by their
+        path relative to it.
+    sources : dict
+        Signatures of the files read in this run, updated with files
+    previous_sources : dict
+        Signatures recorded in the previous run
+    hash_files : bool
+        Also compute the hash of the files
+
+    Returns
+    -------
+    bool
+        True if none of the files changed since the previous run. A
+        file missing in both runs (e.g. C and V, which are then
+        computed) is unchanged.
+
+    """
+
+    all_unchanged = True
+    for fn in files:
+        name = os.path.relpath(fn, case_path)
+        sources[name] = _file_signature(fn, hash_files, previous_sources.get(name))
+        if sources[name] is None and name in previous_sources and previous_sources[name] is None:
+            continue
+        all_unchanged &= _same_file(previous_sources.get(name), sources[name])
+
+    return all_unchanged
+
+
+def _sources_filename(datafilename: str) -> str:
+    """File where the signatures of the files read are recorded"""
+
+    if os.path.isdir(datafilename):
+        return os.path.join(datafilename, 'sources.json')
+    return datafilename + '.sources.json'
+
+
+def _write_sources(datafilename: str, sources: dict):
+    with open(_sources_filename(datafilename), 'w') as f:
+        json.dump(sources, f, indent=1)
+
+
+def _load_previous_data(datafilename: str) -> tuple[dict, dict]:
+    """Data and file signatures saved by a previous run, if any"""
+
+    sources_filename = _sources_filename(datafilename)
+    if not (os.path.exists(datafilename) and os.path.isfile(sources_filename)):
+        return {}, {}
+
+    with open(sources_filename) as f:
+        sources = json.load(f)
+
+    return load_simulation_data(datafilename), sources
+
+
+def _run_task(function, *args):
+    return function(*args)
+
+
+def _run_tasks(tasks: list, workers: int = None) -> list:
+    """Run a list of (function, *args) tasks, maybe in parallel
+
+    Parameters
+    ----------
+    tasks : list[tuple]
+        Tasks to run, as tuples (function, arg1, arg2...). Functions 
+        must be defined at module level so that they can be sent to 
+        other processes.
+    workers : int
+        Number of processes. None or 1 runs the tasks in this 
+        process, one after another.
+
+    Returns
+    -------
+    list
+        Result of every task, in the same order as tasks
+
+    """
+
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        return [_run_task(*task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        futures = [pool.submit(_run_task, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+
 def read_simulation_data(   case_path: str, 
                             fluid_region_name: str = 'FluidRegion/', 
                             solid_region_name: str = 'CatalystRegion/', 
                             momentum_simulation_folder: str = 'MomentumSolution/',
                             config_file_name: str = 'caseConfig.sh',
-                            mode: str = 'last'
+                            mode: str = 'last',
+                            store_format: str = 'joblib',
+                            workers: int = None,
+                            incremental: bool = False,
+                            hash_files: bool = False,
+                            decomposed: bool = None,
+                            mesh_cache_dir: str = None,
+                            dtype: str = 'float64',
+                            compression: str = None,
+                            fields: list[str] = None,
+                            regions: list[str] = None,
+                            timesteps: list = None,
+                            time_window: tuple[float, float] = None,
+                            stride: int = 1,
+                            latest: int = None
                         ) -> str:
     """Function for reading the simulation data (mesh and results)
 
@@ -343,11 +1018,79 @@ def read_simulation_data(   case_path: str,
         Set which timesteps to read and save to file. Default is 
         'last' which just reads the last timestep of the thermal 
         simulation. Option 'all' reads all the existing timesteps.
+        With timesteps, time_window, stride or latest, 'last' reads 
+        the last of the timesteps they select (see select_timesteps).
+    store_format : str
+        Format of the saved data. Default is 'joblib', a single 
+        joblib file. Option 'columnar' saves a case store directory 
+        instead, with one .npy file per array (see case_store.py 
+        module). Use load_simulation_data to read either of them.
+    workers : int
+        Number of processes used to parse the meshes and the field 
+        files in parallel. By default (None or 1) everything is read 
+        in this process. The result is the same in both cases.
+    incremental : bool
+        If True and the data file already exists, only the files 
+        that are new or have changed since the previous run are 
+        parsed; the rest is taken from the data file. With 
+        store_format='columnar' only the new arrays are written. The 
+        size and modification time of every file read are recorded 
+        next to the data file. Default False.
+    hash_files : bool
+        Also record the SHA-1 hash of every file read. In incremental
+        mode, files whose modification time changed but whose hash 
+        did not are then not parsed again. Default False.
+    decomposed : bool
+        How to read cases decomposed for a parallel run (with 
+        processor* directories). By default (None), timesteps that 
+        have not been reconstructed with reconstructPar are read 
+        straight from the processor directories, and put together 
+        with their cellProcAddressing (see decomposed_case.py 
+        module). True reads all the timesteps from the processor 
+        directories, False ignores them. The result is the same as 
+        reading the reconstructed case.
+    mesh_cache_dir : str
+        Path to a mesh cache directory shared by many cases (see 
+        mesh_cache.py module). If given, meshes already parsed for a
+        case with identical mesh files are taken from the cache, 
+        and the saved data only refer to the cached meshes instead 
+        of containing a copy of them. By default (None) meshes are 
+        parsed and saved with the data of every case.
+    dtype : str
+        Data type of the saved fields, 'float64' (default, as in the 
+        OpenFOAM files) or 'float32', which halves their size.
+    compression : str
+        Compress the saved fields with 'zlib' or, if the lz4 package 
+        is installed, 'lz4' (faster). With store_format='columnar' 
+        every field array is compressed on its own (see case_store.py
+        module), otherwise the whole joblib file is. By default 
+        (None) nothing is compressed, and the arrays of case stores 
+        can be memory-mapped.
+    fields : list[str]
+        Fields to read, out of "FluidTemperature", 
+        "SolidTemperature", "StaticPressure" and "VelocityField". 
+        Any other field file can be read too by naming it as 
+        '<region>/<file name>', with region 'fluid', 'solid' or 
+        'momentum' (e.g. 'fluid/p_rgh', 'momentum/p'), and it is 
+        saved under that name. By default (None), the four fields 
+        above (only those of the regions, if given). Files of the
+        fields that are not selected are never opened.
+    regions : list[str]
+        Meshes to read: 'fluid' (FluidMesh) and/or 'solid' 
+        (SolidMesh). By default (None), those of the selected 
+        fields. The fields of the momentum simulation are on the 
+        fluid mesh.
+    timesteps, time_window, stride, latest
+        Select the timesteps to read by name or time, by time window
+        (min_time, max_time), every stride-th one, or the latest 
+        ones (see select_timesteps). They apply to the timesteps of 
+        both simulations.
 
     Returns
     -------
     datafilename : str
-        Name of the file with the data from the results, as a string
+        Name of the file (or case store directory) with the data from
+        the results, as a string
 
     Results
     -------
@@ -357,16 +1100,21 @@ def read_simulation_data(   case_path: str,
         that file is stored in a dictionar. To load it in a script 
         run:
             dict = joblib.load('path_to_the_joblib_file.joblib')
+        or, for both joblib files and case stores (store_format=
+        'columnar'):
+            dict = load_simulation_data(datafilename)
         The dict contains the following items (identified by their 
-        key):
+        key), only the selected meshes and fields:
 
         "Parameters" : CaseParameters
             Object of class CaseParameters containing the values 
             of the parameters of this simulaton
         "SolidMesh" : Ofpp.mesh_parser.FoamMesh
-            Mesh of the solid region of the catalyst (Ofpp class)
+            Mesh of the solid region of the catalyst (Ofpp class, 
+            or case_store.CachedMesh with a mesh_cache_dir)
         "FluidMesh" : Ofpp.mesh_parser.FoamMesh
-            Mesh of the fluid region of the catalyst (Ofpp class)
+            Mesh of the fluid region of the catalyst (Ofpp class, 
+            or case_store.CachedMesh with a mesh_cache_dir)
         "MomentumTimesteps" : list[str]
             List with the timesteps of the momentum simulation (as 
             strings, the names of the folders containing each 
@@ -377,90 +1125,144 @@ def read_simulation_data(   case_path: str,
             strings, the names of the folders containing each 
             timestep. MomentumTimesteps[0]='0' is always the '0' 
             folder of the OpenFOAM simulation).
-        "FluidTemperature" : list[list[numpy.float64]]
-            List "FluidTemperature" contains one list for each 
+        "FluidTemperature" : list[numpy.ndarray]
+            List "FluidTemperature" contains one array for each 
             timestep in "ThermalTimesteps" in the same order 
             starting for the second time step (the first is the 
             initial condition).
-            For each time step, it contains a list with the 
-            temperature at the center of every cell in the fluid 
-            region. The cells are ordered in the same way as in 
-            fluidmesh.cell_centres
-        "SolidTemperature" : list[list[numpy.float64]]
+            For each time step, it contains a contiguous array of 
+            shape (N,) and type dtype with the temperature at the 
+            center of every cell in the fluid region (uniform fields
+            are expanded to all the cells). The cells are ordered in
+            the same way as in fluidmesh.cell_centres. None if the 
+            field file does not exist.
+        "SolidTemperature" : list[numpy.ndarray]
             Same as "FluidTemperature" but for the solid region.
-        "StaticPressure" : list[list[numpy.float64]]
+        "StaticPressure" : list[numpy.ndarray]
             Same as "FluidTemperature" but for static pressure instead
             of temperature.
-        "VelocityField" list[list[numpy.ndarray]]: 
+        "VelocityField" list[numpy.ndarray]: 
             Same as "FluidTemperature" but for velocity pressure 
-            instead of temperature. Since velocity is a vector, for 
-            every cell center instead of a float we have a 
-            numpy.ndarray with three elements.
+            instead of temperature. Since velocity is a vector, the 
+            arrays have shape (N, 3).
+        "<region>/<file name>" : list[numpy.ndarray]
+            Other selected fields, same as "FluidTemperature".
 
     """
 
-    # Read the fluid region mesh:
-    time1 = time.time()
-    fluidmesh = Ofpp.FoamMesh(case_path, fluid_region_name)
-
-    time2 = time.time()
-    print("Time required for reading the fluidmesh = ", time2-time1)
-
-    # Read the coordinates of the centers of cells and their volumes
-    # For this function to work user must have been generated the 'C'
-    # and 'V' mesh files for each region. These files are  created by 
-    # OpenFOAM's own postprocessing utilities.
-    fluidmesh.read_cell_centres(case_path+'0/'+fluid_region_name+'C')
-    fluidmesh.read_cell_volumes(case_path+'0/'+fluid_region_name+'V')
+    if store_format not in ('joblib', 'columnar'):
+        raise ValueError("store_format argument must be either 'joblib' (default) or 'columnar'")
+    case_store.check_storage_options(dtype, compression)
 
-    # Read the solid region mesh:
-    time3 = time.time()
-    solidmesh = Ofpp.FoamMesh(case_path, solid_region_name)
+    fields, mesh_keys = _select_fields(fields, regions)
+    field_timesteps, field_files = _select_case_files(case_path, fluid_region_name, solid_region_name,
+                                                      momentum_simulation_folder, mode, decomposed, fields,
+                                                      timesteps=timesteps, time_window=time_window,
+                                                      stride=stride, latest=latest)
+    timesteps_to_read_thermal = field_timesteps["ThermalTimesteps"]
+    timesteps_to_read_momentum = field_timesteps["MomentumTimesteps"]
 
-    time4 = time.time()
-    print("Time required for reading the solidmesh = ", time4-time3)
+    # Include the case parameters too:
+    params = load_case_properties(case_path,  config_file_name)
 
-    # Read the coordinates of the centers of cells and their volumes
-    solidmesh.read_cell_centres(case_path+'0/'+solid_region_name+'C')
-    solidmesh.read_cell_volumes(case_path+'0/'+solid_region_name+'V')
+    datafilename = case_path + "Case_P" + str(params.porosity) + "_Re" + str(params.Rep) + "_DATA"
+    if store_format == 'joblib':
+        datafilename += ".joblib"
+
+    # Files each mesh is read from:
+    region_names = {"FluidMesh": fluid_region_name, "SolidMesh": solid_region_name}
+    mesh_files = {key: _mesh_files(case_path, region_names[key]) for key in mesh_keys}
+
+    # In incremental mode, whatever was read before from files that 
+    # have not changed since then is taken from the existing data.
+    previous_data, previous_sources = {}, {}
+    if incremental:
+        previous_data, previous_sources = _load_previous_data(datafilename)
+
+    sources = {}
+
+    # Parse the meshes and each field for each timestep that is not 
+    # reused. Every file is an independent task, so with workers > 1 
+    # they are spread across a pool of processes. The meshes go 
+    # first, since they take the longest.
+    sim_data = {"Parameters": params}
+    reused = set()
+    tasks = []
+    task_keys = []
+    for key in mesh_keys:
+        if _check_files(mesh_files[key], case_path, sources, previous_sources, hash_files) \
+                and key in previous_data:
+            sim_data[key] = previous_data[key]
+            reused.add(key)
+        else:
+            tasks.append((_read_mesh, case_path, region_names[key], mesh_cache_dir))
+            task_keys.append((key, None, None))
+
+    # Decomposed timesteps are read one processor file per task, and
+    # put together afterwards with the cellProcAddressing of each 
+    # processor (read only once).
+    addressing = {}
+    for field in fields:
+        timesteps_key = case_store.field_keys(field)[0]
+        previous_values = dict(zip(previous_data.get(timesteps_key, []), previous_data.get(field, [])))
+        sim_data[field] = []
+        for ts, fn in zip(field_timesteps[timesteps_key], field_files[field]):
+            if _check_files(decomposed_case.source_files(fn), case_path, sources, previous_sources, hash_files) \
+                    and ts in previous_values and case_store.has_dtype(previous_values[ts], dtype):
+                sim_data[field].append(previous_values[ts])
+                reused.add((field, ts))
+            elif isinstance(fn, decomposed_case.DecomposedField):
+                sim_data[field].append(fn)
+                for piece, piece_fn in enumerate(fn.files):
+                    tasks.append((field_reader.read_internal_field, piece_fn, True))
+                    task_keys.append((field, len(sim_data[field]) - 1, piece))
+                for addressing_fn in fn.addressing:
+                    if addressing_fn not in addressing:
+                        addressing[addressing_fn] = None
+                        tasks.append((field_reader.read_label_list, addressing_fn))
+                        task_keys.append((addressing_fn, None, None))
+            else:
+                sim_data[field].append(None)
+                tasks.append((field_reader.read_internal_field, fn))
+                task_keys.append((field, len(sim_data[field]) - 1, None))
 
-    # Since the simulations for momentum and temperature are decoupled,
-    # we have different timesteps for each of the simulations:
-    timesteps_momentum = get_timestep_folders(case_path + 'MomentumSolution/')
-    timesteps_thermal = get_timestep_folders(case_path)
-    print("Timesteps momentum simulation: ",timesteps_momentum)
-    print("Timesteps thermal simulation: ",timesteps_thermal)
+    time1 = time.time()
+    results = _run_tasks(tasks, workers)
+    time2 = time.time()
+    print("Time required for reading the meshes and fields = ", time2-time1)
+    if incremental:
+        print("Files parsed: ", len(tasks), ", reused from existing data: ", len(reused))
 
-    # Read the magnitudes for each timestep:
-    # TODO  Write the option to read just some of the timesteps and 
-    #       some of the magnitudes.
+    # Each element of the list of each field contains the value of 
+    # the field in the timestep that is in the same position in the 
+    # 'timesteps_to_read_*' list.
+    pieces = {}
+    for (key, index, piece), result in zip(task_keys, results):
+        if key in addressing:
+            addressing[key] = result
+        elif index is None:
+            sim_data[key] = result
+        elif piece is None:
+            sim_data[key][index] = result
+        else:
+            pieces.setdefault((key, index), []).append(result)
+    for (key, index), field_pieces in pieces.items():
+        source = sim_data[key][index]
+        sim_data[key][index], _ = decomposed_case.stitch_field(
+            [piece for piece, _ in field_pieces], [uniform for _, uniform in field_pieces],
+            [addressing[fn] for fn in source.addressing]
+        )
+    sim_data["MomentumTimesteps"] = timesteps_to_read_momentum
+    sim_data["ThermalTimesteps"] = timesteps_to_read_thermal
 
-    # Timestep [0] is the '0' folder, skip that one.
-    if mode == 'last':
-        timesteps_to_read_thermal = timesteps_thermal[-1]
-        timesteps_to_read_momentum = timesteps_momentum[-1]
-    elif mode == 'all':
-        timesteps_to_read_thermal = timesteps_thermal[1:]
-        timesteps_to_read_momentum = timesteps_momentum[1:]
-    else:
-        warnmessage = "mode argument must be either 'all' or 'last' (default)"
-        warnings.warn(warnmessage)
+    # Every timestep of every field as a contiguous array of the 
+    # chosen type:
+    case_store.normalise_fields(sim_data, dtype)
 
-    # Parse each field for each timestep and store them in a list.
-    #  Each element of the list contains the value of the field in 
-    # the timestep that is in the same position in the 
-    # 'timesteps_to_read_*' list.
-    T_fluid = []
-    T_solid = []
-    for ts in timesteps_to_read_thermal:
-        T_fluid.append(Ofpp.parse_internal_field(case_path + ts + '/' + fluid_region_name + 'T'))
-        T_solid.append(Ofpp.parse_internal_field(case_path + ts + '/' + solid_region_name + 'T'))
-
-    static_p = []
-    vel_field = []
-    for ts in timesteps_to_read_momentum:
-        static_p.append(Ofpp.parse_internal_field(case_path + momentum_simulation_folder + ts + '/' + 'static(p)'))
-        vel_field.append(Ofpp.parse_internal_field(case_path + momentum_simulation_folder + ts + '/' + 'U'))
+    # Keep the order of the keys of the dict:
+    sim_data = {key: sim_data[key] for key in ("Parameters", "SolidMesh", "FluidMesh",
+                                               "MomentumTimesteps", "ThermalTimesteps", *fields)
+                if key in sim_data}
 
     # Save the data in a joblib file. The rationale behind this is 
     # that reading and parsing data from the OpenFOAM files can take 
@@ -469,25 +1271,51 @@ def read_simulation_data(   case_path: str,
     # from openfoam once and then use them as I want (may not sound 
     # very convincing, but trust me I've spent a lot of very 
     # frustating time waiting for these data to load). 
+    if store_format == 'columnar':
+        # Arrays reused from the store are already there:
+        case_store.write_case_store(sim_data, datafilename, unchanged=reused, compression=compression)
+    elif compression is not None:
+        joblib.dump(sim_data, datafilename, compress=(compression, 1))
+    else:
+        joblib.dump(sim_data, datafilename)
 
-    # Include the case parameters too:
-    params = load_case_properties(case_path,  config_file_name)
-    # Save the variables as a dict:
-    sim_data = {"Parameters": params,
-                "SolidMesh": solidmesh, 
-                "FluidMesh": fluidmesh, 
-                "MomentumTimesteps": timesteps_to_read_momentum,
-                "ThermalTimesteps": timesteps_to_read_thermal,
-                "FluidTemperature": T_fluid,
-                "SolidTemperature": T_solid,
-                "StaticPressure": static_p,
-                "VelocityField": vel_field}
+    # Record the files that have been read, for incremental mode:
+    _write_sources(datafilename, sources)
 
-    datafilename = case_path + "Case_P" + str(params.porosity) + "_Re" + str(params.Rep) + "_DATA.joblib"
+    return datafilename
 
-    joblib.dump(sim_data, datafilename)
 
-    return datafilename
+def load_simulation_data(   datafilename: str,
+                            mmap_mode: str = 'r'
+                        ) -> dict:
+    """Function for loading the data saved by read_simulation_data
+
+    Works both with joblib files and with case store directories,
+    and returns the same dict in both cases, with every timestep of
+    every field as a numpy.ndarray (also for data saved by older 
+    versions, with lists or uniform values).
+
+    Parameters
+    ----------
+    datafilename : str
+        Name of the joblib file or case store directory, as returned 
+        by read_simulation_data
+    mmap_mode : str
+        Only for case stores. Memory-map mode of the arrays (default
+        'r'), None reads them into memory.
+
+    Returns
+    -------
+    data : dict
+        Dictionary with the results from the simulation (see 
+        read_simulation_data for its keys)
+
+    """
+
+    if case_store.is_case_store(datafilename):
+        return case_store.read_case_store(datafilename, mmap_mode)
+
+    return case_store.normalise_fields(joblib.load(datafilename))
 
 
 
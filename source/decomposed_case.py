@@ -0,0 +1,238 @@
+"""Decomposed case module
+
+This module defines the reading of the fields of a case decomposed
+for a parallel run (processor0, processor1... directories) without
+reconstructing it with reconstructPar.
+
+Each processor directory has the part of the field of its cells,
+processor<N>/<time>/<region>/<field>, and the map from its cells to
+the cells of the whole mesh,
+processor<N>/constant/<region>/polyMesh/cellProcAddressing. The
+field of the whole mesh is put together by placing the values of
+every processor in the cells of its map, which gives exactly the
+same array as reading the field written by reconstructPar. The mesh
+itself is read from constant/<region>/polyMesh, which decomposePar
+leaves in place.
+
+A timestep of a field in a decomposed case is given by a
+DecomposedField (the files of all the processors and their maps)
+instead of the path to a file. read_field and source_files accept
+both.
+
+This module requires numpy. It also uses os, re, collections
+
+"""
+
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+import field_reader
+
+_PROCESSOR_FOLDER = re.compile(r'^processor(\d+)$')
+
+# Timestep of a field in a decomposed case:
+DecomposedField = namedtuple("DecomposedField", ["files", "addressing"])
+DecomposedField.__doc__ = """Files of a field timestep split in processor directories
+
+files : tuple[str]
+    Field file of every processor
+addressing : tuple[str]
+    cellProcAddressing file of every processor, in the same order
+"""
+
+
+def processor_folders(case_path: str) -> list[str]:
+    """Get the names of the processor directories of a case
+
+    Parameters
+    ----------
+    case_path : str
+        Relative path to the case folder
+
+    Returns
+    -------
+    list[str]
+        Names of the processor<N> directories, sorted by N. Empty if
+        the case is not decomposed.
+
+    """
+
+    if not os.path.isdir(case_path):
+        return []
+
+    folders = [item for item in os.listdir(case_path)
+               if _PROCESSOR_FOLDER.match(item) and os.path.isdir(os.path.join(case_path, item))]
+
+    return sorted(folders, key=lambda item: int(_PROCESSOR_FOLDER.match(item).group(1)))
+
+
+def decomposed_field(   case_path: str,
+                        processors: list[str],
+                        timestep: str,
+                        region_name: str,
+                        field_name: str
+                    ) -> DecomposedField:
+    """Get the DecomposedField of a timestep of a field
+
+    Parameters
+    ----------
+    case_path : str
+        Relative path to the case folder (with the processor
+        directories)
+    processors : list[str]
+        Names of the processor directories, from processor_folders
+    timestep : str
+        Name of the timestep folder
+    region_name : str
+        Name of the region (e.g. 'FluidRegion/'), '' for single
+        region cases
+    field_name : str
+        Name of the field file (e.g. 'T')
+
+    Returns
+    -------
+    DecomposedField
+
+    """
+
+    files = tuple(case_path + processor + '/' + timestep + '/' + region_name + field_name
+                  for processor in processors)
+    addressing = tuple(case_path + processor + '/constant/' + region_name + 'polyMesh/cellProcAddressing'
+                       for processor in processors)
+
+    return DecomposedField(files, addressing)
+
+
+def source_files(source) -> list[str]:
+    """Files a field timestep is read from
+
+    Parameters
+    ----------
+    source : str or DecomposedField
+        Path to the field file, or the files of a decomposed field
+
+    Returns
+    -------
+    list[str]
+
+    """
+
+    if isinstance(source, DecomposedField):
+        return list(source.files) + list(source.addressing)
+
+    return [source]
+
+
+def stitch_field(pieces: list, uniform: list[bool], addressing: list) -> tuple:
+    """Put together the field of the whole mesh
+
+    Parameters
+    ----------
+    pieces : list
+        Field of every processor, as read by
+        field_reader.read_internal_field
+    uniform : list[bool]
+        Whether the field of every processor is uniform, as returned
+        by field_reader.read_internal_field with return_uniform
+    addressing : list[numpy.ndarray]
+        cellProcAddressing of every processor
+
+    Raises
+    ------
+    FileNotFoundError
+        If the cellProcAddressing of any processor is missing (None)
+
+    Returns
+    -------
+    field : numpy.ndarray, float or None
+        Field at every cell of the whole mesh, as read from the field
+        written by reconstructPar: an array of shape (N,) or (N, 3),
+        or the value if it is the same (uniform) in all the
+        processors. None if the field is missing in any processor.
+    uniform : bool
+        True if field is a uniform value
+
+    """
+
+    if any(cells is None for cells in addressing):
+        raise FileNotFoundError("cellProcAddressing missing in a processor directory")
+    if any(piece is None for piece in pieces):
+        return None, False
+
+    # Uniform pieces are a single value (a float, or an array with
+    # the components) instead of one value per cell. A field with the
+    # same uniform value in all the processors (with cells) is written
+    # as uniform by reconstructPar too
+    counted = [i for i in range(len(pieces)) if uniform[i] or len(addressing[i]) > 0]
+    if counted and all(uniform[i] for i in counted) \
+            and all(np.array_equal(pieces[i], pieces[counted[0]]) for i in counted):
+        return pieces[counted[0]], True
+
+    num_cell = sum(len(cells) for cells in addressing)
+    shape = (num_cell,)
+    for piece, is_uniform in zip(pieces, uniform):
+        if np.ndim(piece) == 2:
+            shape = (num_cell, piece.shape[1])
+        elif is_uniform and np.ndim(piece) == 1:
+            shape = (num_cell, len(piece))
+
+    field = np.empty(shape, dtype=np.float64)
+    for piece, cells in zip(pieces, addressing):
+        # Uniform values are broadcast to all the cells of the
+        # processor
+        field[cells] = piece
+
+    return field, False
+
+
+def read_decomposed_field(source: DecomposedField, return_uniform: bool = False):
+    """Read a decomposed field timestep, as if it were reconstructed
+
+    Parameters
+    ----------
+    source : DecomposedField
+        Files of the field
+    return_uniform : bool
+        Also return whether the field is uniform, as stitch_field
+
+    Returns
+    -------
+    numpy.ndarray, float or None
+        As stitch_field
+
+    """
+
+    pieces = [field_reader.read_internal_field(fn, return_uniform=True) if os.path.isfile(fn) else (None, False)
+              for fn in source.files]
+    addressing = [field_reader.read_label_list(fn) for fn in source.addressing]
+
+    field, uniform = stitch_field([piece for piece, _ in pieces], [flag for _, flag in pieces], addressing)
+
+    return (field, uniform) if return_uniform else field
+
+
+def read_field(source, return_uniform: bool = False):
+    """Read a field timestep from a file or from processor directories
+
+    Parameters
+    ----------
+    source : str or DecomposedField
+        Path to the field file, or the files of a decomposed field
+    return_uniform : bool
+        Also return whether the field is uniform, as
+        field_reader.read_internal_field
+
+    Returns
+    -------
+    numpy.ndarray, float or None
+        As field_reader.read_internal_field
+
+    """
+
+    if isinstance(source, DecomposedField):
+        return read_decomposed_field(source, return_uniform)
+
+    return field_reader.read_internal_field(source, return_uniform)
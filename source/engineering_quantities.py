@@ -0,0 +1,274 @@
+"""Engineering quantities module
+
+This module defines the computation of the quantities used to build
+correlations from the simulations of structured catalysts: pressure
+drop and friction factor of the channels, bulk (flow-weighted)
+temperature of the fluid, and heat transfer coefficients and Nusselt
+numbers of the channels and of the wall of the reactor.
+
+All the quantities are computed along the catalyst (the z-range of
+the solid region), at num_zdots axial stations, for all the
+timesteps at once: every field is averaged once per station with
+the cached AxialAverager of its mesh (post_processing_functions.py
+module), and everything else is arithmetic on those (timesteps,
+num_zdots) arrays. Results can be flattened to a tidy table, one row
+per (timestep, station), with the case parameters in every row, so
+the tables of all the cases of a campaign can be concatenated and
+aggregated (e.g. pandas.DataFrame(concat_tables(tables))).
+
+Definitions, with D_h = 2*Rchannels and the mean velocity in the
+channels u = Rep*mu/(rho*D_h), as in the Reynolds number of the case:
+
+    friction_factor = -dp/dz*D_h/(rho*u**2/2)       (Darcy)
+    T_bulk = sum(u_z*T*V)/sum(u_z*V)                  (each station)
+    h_channel = rho*cp*u_z*D_h/4*dT_bulk/dz/(T_solid - T_bulk)
+    h_wall = rho*cp*u_s*R/2*dT_bulk/dz/(wallTemp - T_bulk)
+    Nu_channel = h_channel*D_h/k,   Nu_wall = h_wall*2*R/k
+
+where u_z is the mean axial velocity of the fluid and u_s the
+superficial velocity (u_z times the fluid fraction of the cross
+section) at each station. Both heat transfer coefficients come from
+the energy balance of the fluid: all the heat gained by the fluid
+crosses the walls of the channels (h_channel) or, for the reactor as
+a whole, its outer wall (h_wall).
+
+The thermal and momentum simulations are decoupled: the velocity
+used for the bulk temperature is the one of the last momentum
+timestep, and the thermal table includes the hydraulic quantities of
+that timestep.
+
+This module requires numpy. It also uses warnings
+
+"""
+
+import warnings
+
+import numpy as np
+
+from post_processing_functions import get_axial_averager
+from chunked_averaging import column_range
+
+# Columns of the tidy table taken from the case parameters:
+PARAMETER_COLUMNS = ("porosity", "Rep", "Rchannels", "R", "fluid_rho", "fluid_mu",
+                     "fluid_cp", "fluid_k", "fluid_Pr", "solid_k", "wallTemp", "inletTemp")
+
+
+def _axial_velocity(data: dict, num_cell: int) -> np.ndarray:
+    """Axial velocity at every fluid cell in the last momentum timestep,
+    None if it is not available"""
+
+    if len(data["VelocityField"]) == 0 or data["VelocityField"][-1] is None:
+        return None
+
+    # Not converted, so that a memory-mapped field stays on disk
+    velocity = np.asarray(data["VelocityField"][-1])
+    if velocity.ndim == 1:
+        # Uniform velocity
+        return np.full(num_cell, float(velocity[2]))
+
+    return velocity[:, 2]
+
+
+def axial_quantities(   data: dict,
+                        num_zdots: int = 100,
+                        z_range: tuple[float, float] = None,
+                        chunk_size: int = None
+                    ) -> dict:
+    """Compute the engineering quantities along the catalyst
+
+    quantities = axial_quantities( data, num_zdots )
+    plt.plot(quantities["z"], quantities["Nu_channel"][-1])
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    num_zdots : int
+        Number of axial stations.
+    z_range : tuple[float, float]
+        (min_z, max_z) of the stations. By default, the minimum and
+        maximum z-coordinate of the cells of the solid region (the
+        catalyst).
+    chunk_size : int
+        Number of cells read at a time, for meshes larger than the
+        memory (see get_axial_averager). By default, all at once.
+
+    Returns
+    -------
+    quantities : dict
+        "z" : z-coordinate of the stations, shape (num_zdots,)
+        "ThermalTimesteps", "MomentumTimesteps" : timesteps of the
+            rows of the arrays below
+        With shape (momentum timesteps, num_zdots):
+        "p" : average static pressure [Pa]
+        "pressure_drop" : p at the first station minus p [Pa]
+        "dpdz" : axial pressure gradient [Pa/m]
+        "friction_factor" : Darcy friction factor [-]
+        "fRe" : friction_factor*Rep [-]
+        With shape (thermal timesteps, num_zdots):
+        "T_fluid", "T_solid" : volume-weighted average temperature of
+            the fluid and the solid [K]
+        "T_bulk" : flow-weighted average temperature of the fluid [K]
+        "h_channel", "h_wall" : heat transfer coefficients of the
+            channels and of the outer wall [W/(m2*K)]
+        "Nu_channel", "Nu_wall" : Nusselt numbers [-]
+        With shape (num_zdots,), from the last momentum timestep:
+        "u_channel" : mean axial velocity of the fluid [m/s]
+        "u_superficial" : superficial velocity [m/s]
+        "velocity_available" : False if the case has no velocity
+            field, in which case the velocity is taken as uniform
+            (from Rep) and T_bulk equals T_fluid.
+
+    """
+
+    params = data["Parameters"]
+    fluidmesh = data["FluidMesh"]
+    solidmesh = data["SolidMesh"]
+
+    if z_range is None:
+        z_range = column_range(np.asarray(solidmesh.cell_centres), 2, chunk_size)
+    fluid_averager = get_axial_averager(fluidmesh, num_zdots, z_range, chunk_size)
+    solid_averager = get_axial_averager(solidmesh, num_zdots, z_range, chunk_size)
+    z = fluid_averager.z_dots
+
+    D_h = 2*params.Rchannels
+    u_Rep = params.Rep*params.fluid_mu/(params.fluid_rho*D_h)
+
+    quantities = {"z": z,
+                  "ThermalTimesteps": list(data["ThermalTimesteps"]),
+                  "MomentumTimesteps": list(data["MomentumTimesteps"])}
+
+    # Hydraulics, for every momentum timestep:
+    p = fluid_averager.average(data["StaticPressure"]) if len(data["StaticPressure"]) > 0 \
+        else np.empty((0, num_zdots))
+    dpdz = np.gradient(p, z, axis=1) if len(p) > 0 else p.copy()
+    quantities["p"] = p
+    quantities["pressure_drop"] = p[:, :1] - p
+    quantities["dpdz"] = dpdz
+    quantities["friction_factor"] = -dpdz*D_h/(0.5*params.fluid_rho*u_Rep**2)
+    quantities["fRe"] = quantities["friction_factor"]*params.Rep
+
+    # Velocity of the flow, from the last momentum timestep:
+    fluid_fraction = fluid_averager.slice_volumes/(fluid_averager.slice_volumes + solid_averager.slice_volumes)
+    u_z = _axial_velocity(data, fluid_averager.num_cell)
+    quantities["velocity_available"] = u_z is not None
+    if u_z is None:
+        warnings.warn("No velocity field, the velocity is taken as uniform for the bulk temperature")
+        u_z = np.full(fluid_averager.num_cell, u_Rep)
+    u_channel = fluid_averager.average(u_z)[0]
+    quantities["u_channel"] = u_channel
+    quantities["u_superficial"] = fluid_fraction*u_channel
+
+    # Temperatures, for every thermal timestep:
+    T_fluid = fluid_averager.average(data["FluidTemperature"])
+    T_solid = solid_averager.average(data["SolidTemperature"])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        T_bulk = fluid_averager.average(data["FluidTemperature"], scale=u_z)/u_channel
+    quantities["T_fluid"] = T_fluid
+    quantities["T_solid"] = T_solid
+    quantities["T_bulk"] = T_bulk
+
+    # Heat transfer, from the energy balance of the fluid:
+    dTdz = np.gradient(T_bulk, z, axis=1) if len(T_bulk) > 0 else T_bulk.copy()
+    heat_flux_channel = params.fluid_rho*params.fluid_cp*u_channel*D_h/4*dTdz
+    heat_flux_wall = params.fluid_rho*params.fluid_cp*quantities["u_superficial"]*params.R/2*dTdz
+    with np.errstate(invalid='ignore', divide='ignore'):
+        quantities["h_channel"] = heat_flux_channel/(T_solid - T_bulk)
+        quantities["h_wall"] = heat_flux_wall/(params.wallTemp - T_bulk)
+    quantities["Nu_channel"] = quantities["h_channel"]*D_h/params.fluid_k
+    quantities["Nu_wall"] = quantities["h_wall"]*2*params.R/params.fluid_k
+
+    return quantities
+
+
+# Columns of the tidy table, by the timesteps of their rows:
+_THERMAL_COLUMNS = ("T_fluid", "T_solid", "T_bulk", "h_channel", "h_wall", "Nu_channel", "Nu_wall")
+_STATION_COLUMNS = ("u_channel", "u_superficial")
+_MOMENTUM_COLUMNS = ("p", "pressure_drop", "dpdz", "friction_factor", "fRe")
+
+
+def quantities_table(   data: dict,
+                        num_zdots: int = 100,
+                        z_range: tuple[float, float] = None,
+                        case: str = None,
+                        chunk_size: int = None
+                    ) -> dict:
+    """Compute the engineering quantities as a tidy table
+
+    One row per thermal timestep and axial station, with the
+    quantities of axial_quantities (the hydraulic ones, from the
+    last momentum timestep) and the case parameters.
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    num_zdots : int
+        Number of axial stations.
+    z_range : tuple[float, float]
+        As in axial_quantities
+    case : str
+        Name of the case, added as a column if given
+    chunk_size : int
+        As in axial_quantities
+
+    Returns
+    -------
+    table : dict
+        {column: numpy.ndarray}, all of the same length. Columns
+        "timestep" (str), "time" (float), "station" (index of the
+        station), "z", the quantities, and PARAMETER_COLUMNS. Can be
+        passed to pandas.DataFrame as is.
+
+    """
+
+    quantities = axial_quantities(data, num_zdots, z_range, chunk_size)
+    z = quantities["z"]
+    timesteps = quantities["ThermalTimesteps"]
+    num_rows = len(timesteps)*len(z)
+
+    table = {}
+    if case is not None:
+        table["case"] = np.full(num_rows, case, dtype=object)
+    table["timestep"] = np.repeat(np.asarray(timesteps, dtype=object), len(z))
+    table["time"] = np.repeat(np.asarray(timesteps, dtype=float), len(z))
+    table["station"] = np.tile(np.arange(len(z)), len(timesteps))
+    table["z"] = np.tile(z, len(timesteps))
+
+    for name in _THERMAL_COLUMNS:
+        table[name] = quantities[name].reshape(-1)
+    for name in _STATION_COLUMNS:
+        table[name] = np.tile(quantities[name], len(timesteps))
+    for name in _MOMENTUM_COLUMNS:
+        last = quantities[name][-1] if len(quantities[name]) > 0 else np.full(len(z), np.nan)
+        table[name] = np.tile(last, len(timesteps))
+
+    params = data["Parameters"]
+    for name in PARAMETER_COLUMNS:
+        table[name] = np.full(num_rows, getattr(params, name), dtype=float)
+
+    return table
+
+
+def concat_tables(tables: list[dict]) -> dict:
+    """Join the tables of several cases into one
+
+    Parameters
+    ----------
+    tables : list[dict]
+        Tables from quantities_table, with the same columns
+
+    Returns
+    -------
+    table : dict
+        {column: numpy.ndarray} with the rows of all the tables, in
+        order
+
+    """
+
+    if len(tables) == 0:
+        return {}
+
+    return {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
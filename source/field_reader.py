@@ -0,0 +1,245 @@
+"""Field reader module
+
+This module defines a fast reader for the internalField of OpenFOAM
+field files (T, static(p), U, C, V...), used by read_simulation_data
+(data_handling_functions.py module) instead of
+Ofpp.parse_internal_field.
+
+Ofpp splits the file in lines and converts them one by one in
+Python, which is most of the time spent reading a case. This reader
+finds the header of the list, reads the number of elements and
+converts the whole body at once with numpy. Files it does not
+recognise are passed to Ofpp.
+
+It also reads labelList files, such as the cellProcAddressing maps
+of decomposed cases, and the cellZones of a polyMesh.
+
+This module requires numpy and Ofpp. It also uses os, re
+
+"""
+
+import os
+import re
+
+import numpy as np
+import Ofpp
+
+# Number of components of each type of OpenFOAM list:
+COMPONENTS = {
+    b'scalar': 1,
+    b'vector': 3,
+    b'symmTensor': 6,
+    b'tensor': 9,
+}
+
+_NONUNIFORM_HEADER = re.compile(rb'^internalField\s+nonuniform\s+List<(\w+)>\s*(\d+)\s*\(', re.M)
+_UNIFORM_HEADER = re.compile(rb'^internalField\s+uniform\s+([^;]*);', re.M)
+_LIST_END = re.compile(rb'\)\s*;')
+_BINARY_FORMAT = re.compile(rb'^\s*format\s+binary\s*;', re.M)
+_HEADER_END = re.compile(rb'FoamFile\s*\{[^}]*\}')
+_LIST_HEADER = re.compile(rb'(\d+)\s*\(')
+_LABEL_64 = re.compile(rb'label\s*=\s*64')
+_PARENTHESES = bytes.maketrans(b'()', b'  ')
+_ZONE_HEADER = re.compile(rb'([^\s{}();]+)\s*\{[^{}]*?cellLabels\s+List<label>\s*(\d+)\s*\(')
+
+
+def parse_internal_field_content(content: bytes):
+    """Parse the internalField of the contents of a field file
+
+    Parameters
+    ----------
+    content : bytes
+        Whole contents of the field file
+
+    Returns
+    -------
+    numpy.ndarray, float or None
+        For nonuniform fields, a contiguous float64 array of shape
+        (N,) for scalars or (N, components) otherwise. For uniform
+        fields, the value as Ofpp returns it (a float, or an array
+        with the components). None if the internalField is not
+        recognised.
+
+    """
+
+    header = _NONUNIFORM_HEADER.search(content)
+    if header is not None:
+        return _parse_nonuniform(content, header)
+
+    header = _UNIFORM_HEADER.search(content)
+    if header is not None:
+        return _parse_uniform(header.group(1))
+
+    return None
+
+
+def _parse_nonuniform(content: bytes, header: re.Match):
+    """Convert the body of a nonuniform list in one go"""
+
+    num_components = COMPONENTS.get(header.group(1))
+    if num_components is None:
+        return None
+    num = int(header.group(2))
+    start = header.end()
+
+    if _BINARY_FORMAT.search(content, 0, header.start()):
+        # Binary lists are the raw doubles right after the '('
+        data = np.frombuffer(content, dtype=np.float64, count=num*num_components, offset=start).copy()
+    else:
+        end = _LIST_END.search(content, start)
+        if end is None:
+            return None
+        body = content[start:end.start()]
+        if num_components > 1:
+            body = body.translate(_PARENTHESES)
+        data = np.fromstring(body, dtype=np.float64, sep=' ')
+        if data.size != num*num_components:
+            return None
+
+    if num_components > 1:
+        data = data.reshape(num, num_components)
+
+    return data
+
+
+def _parse_uniform(value: bytes):
+    """Parse the value of a uniform field (as Ofpp does)"""
+
+    try:
+        if b'(' in value:
+            return np.array([float(x) for x in value.split(b'(')[1].split(b')')[0].split()])
+        return float(value)
+    except ValueError:
+        # e.g. a value given with a $variable
+        return None
+
+
+def read_internal_field(fn: str, return_uniform: bool = False):
+    """Read the internalField of an OpenFOAM field file
+
+    Drop-in replacement for Ofpp.parse_internal_field. Files whose
+    internalField is not recognised are parsed by Ofpp.
+
+    Parameters
+    ----------
+    fn : str
+        Path to the field file
+    return_uniform : bool
+        Also return whether the field is uniform. The shape of the
+        values does not tell, e.g. a uniform vector has the same 
+        shape as a scalar field of 3 cells. Default False.
+
+    Returns
+    -------
+    numpy.ndarray or float
+        For nonuniform fields, a contiguous float64 array of shape
+        (N,) for scalars or (N, 3) for vectors. For uniform fields,
+        the value (a float, or an array with the components). As 
+        with Ofpp, None if the file does not exist.
+    uniform : bool
+        Only with return_uniform. True if the internalField is 
+        uniform (False if the file does not exist).
+
+    """
+
+    if not os.path.isfile(fn):
+        data = Ofpp.parse_internal_field(fn)
+        return (data, False) if return_uniform else data
+
+    with open(fn, 'rb') as f:
+        content = f.read()
+
+    data = parse_internal_field_content(content)
+    if data is None:
+        data = Ofpp.parse_internal_field(fn)
+
+    if return_uniform:
+        uniform = _NONUNIFORM_HEADER.search(content) is None and _UNIFORM_HEADER.search(content) is not None
+        return data, uniform
+
+    return data
+
+
+def read_label_list(fn: str) -> np.ndarray:
+    """Read an OpenFOAM labelList file (e.g. cellProcAddressing)
+
+    Parameters
+    ----------
+    fn : str
+        Path to the file
+
+    Returns
+    -------
+    numpy.ndarray
+        The labels, as int64, or None if the file does not exist
+
+    """
+
+    if not os.path.isfile(fn):
+        return None
+
+    with open(fn, 'rb') as f:
+        content = f.read()
+
+    header_end = _HEADER_END.search(content)
+    start = header_end.end() if header_end is not None else 0
+    header = _LIST_HEADER.search(content, start)
+    if header is None:
+        raise ValueError(f"{fn} is not a labelList file")
+    num = int(header.group(1))
+
+    if _BINARY_FORMAT.search(content, 0, start):
+        dtype = np.int64 if _LABEL_64.search(content, 0, start) else np.int32
+        labels = np.frombuffer(content, dtype=dtype, count=num, offset=header.end())
+    else:
+        end = content.find(b')', header.end())
+        labels = np.fromstring(content[header.end():end], dtype=np.int64, sep=' ')
+        if labels.size != num:
+            raise ValueError(f"{fn} has {labels.size} labels instead of {num}")
+
+    return labels.astype(np.int64)
+
+
+def read_cell_zones(fn: str) -> dict:
+    """Read an OpenFOAM cellZones file (constant/<region>/polyMesh)
+
+    Parameters
+    ----------
+    fn : str
+        Path to the file
+
+    Returns
+    -------
+    dict
+        {zone name: labels of its cells, as int64}, or None if the
+        file does not exist
+
+    """
+
+    if not os.path.isfile(fn):
+        return None
+
+    with open(fn, 'rb') as f:
+        content = f.read()
+
+    header_end = _HEADER_END.search(content)
+    start = header_end.end() if header_end is not None else 0
+    binary = _BINARY_FORMAT.search(content, 0, start) is not None
+    dtype = np.int64 if _LABEL_64.search(content, 0, start) else np.int32
+
+    zones = {}
+    header = _ZONE_HEADER.search(content, start)
+    while header is not None:
+        num = int(header.group(2))
+        if binary:
+            labels = np.frombuffer(content, dtype=dtype, count=num, offset=header.end())
+            end = header.end() + labels.nbytes
+        else:
+            end = content.find(b')', header.end())
+            labels = np.fromstring(content[header.end():end], dtype=np.int64, sep=' ')
+            if labels.size != num:
+                raise ValueError(f"Zone {header.group(1).decode()} of {fn} has {labels.size} labels instead of {num}")
+        zones[header.group(1).decode()] = labels.astype(np.int64)
+        header = _ZONE_HEADER.search(content, end)
+
+    return zones
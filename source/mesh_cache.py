@@ -0,0 +1,170 @@
+"""Mesh cache module
+
+This module defines a cache of parsed meshes shared by many cases,
+indexed by the contents of their files.
+
+The cases of a sweep over the Reynolds number (e.g.
+Catalyst_P-0.15_n-7_nl-2_Re-20 and ..._Re-100) have the same mesh,
+but read_simulation_data parses it again for each of them, and saves
+a copy of it with the data of every case. With a mesh cache, each
+mesh is parsed once: it is saved in the cache (in the format of the
+meshes of a case store, see case_store.py module) under the hash of
+its files, and every case whose mesh files have the same contents
+gets the cached mesh. The data of the cases only refer to it.
+
+The hash covers the polyMesh files of the region (boundary, points,
+faces, owner, neighbour) and its C and V files, without their FoamFile
+header (which has the location of the file), so identical meshes in
+different folders have the same key.
+
+mesh = load_mesh( case_path, 'FluidRegion/', 'path/to/cache' )
+
+This module requires numpy. It also uses os, re, json, shutil,
+hashlib, tempfile
+
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+
+import case_store
+import data_handling_functions
+
+_HEADER_END = re.compile(rb'FoamFile\s*\{[^}]*\}')
+
+# Size of the blocks files are hashed in [bytes]:
+_BLOCK_SIZE = 1 << 20
+
+
+def _hash_file(sha1, fn: str):
+    """Add the contents of a file, without its header, to a hash"""
+
+    with open(fn, 'rb') as f:
+        block = f.read(_BLOCK_SIZE)
+        header_end = _HEADER_END.search(block)
+        if header_end is not None:
+            block = block[header_end.end():]
+        while block:
+            sha1.update(block)
+            block = f.read(_BLOCK_SIZE)
+
+
+def mesh_key(case_path: str, region_name: str) -> str:
+    """Get the key of the mesh of a region in a mesh cache
+
+    Parameters
+    ----------
+    case_path : str
+        Relative path to the case folder
+    region_name : str
+        Name of the region (e.g. 'FluidRegion/')
+
+    Returns
+    -------
+    str
+        SHA-1 hash of the mesh files of the region (polyMesh, C and
+        V), without their headers
+
+    """
+
+    sha1 = hashlib.sha1()
+    for fn in data_handling_functions._mesh_files(case_path, region_name):
+        name = os.path.basename(fn)
+        if os.path.isfile(fn):
+            sha1.update(name.encode() + b'\0')
+            _hash_file(sha1, fn)
+        else:
+            # C and V may be missing (they are then computed)
+            sha1.update(name.encode() + b'\0missing\0')
+
+    return sha1.hexdigest()
+
+
+def is_cached(cache_dir: str, key: str) -> bool:
+    """Check if a mesh is in a mesh cache"""
+
+    return os.path.isfile(case_store.cached_mesh_entry(cache_dir, key))
+
+
+def cache_mesh(mesh, cache_dir: str, key: str) -> "case_store.CachedMesh":
+    """Save a mesh in a mesh cache
+
+    The mesh is first saved in a temporary folder inside the cache,
+    which is then renamed, so other processes never see a partially
+    saved mesh. If another process has already saved the same key,
+    its copy is kept.
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh
+        Mesh with cell_centres and cell_volumes already read
+    cache_dir : str
+        Path to the mesh cache directory. It is created if it does
+        not exist.
+    key : str
+        Key of the mesh, from mesh_key
+
+    Returns
+    -------
+    case_store.CachedMesh
+        The mesh, opened from the cache
+
+    """
+
+    os.makedirs(os.path.join(cache_dir, 'meshes'), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='tmp-', dir=cache_dir)
+    try:
+        mesh_manifest = case_store._write_mesh(tmp_dir, key, mesh)
+        with open(case_store.cached_mesh_entry(tmp_dir, key), 'w') as f:
+            json.dump(mesh_manifest, f, indent=2)
+        try:
+            os.rename(os.path.join(tmp_dir, 'meshes', key), os.path.join(cache_dir, 'meshes', key))
+        except OSError:
+            if not is_cached(cache_dir, key):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return case_store.CachedMesh(cache_dir, key)
+
+
+def load_mesh(  case_path: str,
+                region_name: str,
+                cache_dir: str,
+                mmap_mode: str = 'r'
+            ) -> "case_store.CachedMesh":
+    """Read the mesh of a region through a mesh cache
+
+    If a mesh with the same files is already in the cache, it is
+    opened from there. Otherwise the mesh is parsed (as
+    read_simulation_data does) and saved in the cache.
+
+    Parameters
+    ----------
+    case_path : str
+        Relative path to the case folder
+    region_name : str
+        Name of the region (e.g. 'FluidRegion/')
+    cache_dir : str
+        Path to the mesh cache directory
+    mmap_mode : str
+        Memory-map mode of the arrays of the mesh (default 'r')
+
+    Returns
+    -------
+    case_store.CachedMesh
+        Mesh with its cell centres and volumes, usable wherever an
+        Ofpp.FoamMesh is
+
+    """
+
+    key = mesh_key(case_path, region_name)
+    if not is_cached(cache_dir, key):
+        mesh = data_handling_functions._read_mesh(case_path, region_name)
+        cache_mesh(mesh, cache_dir, key)
+
+    return case_store.CachedMesh(cache_dir, key, mmap_mode)
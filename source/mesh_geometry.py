@@ -0,0 +1,207 @@
+"""Mesh geometry module
+
+This module defines the computation of the centres and volumes of
+the cells of an OpenFOAM mesh straight from its polyMesh (points,
+faces, owner and neighbour), as Ofpp.FoamMesh parses it.
+
+read_simulation_data (data_handling_functions.py module) reads them
+from the 0/<region>/C and 0/<region>/V files written by OpenFOAM's
+postProcess (writeCellCentres, writeCellVolumes). When those files
+are missing they are computed with this module instead, so cases can
+be post-processed without an OpenFOAM install.
+
+The method is the same as OpenFOAM's (primitiveMesh): every face is
+split in triangles around its approximate centre to get its area
+vector and centre, and every cell in pyramids with base in its faces
+and apex in the average of its face centres. All the faces (and all
+the triangles) are processed at once with numpy, with no loops over
+cells or faces in Python.
+
+This module requires numpy.
+
+"""
+
+import numpy as np
+
+
+def face_arrays(mesh) -> tuple[np.ndarray, np.ndarray]:
+    """Get the faces of a mesh as flat arrays
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+        Mesh with its faces
+
+    Returns
+    -------
+    face_offsets : numpy.ndarray
+        Start of every face in face_points, plus the total length,
+        shape (num_face+1,)
+    face_points : numpy.ndarray
+        Point labels of all the faces, one face after another
+
+    """
+
+    face_offsets = getattr(mesh, "face_offsets", None)
+    if face_offsets is not None:
+        return np.asarray(face_offsets), np.asarray(mesh.face_points)
+
+    lengths = np.fromiter((len(face) for face in mesh.faces), dtype=np.int64, count=len(mesh.faces))
+    face_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    face_points = np.fromiter(
+        (label for face in mesh.faces for label in face), dtype=np.int64, count=int(lengths.sum())
+    )
+
+    return face_offsets, face_points
+
+
+def face_centres_and_areas( points: np.ndarray,
+                            face_offsets: np.ndarray,
+                            face_points: np.ndarray
+                        ) -> tuple[np.ndarray, np.ndarray]:
+    """Compute the centre and area vector of every face
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Coordinates of the points of the mesh, shape (num_point, 3)
+    face_offsets, face_points : numpy.ndarray
+        Faces of the mesh, as returned by face_arrays
+
+    Returns
+    -------
+    face_centres : numpy.ndarray
+        Centre of every face, shape (num_face, 3)
+    face_areas : numpy.ndarray
+        Area vector of every face (normal to the face, with the
+        right-hand rule order of its points, and length equal to its
+        area), shape (num_face, 3)
+
+    """
+
+    points = np.asarray(points, dtype=float)
+    face_offsets = np.asarray(face_offsets, dtype=np.int64)
+    starts = face_offsets[:-1]
+    sizes = np.diff(face_offsets)
+    num_face = len(sizes)
+
+    # Face of every point in face_points, and the next point of the
+    # face (every point with the following one is an edge)
+    face_of = np.repeat(np.arange(num_face), sizes)
+    following = np.arange(1, len(face_points) + 1)
+    following[face_offsets[1:] - 1] = starts
+
+    face_xyz = points[face_points]
+    next_xyz = face_xyz[following]
+
+    # Approximate centre: average of the points of the face
+    centre_estimate = np.add.reduceat(face_xyz, starts, axis=0)/sizes[:, None]
+
+    # Triangles with base in each edge and apex in the approximate
+    # centre
+    apex = centre_estimate[face_of]
+    tri_normals = np.cross(next_xyz - face_xyz, apex - face_xyz)
+    tri_areas = np.linalg.norm(tri_normals, axis=1)
+    tri_centres = face_xyz + next_xyz + apex
+
+    sum_normals = np.add.reduceat(tri_normals, starts, axis=0)
+    sum_areas = np.add.reduceat(tri_areas, starts)
+    sum_centres = np.add.reduceat(tri_areas[:, None]*tri_centres, starts, axis=0)
+
+    # Degenerate faces (zero area) keep their approximate centre
+    with np.errstate(invalid='ignore', divide='ignore'):
+        face_centres = np.where(sum_areas[:, None] > 0,
+                                sum_centres/(3*sum_areas[:, None]), centre_estimate)
+    face_areas = 0.5*sum_normals
+
+    return face_centres, face_areas
+
+
+def cell_centres_and_volumes(   face_centres: np.ndarray,
+                                face_areas: np.ndarray,
+                                owner: np.ndarray,
+                                neighbour: np.ndarray,
+                                num_cell: int
+                            ) -> tuple[np.ndarray, np.ndarray]:
+    """Compute the centre and volume of every cell
+
+    Parameters
+    ----------
+    face_centres, face_areas : numpy.ndarray
+        As returned by face_centres_and_areas
+    owner : numpy.ndarray
+        Owner cell of every face
+    neighbour : numpy.ndarray
+        Neighbour cell of every internal face (the first ones). Any
+        entries after the internal faces are ignored.
+    num_cell : int
+        Number of cells of the mesh
+
+    Returns
+    -------
+    cell_centres : numpy.ndarray
+        Centre of every cell, shape (num_cell, 3)
+    cell_volumes : numpy.ndarray
+        Volume of every cell, shape (num_cell,)
+
+    """
+
+    owner = np.asarray(owner, dtype=np.int64)
+    num_face = len(owner)
+    neighbour = np.asarray(neighbour, dtype=np.int64)
+    num_inner_face = np.count_nonzero(neighbour[:num_face] >= 0)
+    neighbour = neighbour[:num_inner_face]
+
+    # Every internal face is seen from its owner and its neighbour
+    cells = np.concatenate((owner, neighbour))
+    centres = np.concatenate((face_centres, face_centres[:num_inner_face]))
+    # Area vectors point out of the owner and into the neighbour
+    areas = np.concatenate((face_areas, -face_areas[:num_inner_face]))
+
+    # Approximate centre: average of the centres of the faces
+    num_faces = np.bincount(cells, minlength=num_cell)
+    centre_estimate = np.stack([np.bincount(cells, centres[:, i], minlength=num_cell)
+                                for i in range(3)], axis=1)/num_faces[:, None]
+
+    # Pyramids with base in each face and apex in the approximate
+    # centre (3 times their volume, and their centroid)
+    pyr3_volumes = np.einsum('ij,ij->i', areas, centres - centre_estimate[cells])
+    pyr_centres = 0.75*centres + 0.25*centre_estimate[cells]
+
+    cell_volumes3 = np.bincount(cells, pyr3_volumes, minlength=num_cell)
+    cell_centres = np.stack([np.bincount(cells, pyr3_volumes*pyr_centres[:, i], minlength=num_cell)
+                             for i in range(3)], axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cell_centres = np.where(np.abs(cell_volumes3[:, None]) > 0,
+                                cell_centres/cell_volumes3[:, None], centre_estimate)
+
+    return cell_centres, cell_volumes3/3
+
+
+def compute_cell_geometry(mesh) -> tuple[np.ndarray, np.ndarray]:
+    """Compute the cell centres and volumes of a mesh
+
+    mesh.cell_centres, mesh.cell_volumes = compute_cell_geometry( mesh )
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+        Mesh with its points, faces, owner and neighbour
+
+    Returns
+    -------
+    cell_centres : numpy.ndarray
+        Centre of every cell, shape (num_cell, 3), as in the C file
+        written by OpenFOAM's postProcess -func writeCellCentres
+    cell_volumes : numpy.ndarray
+        Volume of every cell, shape (num_cell,), as in the V file
+        written by postProcess -func writeCellVolumes
+
+    """
+
+    face_offsets, face_points = face_arrays(mesh)
+    face_centres, face_areas = face_centres_and_areas(mesh.points, face_offsets, face_points)
+
+    return cell_centres_and_volumes(face_centres, face_areas, mesh.owner,
+                                    mesh.neighbour, mesh.num_cell)
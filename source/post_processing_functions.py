@@ -5,11 +5,613 @@ of the results of simulations of structured catalysts. It uses the
 data from simulations that have already been processed by the 
 functions defined in data_handling_functions.py module.
 
+Meshes too large for the in-memory averagers can be averaged in
+chunks of cells by passing a chunk_size to the functions below (see
+chunked_averaging.py module).
+
+This module requires numpy and scipy.
+
 """
+import weakref
+from collections import OrderedDict
+
 import numpy as np
+from scipy import sparse
+
+import chunked_averaging
+
+# Maximum number of AxialAverager objects kept by get_axial_averager:
+AVERAGER_CACHE_SIZE = 16
+_averager_cache = OrderedDict()
+
+
+def _axial_slice_membership(    z_centres: np.ndarray,
+                                z_dots: np.ndarray
+                            ) -> tuple[np.ndarray, np.ndarray]:
+    """Find the slices each cell belongs to
+
+    A cell belongs to slice j if its z-coordinate lies between 
+    z_dots[j]-half_segsize and z_dots[j]+half_segsize, both limits 
+    included. This means that a cell whose centre falls exactly on 
+    the limit between two slices belongs to both of them (and a cell 
+    outside of the range of z_dots belongs to none).
+
+    Since the limits of the slices are sorted, the slices of each 
+    cell are a contiguous range that can be found with a binary 
+    search, without looping over the cells.
+
+    Parameters
+    ----------
+    z_centres : numpy.ndarray
+        z-coordinate of the centre of every cell
+    z_dots : numpy.ndarray
+        z-coordinate of the centre of every slice (equally spaced)
+
+    Returns
+    -------
+    cells : numpy.ndarray
+        Index of the cell of every (cell, slice) pair
+    slices : numpy.ndarray
+        Index of the slice of every (cell, slice) pair
+
+    """
+
+    # Half size of the segments:
+    half_segsize = (z_dots[1] - z_dots[0])/2.0
+    lower = z_dots - half_segsize
+    upper = z_dots + half_segsize
+
+    # First slice whose upper limit is above the cell, and first slice
+    # whose lower limit is above the cell (excluded):
+    first = np.searchsorted(upper, z_centres, side='left')
+    last = np.searchsorted(lower, z_centres, side='right')
+    counts = np.clip(last - first, 0, None)
+
+    # Expand the ranges into (cell, slice) pairs:
+    cells = np.repeat(np.arange(len(z_centres)), counts)
+    range_start = np.repeat(np.cumsum(counts) - counts, counts)
+    slices = np.repeat(first, counts) + np.arange(len(cells)) - range_start
+
+    return cells, slices
+
+
+def axial_slice_average(    z_centres: np.ndarray,
+                            cell_volumes: np.ndarray,
+                            field: np.ndarray,
+                            z_dots: np.ndarray
+                        ) -> np.ndarray:
+    """Volume-weighted average of a field around each of the z_dots
+
+    The value of the field at every cell whose centre falls in the 
+    slice around each point of z_dots is weighted with its volume 
+    divided by the total volume of the cells in that slice. All the 
+    timesteps are averaged at once. Slices that contain no cells get 
+    an average of 0.
+
+    This builds a one-off AxialAverager. To average several fields of 
+    the same mesh, use get_axial_averager instead.
+
+    Parameters
+    ----------
+    z_centres : numpy.ndarray
+        z-coordinate of the centre of every cell, shape (cells,)
+    cell_volumes : numpy.ndarray
+        Volume of every cell, shape (cells,)
+    field : numpy.ndarray
+        Value of the field at every cell for every timestep, shape 
+        (timesteps, cells). A list with one array per timestep is 
+        also accepted.
+    z_dots : numpy.ndarray
+        z-coordinate of the centre of every slice (equally spaced)
+
+    Returns
+    -------
+    avg : numpy.ndarray
+        Average of the field in each slice for each timestep, shape
+        (timesteps, len(z_dots))
+
+    """
+
+    return AxialAverager(z_centres, cell_volumes, z_dots).average(field)
+
+
+class AxialAverager:
+    """Precomputed operator for volume-weighted axial averages.
+
+    Finding which cells fall in each slice is the expensive part of 
+    the axial averages, and it only depends on the mesh and on the 
+    slices. This class does it once and stores the result as a 
+    sparse matrix with one row per slice and one column per cell, 
+    whose elements are the volume of the cell divided by the total 
+    volume of the slice. Averaging any field for all its timesteps 
+    is then a single matrix product.
+
+    Use get_axial_averager to get the (cached) averager of a mesh.
+
+    Attributes
+    ----------
+    z_dots : numpy.ndarray
+        z-coordinate of the centre of every slice
+    num_cell : int
+        Number of cells of the mesh
+    slice_volumes : numpy.ndarray
+        Total volume of the cells of every slice
+    weights : scipy.sparse.csr_matrix
+        Slice-weight matrix, shape (len(z_dots), num_cell)
+
+    Methods
+    -------
+    from_mesh(mesh, num_zdots, z_range=None) -> AxialAverager
+        Build the averager of an Ofpp mesh with cell centres and 
+        volumes.
+    average(self, field) -> numpy.ndarray
+        Average a field for all its timesteps.
+
+    """
+
+    def __init__(   self,
+                    z_centres: np.ndarray,
+                    cell_volumes: np.ndarray,
+                    z_dots: np.ndarray
+                ):
+        """
+        Build the slice-weight matrix for the given cells and slices.
+
+        Parameters
+        ----------
+        z_centres : numpy.ndarray
+            z-coordinate of the centre of every cell, shape (cells,)
+        cell_volumes : numpy.ndarray
+            Volume of every cell, shape (cells,)
+        z_dots : numpy.ndarray
+            z-coordinate of the centre of every slice (equally 
+            spaced)
+        """
+        z_centres = np.asarray(z_centres, dtype=float)
+        cell_volumes = np.asarray(cell_volumes, dtype=float)
+        self.z_dots = np.asarray(z_dots, dtype=float)
+        self.num_cell = len(z_centres)
+        num_zdots = len(self.z_dots)
+
+        cells, slices = _axial_slice_membership(z_centres, self.z_dots)
+        pair_volumes = cell_volumes[cells]
+        self.slice_volumes = np.bincount(slices, weights=pair_volumes, minlength=num_zdots)
+
+        # Slices without cells have no elements, so their average is 0.
+        self.weights = sparse.csr_matrix(
+            (pair_volumes/self.slice_volumes[slices], (slices, cells)),
+            shape=(num_zdots, self.num_cell)
+        )
+
+    @classmethod
+    def from_mesh(  cls,
+                    mesh,
+                    num_zdots: int,
+                    z_range: tuple[float, float] = None
+                ) -> "AxialAverager":
+        """
+        Build the averager of a mesh.
+
+        Parameters
+        ----------
+        mesh : Ofpp.mesh_parser.FoamMesh
+            Mesh with cell_centres and cell_volumes already read
+        num_zdots : int
+            Number of points to divide the lenght of the reactor in.
+        z_range : tuple[float, float]
+            (min_z, max_z) of the z_dots. By default, the minimum and 
+            maximum z-coordinate of the cells of the mesh.
+
+        Returns
+        -------
+        AxialAverager
+        """
+        z_centres = np.asarray(mesh.cell_centres)[:, 2]
+        if z_range is None:
+            z_range = (z_centres.min(), z_centres.max())
+        z_dots = np.linspace(z_range[0], z_range[1], num_zdots)
+
+        return cls(z_centres, mesh.cell_volumes, z_dots)
+
+    def average(self, field, scale: np.ndarray = None) -> np.ndarray:
+        """
+        Average a field around each of the z_dots.
+
+        Parameters
+        ----------
+        field : numpy.ndarray
+            Value of the field at every cell for every timestep, 
+            shape (timesteps, cells). A list with one array per 
+            timestep, or a single timestep of shape (cells,), are 
+            also accepted. Other sequences (e.g. the fields of a 
+            SimulationData) are averaged one timestep at a time, so 
+            that they are never all loaded at once.
+        scale : numpy.ndarray
+            Average scale*field instead, with scale given at every 
+            cell, shape (cells,) (e.g. the axial velocity, for 
+            flow-weighted averages). By default (None), 1.
+
+        Returns
+        -------
+        avg : numpy.ndarray
+            Average of the field in each slice for each timestep, 
+            shape (timesteps, len(z_dots))
+        """
+        weights = self.weights
+        if scale is not None:
+            weights = weights.multiply(np.asarray(scale, dtype=float)[None, :]).tocsr()
+
+        if not isinstance(field, (np.ndarray, list, tuple)):
+            avg = np.empty((len(field), len(self.z_dots)))
+            for ts, values in enumerate(field):
+                avg[ts] = weights @ np.asarray(values, dtype=float)
+            return avg
+
+        field = np.asarray(field, dtype=float).reshape(-1, self.num_cell)
+
+        return np.asarray(weights @ field.T).T
+
+
+def get_axial_averager( mesh,
+                        num_zdots: int,
+                        z_range: tuple[float, float] = None,
+                        chunk_size: int = None
+                    ) -> AxialAverager:
+    """Get the AxialAverager of a mesh, reusing it if possible
+
+    Averagers are cached per (mesh, num_zdots, z_range), so that 
+    averaging several fields of the same mesh (pressure, temperature, 
+    etc.) only finds the slices of the cells once. The cache keeps 
+    the AVERAGER_CACHE_SIZE most recently used averagers. It only 
+    holds weak references to the meshes, so a mesh that is no longer 
+    used is never matched again.
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh
+        Mesh with cell_centres and cell_volumes already read
+    num_zdots : int
+        Number of points to divide the lenght of the reactor in.
+    z_range : tuple[float, float]
+        (min_z, max_z) of the z_dots. By default, the minimum and 
+        maximum z-coordinate of the cells of the mesh.
+    chunk_size : int
+        If given, get a chunked_averaging.ChunkedAxialAverager 
+        instead, which reads the mesh and the fields in chunks of 
+        chunk_size cells (for meshes larger than the memory). By 
+        default (None), the in-memory AxialAverager.
+
+    Returns
+    -------
+    AxialAverager or chunked_averaging.ChunkedAxialAverager
+
+    """
+
+    if z_range is not None:
+        z_range = (float(z_range[0]), float(z_range[1]))
+
+    if chunk_size is not None:
+        return _cached_averager(mesh, ("axial", num_zdots, z_range, chunk_size),
+                                lambda: chunked_averaging.ChunkedAxialAverager.from_mesh(
+                                    mesh, num_zdots, z_range, chunk_size))
+
+    return _cached_averager(mesh, ("axial", num_zdots, z_range),
+                            lambda: AxialAverager.from_mesh(mesh, num_zdots, z_range))
+
+
+def _cached_averager(mesh, options: tuple, build):
+    """Get the averager of a mesh with some options from the cache,
+    or build it with build() and add it to the cache"""
+
+    key = (id(mesh),) + options
+
+    cached = _averager_cache.get(key)
+    if cached is not None and cached[0]() is mesh:
+        _averager_cache.move_to_end(key)
+        return cached[1]
+
+    averager = build()
+    _averager_cache[key] = (weakref.ref(mesh), averager)
+    while len(_averager_cache) > AVERAGER_CACHE_SIZE:
+        _averager_cache.popitem(last=False)
+
+    return averager
+
+
+def clear_averager_cache():
+    """Remove all the averagers (axial and profile) and cell locators
+    (spatial_index.py module) from the cache"""
+    _averager_cache.clear()
+
+
+def cylindrical_coordinates(    points: np.ndarray,
+                                centre: tuple[float, float] = (0.0, 0.0)
+                            ) -> np.ndarray:
+    """Convert points to cylindrical coordinates around the reactor axis
+
+    The axis of the reactor is parallel to z and goes through centre.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Cartesian coordinates, shape (N, 3)
+    centre : tuple[float, float]
+        (x, y) of the axis of the reactor. By default the z axis.
+
+    Returns
+    -------
+    numpy.ndarray
+        (r, theta, z) of every point, shape (N, 3), with theta in
+        radians between -pi and pi
+
+    """
+
+    points = np.asarray(points, dtype=float)
+    x = points[:, 0] - centre[0]
+    y = points[:, 1] - centre[1]
+
+    return np.stack((np.hypot(x, y), np.arctan2(y, x), points[:, 2]), axis=1)
+
+
+def _profile_bin_index(cell_coordinates: np.ndarray, edges: tuple[np.ndarray]) -> np.ndarray:
+    """Flat index of the bin of every cell (in C order), -1 for the
+    cells outside of all the bins (see ProfileAverager)"""
+
+    shape = tuple(len(e) - 1 for e in edges)
+
+    # Bin of each cell along each coordinate:
+    inside = np.ones(len(cell_coordinates), dtype=bool)
+    indices = []
+    for i, e in enumerate(edges):
+        index = np.searchsorted(e, cell_coordinates[:, i], side='right') - 1
+        # The upper edge of the last bin is included:
+        index[cell_coordinates[:, i] == e[-1]] = len(e) - 2
+        inside &= (index >= 0) & (index < len(e) - 1)
+        indices.append(index)
+
+    bin_index = np.full(len(cell_coordinates), -1, dtype=np.int64)
+    bin_index[inside] = np.ravel_multi_index([index[inside] for index in indices], shape)
+
+    return bin_index
+
+
+class ProfileAverager:
+    """Precomputed binning index for volume-weighted profiles.
+
+    The cells are sorted into bins of one or more cylindrical 
+    coordinates (r, theta, z) of their centres, e.g. rings for a 
+    radial profile or (r, z) cells for an r-z map. Each cell falls in
+    one bin at most. As in AxialAverager, the bins are found once and 
+    stored as a sparse matrix with one row per bin and one column per
+    cell, whose elements are the volume of the cell divided by the 
+    total volume of its bin, so any field is averaged for all its 
+    timesteps with a single matrix product.
+
+    Use get_profile_averager to get the (cached) averager of a mesh.
+
+    Attributes
+    ----------
+    coordinates : tuple[str]
+        Coordinates of the bins, from 'r', 'theta' and 'z'
+    edges : tuple[numpy.ndarray]
+        Edges of the bins for each coordinate
+    centres : tuple[numpy.ndarray]
+        Centres of the bins for each coordinate
+    shape : tuple[int]
+        Number of bins for each coordinate
+    bin_index : numpy.ndarray
+        Flat index of the bin of every cell (in C order), -1 for the
+        cells outside of all the bins
+    bin_volumes : numpy.ndarray
+        Total volume of the cells of every bin, shape shape
+    num_cell : int
+        Number of cells of the mesh
+    weights : scipy.sparse.csr_matrix
+        Bin-weight matrix, shape (number of bins, num_cell)
+
+    Methods
+    -------
+    from_mesh(mesh, coordinates, bins, ranges=None, centre=(0, 0))
+        Build the averager of a mesh with cell centres and volumes.
+    average(self, field) -> numpy.ndarray
+        Average a field for all its timesteps.
+
+    """
+
+    def __init__(   self,
+                    cell_coordinates: np.ndarray,
+                    cell_volumes: np.ndarray,
+                    edges: list[np.ndarray],
+                    coordinates: tuple[str] = None
+                ):
+        """
+        Build the bin-weight matrix for the given cells and bins.
+
+        Parameters
+        ----------
+        cell_coordinates : numpy.ndarray
+            Coordinates of the centre of every cell used for the 
+            bins, shape (cells, len(edges))
+        cell_volumes : numpy.ndarray
+            Volume of every cell, shape (cells,)
+        edges : list[numpy.ndarray]
+            Edges of the bins for each coordinate (increasing). As in
+            numpy.histogram, bins include their lower edge, and the
+            last one also its upper edge.
+        coordinates : tuple[str]
+            Names of the coordinates, only for reference
+        """
+        cell_coordinates = np.asarray(cell_coordinates, dtype=float).reshape(len(cell_volumes), -1)
+        cell_volumes = np.asarray(cell_volumes, dtype=float)
+        self.coordinates = tuple(coordinates) if coordinates is not None else None
+        self.edges = tuple(np.asarray(e, dtype=float) for e in edges)
+        self.centres = tuple((e[1:] + e[:-1])/2 for e in self.edges)
+        self.shape = tuple(len(e) - 1 for e in self.edges)
+        self.num_cell = len(cell_volumes)
+        num_bins = int(np.prod(self.shape))
+
+        self.bin_index = _profile_bin_index(cell_coordinates, self.edges)
+
+        cells = np.flatnonzero(self.bin_index >= 0)
+        bins = self.bin_index[cells]
+        bin_volumes = np.bincount(bins, weights=cell_volumes[cells], minlength=num_bins)
+        self.bin_volumes = bin_volumes.reshape(self.shape)
+
+        self.weights = sparse.csr_matrix(
+            (cell_volumes[cells]/bin_volumes[bins], (bins, cells)),
+            shape=(num_bins, self.num_cell)
+        )
+        self._empty = bin_volumes == 0
+
+    @classmethod
+    def from_mesh(  cls,
+                    mesh,
+                    coordinates: tuple[str],
+                    bins: tuple[int],
+                    ranges: dict = None,
+                    centre: tuple[float, float] = (0.0, 0.0)
+                ) -> "ProfileAverager":
+        """
+        Build the averager of a mesh, with equally spaced bins.
+
+        Parameters
+        ----------
+        mesh : Ofpp.mesh_parser.FoamMesh
+            Mesh with cell_centres and cell_volumes already read
+        coordinates : tuple[str]
+            Coordinates of the bins, e.g. ('r',), ('r', 'z') or 
+            ('r', 'theta', 'z')
+        bins : tuple[int]
+            Number of bins for each coordinate
+        ranges : dict
+            (min, max) of the bins of some coordinates, e.g. 
+            {"z": (z_min, z_max)}. By default, 'r' goes from 0 to the
+            largest radius of the points of the mesh (the wall), 
+            'theta' and 'z' from the minimum to the maximum of the 
+            points of the mesh.
+        centre : tuple[float, float]
+            (x, y) of the axis of the reactor. By default the z axis.
+
+        Returns
+        -------
+        ProfileAverager
+        """
+        ranges = dict(ranges or {})
+        columns = {"r": 0, "theta": 1, "z": 2}
+        cell_coordinates = cylindrical_coordinates(mesh.cell_centres, centre)
+
+        points = getattr(mesh, "points", None)
+        bounds = cylindrical_coordinates(points if points is not None else mesh.cell_centres, centre)
+
+        edges = []
+        for name, num_bins in zip(coordinates, bins):
+            if name not in ranges:
+                low = 0.0 if name == "r" else bounds[:, columns[name]].min()
+                ranges[name] = (low, bounds[:, columns[name]].max())
+            edges.append(np.linspace(ranges[name][0], ranges[name][1], num_bins + 1))
+
+        return cls(cell_coordinates[:, [columns[name] for name in coordinates]],
+                   mesh.cell_volumes, edges, coordinates)
+
+    def average(self, field, scale: np.ndarray = None) -> np.ndarray:
+        """
+        Average a field in each bin.
+
+        Parameters
+        ----------
+        field : numpy.ndarray
+            Value of the field at every cell for every timestep, 
+            shape (timesteps, cells). Lists, single timesteps and 
+            other sequences are accepted as in AxialAverager.average.
+        scale : numpy.ndarray
+            As in AxialAverager.average
+
+        Returns
+        -------
+        avg : numpy.ndarray
+            Average of the field in each bin for each timestep, shape
+            (timesteps,) + shape. Bins without cells are NaN.
+        """
+        weights = self.weights
+        if scale is not None:
+            weights = weights.multiply(np.asarray(scale, dtype=float)[None, :]).tocsr()
+
+        if not isinstance(field, (np.ndarray, list, tuple)):
+            avg = np.empty((len(field), weights.shape[0]))
+            for ts, values in enumerate(field):
+                avg[ts] = weights @ np.asarray(values, dtype=float)
+        else:
+            field = np.asarray(field, dtype=float).reshape(-1, self.num_cell)
+            avg = np.asarray(weights @ field.T).T
+
+        avg[:, self._empty] = np.nan
+
+        return avg.reshape((len(avg),) + self.shape)
+
+
+def get_profile_averager(   mesh,
+                            coordinates: tuple[str],
+                            bins: tuple[int],
+                            ranges: dict = None,
+                            centre: tuple[float, float] = (0.0, 0.0),
+                            chunk_size: int = None
+                        ) -> ProfileAverager:
+    """Get the ProfileAverager of a mesh, reusing it if possible
+
+    Averagers are cached with the axial ones (see 
+    get_axial_averager), so the bins of the cells are only found 
+    once for all the fields and timesteps of a mesh.
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh
+        Mesh with cell_centres and cell_volumes already read
+    coordinates, bins, ranges, centre
+        As in ProfileAverager.from_mesh
+    chunk_size : int
+        If given, get a chunked_averaging.ChunkedProfileAverager 
+        instead, as in get_axial_averager
+
+    Returns
+    -------
+    ProfileAverager or chunked_averaging.ChunkedProfileAverager
+
+    """
+
+    coordinates = tuple(coordinates)
+    bins = tuple(int(b) for b in bins)
+    ranges_key = tuple(sorted((name, float(low), float(high))
+                              for name, (low, high) in (ranges or {}).items()))
+    centre = (float(centre[0]), float(centre[1]))
+
+    if chunk_size is not None:
+        return _cached_averager(mesh, ("profile", coordinates, bins, ranges_key, centre, chunk_size),
+                                lambda: chunked_averaging.ChunkedProfileAverager.from_mesh(
+                                    mesh, coordinates, bins, ranges, centre, chunk_size))
+
+    return _cached_averager(mesh, ("profile", coordinates, bins, ranges_key, centre),
+                            lambda: ProfileAverager.from_mesh(mesh, coordinates, bins, ranges, centre))
+
+
+def _wall_radius(   data: dict,
+                    centre: tuple[float, float],
+                    chunk_size: int = None
+                ) -> float:
+    """Largest radius of the points of the meshes of a case"""
+
+    radius = 0.0
+    for key in ("FluidMesh", "SolidMesh"):
+        mesh = data[key]
+        points = getattr(mesh, "points", None)
+        points = points if points is not None else mesh.cell_centres
+        radius = max(radius, chunked_averaging.cylindrical_range(points, "r", centre, chunk_size)[1])
+
+    return radius
+
 
 def getAvg_p_rgh(   data: dict,
-                    num_zdots: int
+                    num_zdots: int,
+                    chunk_size: int = None
                 ):
     """Function for getting the average pressure in the cross section
 
@@ -38,64 +640,34 @@ def getAvg_p_rgh(   data: dict,
         dictionary with the results from the simulation
     num_zdots : int
         Number of points to divide the lenght of the reactor in.
+    chunk_size : int
+        Number of cells read at a time, for meshes larger than the 
+        memory (see get_axial_averager). By default, all at once.
 
     Returns
     -------
-    z_dots : list[numpy.float64]
+    z_dots : numpy.ndarray
         z-coordinate of the num_zdots points for which the average 
         pressure is calcullated. length of z_dots is num_zdots
 
-    avg_p : list[list[numpy.float64]]
+    avg_p : numpy.ndarray
         Average pressure arround the section at each of the z_dots 
-        for each of the momentum timesteps.
+        for each of the momentum timesteps, shape (timesteps, 
+        num_zdots). avg_p[ts] is the profile of timestep ts.
     """
 
-    # Centres of the cells in the fluid region:
-    fluidmesh = data["FluidMesh"]
-    z_centres = [centre[2] for centre in fluidmesh.cell_centres]
-
-
-    # Minimum and maximum z-coordinate of all the cells:
-    min_z = min(z_centres)
-    max_z = max(z_centres)
-
-    # Z points to calcullate the average arround:
-    z_dots = np.linspace(min_z, max_z, num_zdots)
-
-    # Half size of the segments:
-    half_segsize = (z_dots[1] - z_dots[0])/2.0
-    
-    # Save index of cells in each of the samnple sections:
-    indexes = [[] for _ in range(0, num_zdots)]
-
-    for i in range(0, fluidmesh.num_cell):
-        for j in range(0,num_zdots):
-            if (z_centres[i] >= z_dots[j]-half_segsize) and (z_centres[i]<=z_dots[j]+half_segsize):
-                indexes[j].append(i)
+    # Slices between the minimum and maximum z-coordinate of all the 
+    # cells in the fluid region:
+    averager = get_axial_averager(data["FluidMesh"], num_zdots, chunk_size=chunk_size)
 
     # Calcullate the average pressure in each section for each timestep.
-    num_timesteps = len(data["MomentumTimesteps"])
-    print(num_timesteps)
-    print(data["MomentumTimesteps"])
-    p_data = data["StaticPressure"]
-    avg_p =  []
-
-    for ts in range(0, num_timesteps):
-        print(ts)
-        print(p_data[ts][1])
-        p_rgh_ts = []
-        for j in range(0,num_zdots):
-            total_cell_vol = np.sum([fluidmesh.cell_volumes[i] for i in indexes[j]])
-            p_rgh_ts_zi = np.sum([p_data[ts][i]*fluidmesh.cell_volumes[i]/total_cell_vol for i in indexes[j]])
+    avg_p = averager.average(data["StaticPressure"])
 
-            p_rgh_ts.append(p_rgh_ts_zi)
-
-        avg_p.append(p_rgh_ts)
-
-    return z_dots, avg_p
+    return averager.z_dots, avg_p
 
 def getAvg_T_justFluid( data: dict,
-                        num_zdots: int
+                        num_zdots: int,
+                        chunk_size: int = None
                         ):
     """Function for getting the average temperature in the cross section
 
@@ -124,61 +696,36 @@ def getAvg_T_justFluid( data: dict,
         dictionary with the results from the simulation
     num_zdots : int
         Number of points to divide the lenght of the reactor in.
+    chunk_size : int
+        Number of cells read at a time, for meshes larger than the 
+        memory (see get_axial_averager). By default, all at once.
 
     Returns
     -------
-    z_dots : list[numpy.float64]
+    z_dots : numpy.ndarray
         z-coordinate of the num_zdots points for which the average 
         pressure is calcullated. length of z_dots is num_zdots
 
-    avg_T_flu : list[list[numpy.float64]]
+    avg_T_flu : numpy.ndarray
         Average temperature arround the section at each of the z_dots 
-        for each of the momentum timesteps.
+        for each of the thermal timesteps, shape (timesteps, 
+        num_zdots).
     """
 
-    # Centres of the cells in the fluid region:
-    fluidmesh = data["FluidMesh"]
-    z_centres = [centre[2] for centre in fluidmesh.cell_centres]
-
-
-    # Minimum and maximum z-coordinate of all the cells:
-    min_z = min(z_centres)
-    max_z = max(z_centres)
-
-    # Z points to calcullate the average arround:
-    z_dots = np.linspace(min_z, max_z, num_zdots)
-
-    # Half size of the segments:
-    half_segsize = (z_dots[1] - z_dots[0])/2.0
-    
-    # Save index of cells in each of the samnple sections:
-    indexes = [[] for _ in range(0, num_zdots)]
-
-    for i in range(0, fluidmesh.num_cell):
-        for j in range(0,num_zdots):
-            if (z_centres[i] >= z_dots[j]-half_segsize) and (z_centres[i]<=z_dots[j]+half_segsize):
-                indexes[j].append(i)
-
-    # Calcullate the average pressure in each section for each timestep.
-    num_timesteps = len(data["ThermalTimesteps"])
-    T_data = data["FluidTemperature"]
-    avg_T =  []
-
-    for ts in range(0, num_timesteps):
-        p_rgh_ts = []
-        for j in range(0,num_zdots):
-            total_cell_vol = np.sum([fluidmesh.cell_volumes[i] for i in indexes[j]])
-            p_rgh_ts_zi = np.sum([T_data[ts][i]*fluidmesh.cell_volumes[i]/total_cell_vol for i in indexes[j]])
-
-            p_rgh_ts.append(p_rgh_ts_zi)
+    # Slices between the minimum and maximum z-coordinate of all the 
+    # cells in the fluid region:
+    averager = get_axial_averager(data["FluidMesh"], num_zdots, chunk_size=chunk_size)
 
-        avg_T.append(p_rgh_ts)
+    # Calcullate the average temperature in each section for each 
+    # timestep.
+    avg_T = averager.average(data["FluidTemperature"])
 
-    return z_dots, avg_T
+    return averager.z_dots, avg_T
 
 
 def getAvg_T(   data: dict,
-                num_zdots: int
+                num_zdots: int,
+                chunk_size: int = None
             ):
     """Function for getting the average temperature in the cross section
 
@@ -207,75 +754,173 @@ def getAvg_T(   data: dict,
         dictionary with the results from the simulation
     num_zdots : int
         Number of points to divide the lenght of the reactor in.
+    chunk_size : int
+        Number of cells read at a time, for meshes larger than the 
+        memory (see get_axial_averager). By default, all at once.
 
     Returns
     -------
-    z_dots : list[numpy.float64]
+    z_dots : numpy.ndarray
         z-coordinate of the num_zdots points for which the average 
         temperature is calcullated. length of z_dots is num_zdots
 
-    avg_T_fluid : list[list[numpy.float64]]
+    avg_T_fluid : numpy.ndarray
         Average temperature in the fluid arround the section at each
-        of the z_dots for each of the thermal timesteps.
+        of the z_dots for each of the thermal timesteps, shape 
+        (timesteps, num_zdots).
 
-    avg_T_solid : list[list[numpy.float64]]
+    avg_T_solid : numpy.ndarray
         Average temperature in the solid arround the section at each
-        of the z_dots for each of the thermal timesteps.
+        of the z_dots for each of the thermal timesteps, shape 
+        (timesteps, num_zdots).
     """
 
-    # Centres of the cells in the fluid region:
     fluidmesh = data["FluidMesh"]
-    z_cen_fluid = [centre[2] for centre in fluidmesh.cell_centres]
+    solidmesh = data["SolidMesh"]
+
+    # Z points to calculate the average arround, between the minimum 
+    # and maximum z-coordinate of the cells within the reator (the 
+    # solid region):
+    z_range = chunked_averaging.column_range(np.asarray(solidmesh.cell_centres), 2, chunk_size)
+    fluid_averager = get_axial_averager(fluidmesh, num_zdots, z_range, chunk_size)
+    solid_averager = get_axial_averager(solidmesh, num_zdots, z_range, chunk_size)
+    z_dots = solid_averager.z_dots
+
+    # Calcullate the average temperature in each section for each 
+    # timestep, separately for each region.
+    avg_T_fluid = fluid_averager.average(data["FluidTemperature"])
+    avg_T_solid = solid_averager.average(data["SolidTemperature"])
+
+    return z_dots, avg_T_fluid, avg_T_solid
+
+
+def getAvg_T_radial(    data: dict,
+                        num_rdots: int,
+                        z_range: tuple[float, float] = None,
+                        centre: tuple[float, float] = (0.0, 0.0),
+                        chunk_size: int = None
+                    ):
+    """Function for getting the radial profiles of temperature
+
+    This function divides the radius of the reactor (from the axis 
+    to the wall) in num_rdots rings of equal width, and calcullates 
+    the average temperature of the cells of each ring, separately for
+    the fluid and the solid. For the averaging, the temperature of 
+    each cell is weighted to its volume divided by the total volume 
+    of all the cells of the ring. By default, just the region of the
+    structured catalyst (the z-range of the solid) is used.
+
+    z_dots are not used: the whole z_range is averaged in every ring.
+
+    r_dots, avg_T_fluid, avg_T_solid = getAvg_T_radial( data, num_rdots )
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation
+    num_rdots : int
+        Number of rings to divide the radius of the reactor in.
+    z_range : tuple[float, float]
+        (min_z, max_z) of the cells used. By default, the minimum and
+        maximum z-coordinate of the points of the solid region.
+    centre : tuple[float, float]
+        (x, y) of the axis of the reactor. By default the z axis.
+    chunk_size : int
+        Number of cells read at a time, for meshes larger than the 
+        memory (see get_axial_averager). By default, all at once.
+
+    Returns
+    -------
+    r_dots : numpy.ndarray
+        Radius of the centre of each ring, length num_rdots
+
+    avg_T_fluid : numpy.ndarray
+        Average temperature in the fluid in each ring for each of 
+        the thermal timesteps, shape (timesteps, num_rdots). Rings 
+        without fluid cells are NaN.
+
+    avg_T_solid : numpy.ndarray
+        Same as avg_T_fluid, for the solid.
+    """
+
+    r_dots, _, avg_T_fluid, avg_T_solid = getAvg_T_rz(data, num_rdots, 1, z_range, centre, chunk_size)
+
+    return r_dots, avg_T_fluid[:, :, 0], avg_T_solid[:, :, 0]
 
-    # Centres of the cells in the solid region:
+
+def getAvg_T_rz(    data: dict,
+                    num_rdots: int,
+                    num_zdots: int,
+                    z_range: tuple[float, float] = None,
+                    centre: tuple[float, float] = (0.0, 0.0),
+                    chunk_size: int = None
+                ):
+    """Function for getting r-z maps of temperature
+
+    This function divides the reactor in num_rdots rings of equal 
+    width (from the axis to the wall) and num_zdots slices of equal 
+    length, and calcullates the average temperature of the cells of 
+    each (ring, slice) bin, separately for the fluid and the solid. 
+    For the averaging, the temperature of each cell is weighted to 
+    its volume divided by the total volume of all the cells of the 
+    bin.
+
+    r_dots, z_dots, avg_T_fluid, avg_T_solid = getAvg_T_rz( data, num_rdots, num_zdots )
+    plt.pcolormesh(z_dots, r_dots, avg_T_fluid[-1])
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation
+    num_rdots : int
+        Number of rings to divide the radius of the reactor in.
+    num_zdots : int
+        Number of slices to divide the z_range in.
+    z_range : tuple[float, float]
+        (min_z, max_z) of the slices. By default, the minimum and 
+        maximum z-coordinate of the points of the solid region (the 
+        structured catalyst).
+    centre : tuple[float, float]
+        (x, y) of the axis of the reactor. By default the z axis.
+    chunk_size : int
+        Number of cells read at a time, for meshes larger than the 
+        memory (see get_axial_averager). By default, all at once.
+
+    Returns
+    -------
+    r_dots : numpy.ndarray
+        Radius of the centre of each ring, length num_rdots
+
+    z_dots : numpy.ndarray
+        z-coordinate of the centre of each slice, length num_zdots
+
+    avg_T_fluid : numpy.ndarray
+        Average temperature in the fluid in each bin for each of the
+        thermal timesteps, shape (timesteps, num_rdots, num_zdots).
+        Bins without fluid cells are NaN.
+
+    avg_T_solid : numpy.ndarray
+        Same as avg_T_fluid, for the solid.
+    """
+
+    fluidmesh = data["FluidMesh"]
     solidmesh = data["SolidMesh"]
-    z_cen_solid = [centre[2] for centre in solidmesh.cell_centres]
 
-    # Minimum and maximum z-coordinate of the cells within the reator:
-    min_z = min(z_cen_solid)
-    max_z = max(z_cen_solid)
+    # Same bins for both regions: rings up to the wall of the reactor
+    # and slices within the catalyst
+    if z_range is None:
+        points = getattr(solidmesh, "points", None)
+        points = np.asarray(points if points is not None else solidmesh.cell_centres)
+        z_range = chunked_averaging.column_range(points, 2, chunk_size)
+    ranges = {"r": (0.0, _wall_radius(data, centre, chunk_size)), "z": z_range}
 
-    # Z points to calculate the average arround:
-    z_dots = np.linspace(min_z, max_z, num_zdots)
+    fluid_averager = get_profile_averager(fluidmesh, ("r", "z"), (num_rdots, num_zdots), ranges, centre,
+                                          chunk_size)
+    solid_averager = get_profile_averager(solidmesh, ("r", "z"), (num_rdots, num_zdots), ranges, centre,
+                                          chunk_size)
+    r_dots, z_dots = solid_averager.centres
 
-    # Half size of the segments:
-    half_segsize = (z_dots[1] - z_dots[0])/2.0
-    
-    # Save index of cells in each of the samnple sections:
-    indexesFluid = [[] for _ in range(0, num_zdots)]
-    indexesSolid = [[] for _ in range(0, num_zdots)]
-
-    for i in range(0, fluidmesh.num_cell):
-        for j in range(0,num_zdots):
-            if (z_cen_fluid[i] >= z_dots[j]-half_segsize) and (z_cen_fluid[i]<=z_dots[j]+half_segsize):
-                indexesFluid[j].append(i)
-
-    for i in range(0,solidmesh.num_cell):
-        for j in range(0,num_zdots):
-            if (z_cen_solid[i] >= z_dots[j]-half_segsize) and (z_cen_solid[i]<=z_dots[j]+half_segsize):
-                indexesSolid[j].append(i)
-
-    # Calcullate the average temperature in each section for each timestep.
-    num_timesteps = len(data["ThermalTimesteps"])
-    T_data_fluid = data["FluidTemperature"]
-    T_data_solid = data["SolidTemperature"]
-    avg_T_fluid =  []
-    avg_T_solid =  []
-
-    for ts in range(0, num_timesteps):
-        Tflu_ts = []
-        Tsol_ts = []
-        for j in range(0,num_zdots):
-            total_cell_vol_fluid = np.sum([fluidmesh.cell_volumes[i] for i in indexesFluid[j]])
-            total_cell_vol_solid = np.sum([solidmesh.cell_volumes[i] for i in indexesSolid[j]])
-
-            T_flu_ts_zi = np.sum([T_data_fluid[ts][i]*fluidmesh.cell_volumes[i]/total_cell_vol_fluid for i in indexesFluid[j]])
-            T_sol_ts_zi = np.sum([T_data_solid[ts][i]*solidmesh.cell_volumes[i]/total_cell_vol_solid for i in indexesSolid[j]])
-            
-            Tflu_ts.append(T_flu_ts_zi)
-            Tsol_ts.append(T_sol_ts_zi)
-
-        avg_T_fluid.append(Tflu_ts)
-        avg_T_solid.append(Tsol_ts)
+    avg_T_fluid = fluid_averager.average(data["FluidTemperature"])
+    avg_T_solid = solid_averager.average(data["SolidTemperature"])
 
-    return z_dots, avg_T_fluid, avg_T_solid
+    return r_dots, z_dots, avg_T_fluid, avg_T_solid
@@ -0,0 +1,292 @@
+"""Simulation data module
+
+This module defines SimulationData, a lazy replacement for the dict
+returned by read_simulation_data / load_simulation_data
+(data_handling_functions.py module).
+
+It has the same keys and is indexed in the same way
+(data["FluidTemperature"][ts]), but the timesteps of the fields are
+only read when they are first accessed. The arrays read are kept in
+a cache with a memory budget; when the budget is exceeded, the least
+recently used timesteps are dropped (and read again if they are
+needed later). The case parameters, the meshes and the lists of
+timesteps are always loaded.
+
+The data can be read straight from the OpenFOAM case directory
+(SimulationData.from_case) or from a case store created with
+read_simulation_data(store_format='columnar') (SimulationData.from_store).
+The post-processing functions accept a SimulationData wherever they
+accept the data dict.
+
+It uses collections
+
+"""
+
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+
+import case_store
+import data_handling_functions
+import decomposed_case
+
+# Default memory budget of the timestep cache [bytes]:
+DEFAULT_MEMORY_BUDGET = 2*1024**3
+
+
+class TimestepCache:
+    """Least-recently-used cache of field arrays with a memory budget.
+
+    Attributes
+    ----------
+    memory_budget : int
+        Maximum total size of the cached arrays [bytes]. The last
+        array loaded is always kept, even if it alone exceeds it.
+    nbytes : int
+        Total size of the cached arrays [bytes]
+    hits, misses : int
+        Number of accesses found and not found in the cache
+
+    Methods
+    -------
+    get(self, key, load) -> numpy.ndarray
+        Get the array of key, calling load() if it is not cached.
+    clear(self)
+        Drop all the cached arrays.
+
+    """
+
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._arrays = OrderedDict()
+
+    def get(self, key, load):
+        if key in self._arrays:
+            self.hits += 1
+            self._arrays.move_to_end(key)
+            return self._arrays[key]
+
+        self.misses += 1
+        array = load()
+        self._arrays[key] = array
+        self.nbytes += getattr(array, 'nbytes', 0)
+        self._evict()
+
+        return array
+
+    def _evict(self):
+        while self.nbytes > self.memory_budget and len(self._arrays) > 1:
+            _, array = self._arrays.popitem(last=False)
+            self.nbytes -= getattr(array, 'nbytes', 0)
+
+    def clear(self):
+        self._arrays.clear()
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._arrays)
+
+    def __repr__(self) -> str:
+        return (f"{self.__class__.__name__}(arrays={len(self)}, "
+                f"nbytes={self.nbytes}, memory_budget={self.memory_budget}, "
+                f"hits={self.hits}, misses={self.misses})")
+
+
+class LazyField(Sequence):
+    """Timesteps of one field of a SimulationData, read on access.
+
+    lazy_field[i] returns the value of the field in the i-th timestep
+    (an array with the value at every cell), reading it if it is not
+    in the cache of the SimulationData.
+
+    """
+
+    def __init__(self, owner: "SimulationData", field: str, sources: list):
+        self._owner = owner
+        self.field = field
+        self.sources = list(sources)
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"{self.field} has {len(self)} timesteps")
+        return self._owner._load(self.field, index)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.field!r}, timesteps={len(self)})"
+
+
+class SimulationData(Mapping):
+    """Data of a simulation, with the fields read on demand.
+
+    Behaves as the read-only dict of read_simulation_data, with keys
+    "Parameters", "SolidMesh", "FluidMesh", "MomentumTimesteps",
+    "ThermalTimesteps", "FluidTemperature", "SolidTemperature",
+    "StaticPressure" and "VelocityField". Fields are LazyField
+    sequences.
+
+    Attributes
+    ----------
+    cache : TimestepCache
+        Cache of the field arrays read, shared by all the fields
+    memory_budget : int
+        Memory budget of the cache [bytes], can be changed at any time
+
+    Methods
+    -------
+    from_case(case_path, ...) -> SimulationData
+        Read the fields from the files of an OpenFOAM case.
+    from_store(store_path, ...) -> SimulationData
+        Read the fields from a case store.
+
+    """
+
+    def __init__(   self,
+                    data: dict,
+                    field_sources: dict,
+                    loader,
+                    memory_budget: int = DEFAULT_MEMORY_BUDGET
+                ):
+        """
+        Parameters
+        ----------
+        data : dict
+            Items loaded eagerly (parameters, meshes and timesteps)
+        field_sources : dict
+            For each field, the list with the source of every
+            timestep (e.g. the file it is read from)
+        loader : callable
+            Function that reads one timestep of a field from its
+            source, loader(source) -> numpy.ndarray
+        memory_budget : int
+            Memory budget of the cache [bytes]
+        """
+        self.cache = TimestepCache(memory_budget)
+        self._loader = loader
+        self._data = dict(data)
+        for field, sources in field_sources.items():
+            self._data[field] = LazyField(self, field, sources)
+
+    @property
+    def memory_budget(self) -> int:
+        return self.cache.memory_budget
+
+    @memory_budget.setter
+    def memory_budget(self, value: int):
+        self.cache.memory_budget = value
+        self.cache._evict()
+
+    def _load(self, field: str, index: int):
+        source = self._data[field].sources[index]
+        return self.cache.get((field, index), lambda: self._loader(source))
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({list(self._data)}, {self.cache})"
+
+    @classmethod
+    def from_case(  cls,
+                    case_path: str,
+                    fluid_region_name: str = 'FluidRegion/',
+                    solid_region_name: str = 'CatalystRegion/',
+                    momentum_simulation_folder: str = 'MomentumSolution/',
+                    config_file_name: str = 'caseConfig.sh',
+                    mode: str = 'all',
+                    memory_budget: int = DEFAULT_MEMORY_BUDGET
+                ) -> "SimulationData":
+        """
+        Open the data of an OpenFOAM case without reading the fields.
+
+        The meshes and the case parameters are read right away, the
+        field files when each timestep is accessed.
+
+        Parameters
+        ----------
+        case_path, fluid_region_name, solid_region_name,
+        momentum_simulation_folder, config_file_name
+            As in read_simulation_data
+        mode : str
+            As in read_simulation_data, but 'all' by default.
+        memory_budget : int
+            Memory budget of the cache [bytes]
+
+        Returns
+        -------
+        SimulationData
+        """
+        field_timesteps, field_files = data_handling_functions._select_case_files(
+            case_path, fluid_region_name, solid_region_name, momentum_simulation_folder, mode
+        )
+        data = {"Parameters": data_handling_functions.load_case_properties(case_path, config_file_name),
+                "SolidMesh": data_handling_functions._read_mesh(case_path, solid_region_name),
+                "FluidMesh": data_handling_functions._read_mesh(case_path, fluid_region_name),
+                "MomentumTimesteps": field_timesteps["MomentumTimesteps"],
+                "ThermalTimesteps": field_timesteps["ThermalTimesteps"]}
+
+        # Uniform timesteps are expanded to the cells of the mesh of
+        # their field
+        field_sources = {field: [(source, data[case_store.field_keys(field)[1]].num_cell) for source in files]
+                         for field, files in field_files.items()}
+
+        return cls(data, field_sources, _load_case_field, memory_budget)
+
+    @classmethod
+    def from_store( cls,
+                    store_path: str,
+                    memory_budget: int = DEFAULT_MEMORY_BUDGET
+                ) -> "SimulationData":
+        """
+        Open a case store, reading each field timestep on access.
+
+        Unlike read_case_store, the arrays are read into memory (and
+        counted in the memory budget) instead of memory-mapped.
+
+        Parameters
+        ----------
+        store_path : str
+            Path to the case store directory
+        memory_budget : int
+            Memory budget of the cache [bytes]
+
+        Returns
+        -------
+        SimulationData
+        """
+        manifest = case_store.read_manifest(store_path)
+        data = {"Parameters": data_handling_functions.CaseParameters(**manifest["Parameters"])}
+        for key, mesh_manifest in manifest["meshes"].items():
+            data[key] = case_store.open_mesh(store_path, mesh_manifest)
+        data["MomentumTimesteps"] = manifest["MomentumTimesteps"]
+        data["ThermalTimesteps"] = manifest["ThermalTimesteps"]
+
+        field_sources = {field: [(store_path, filename) for filename in field_manifest["files"]]
+                         for field, field_manifest in manifest["fields"].items()}
+
+        return cls(data, field_sources, _load_store_array, memory_budget)
+
+
+def _load_case_field(source: tuple):
+    source, num_cell = source
+    values, uniform = decomposed_case.read_field(source, return_uniform=True)
+    return case_store.normalise_field(values, num_cell, uniform=uniform)
+
+
+def _load_store_array(source: tuple):
+    store_path, filename = source
+    return case_store._load_array(store_path, filename, mmap_mode=None)
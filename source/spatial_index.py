@@ -0,0 +1,407 @@
+"""Spatial index module
+
+This module defines point queries on the cells of a mesh: values of
+the fields at given points (probes, e.g. at the positions of the
+thermocouples), along a line (e.g. the centreline of the reactor) and
+on a cross section at a given z.
+
+The cells are found with a KD-tree (scipy.spatial.cKDTree) of their
+centres, built once per mesh (CellLocator, cached with the averagers
+of the mesh by get_cell_locator). The value at a point is the value
+of the cell whose centre is nearest, as in the cell-centred solution
+of OpenFOAM, and it is taken from all the timesteps of the field at
+once, so thousands of points are sampled in a few milliseconds.
+
+Points can fall outside of the region of a field (e.g. a point in a
+solid wall for the temperature of the fluid). The functions that
+take the data of a simulation (probe_field, sample_line and
+sample_plane) find the nearest cell of both the fluid and the solid
+regions, and return NaN for the points that are closer to a cell of
+the other region. Points outside of the reactor can be discarded
+with max_distance.
+
+T_probes = probe_field( data, "FluidTemperature", [(0, 0, 0.1), (0, 0, 0.2)] )
+s, T_axis = sample_line( data, "FluidTemperature", (0, 0, z_min), (0, 0, z_max), 200 )
+
+This module requires numpy and scipy.
+
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import case_store
+import post_processing_functions
+
+# Mesh keys of the region that is not the region of a mesh:
+_OTHER_MESH = {"FluidMesh": "SolidMesh", "SolidMesh": "FluidMesh"}
+
+
+class CellLocator:
+    """KD-tree of the centres of the cells of a mesh.
+
+    Use get_cell_locator to get the (cached) locator of a mesh.
+
+    Attributes
+    ----------
+    num_cell : int
+        Number of cells of the mesh
+    tree : scipy.spatial.cKDTree
+        KD-tree of the cell centres
+
+    Methods
+    -------
+    from_mesh(mesh) -> CellLocator
+        Build the locator of a mesh with cell centres.
+    nearest_cells(self, points, max_distance=None)
+        Nearest cell to every point, and its distance.
+    probe(self, field, points, max_distance=None) -> numpy.ndarray
+        Values of a field at some points for all its timesteps.
+    plane_cells(self, z) -> numpy.ndarray
+        Cells cut by a plane of constant z.
+
+    """
+
+    def __init__(self, cell_centres: np.ndarray):
+        """
+        Build the KD-tree of the cell centres.
+
+        Parameters
+        ----------
+        cell_centres : numpy.ndarray
+            Coordinates of the centre of every cell, shape (cells, 3)
+        """
+        cell_centres = np.asarray(cell_centres, dtype=float)
+        self.num_cell = len(cell_centres)
+        self.tree = cKDTree(cell_centres)
+
+    @classmethod
+    def from_mesh(cls, mesh) -> "CellLocator":
+        """
+        Build the locator of a mesh.
+
+        Parameters
+        ----------
+        mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+            Mesh with cell_centres already read
+
+        Returns
+        -------
+        CellLocator
+        """
+        return cls(mesh.cell_centres)
+
+    def nearest_cells(  self,
+                        points: np.ndarray,
+                        max_distance: float = None
+                    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the cell whose centre is nearest to every point.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            Cartesian coordinates of the points, shape (points, 3)
+        max_distance : float
+            Points farther than max_distance from all the cell
+            centres get no cell. By default (None), no limit.
+
+        Returns
+        -------
+        cells : numpy.ndarray
+            Index of the nearest cell to every point, -1 for the
+            points without a cell
+        distances : numpy.ndarray
+            Distance from every point to the centre of its cell (inf
+            for the points without a cell)
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        upper_bound = np.inf if max_distance is None else max_distance
+        distances, cells = self.tree.query(points, distance_upper_bound=upper_bound)
+        cells[cells == self.num_cell] = -1
+
+        return cells, distances
+
+    def probe(  self,
+                field,
+                points: np.ndarray,
+                max_distance: float = None
+            ) -> np.ndarray:
+        """
+        Get the values of a field at some points for all its
+        timesteps.
+
+        Parameters
+        ----------
+        field : numpy.ndarray
+            Value of the field at every cell for every timestep,
+            shape (timesteps, cells) or (timesteps, cells, 3) for a
+            vector field. Lists of arrays and other sequences (e.g.
+            the fields of a SimulationData) are read one timestep at
+            a time.
+        points : numpy.ndarray
+            Cartesian coordinates of the points, shape (points, 3)
+        max_distance : float
+            As in nearest_cells
+
+        Returns
+        -------
+        values : numpy.ndarray
+            Value of the nearest cell to every point for every
+            timestep, shape (timesteps, points) or (timesteps,
+            points, 3). NaN for the points without a cell.
+        """
+        cells, _ = self.nearest_cells(points, max_distance)
+        return take_cells(field, cells)
+
+    def plane_cells(self, z: float) -> np.ndarray:
+        """
+        Find the cells cut by a plane of constant z.
+
+        The cell of each point of the plane is the one with the
+        nearest centre, so the cells cut by the plane are the nearest
+        cells to the projections of all the cell centres on it.
+
+        Parameters
+        ----------
+        z : float
+            z-coordinate of the plane
+
+        Returns
+        -------
+        numpy.ndarray
+            Index of the cells cut by the plane, sorted
+        """
+        projected = np.array(self.tree.data)
+        projected[:, 2] = z
+
+        return np.unique(self.tree.query(projected)[1])
+
+
+def take_cells(field, cells: np.ndarray) -> np.ndarray:
+    """Values of some cells of a field for all its timesteps
+
+    Parameters
+    ----------
+    field : numpy.ndarray
+        Field as in CellLocator.probe
+    cells : numpy.ndarray
+        Index of the cells, -1 for no cell
+
+    Returns
+    -------
+    values : numpy.ndarray
+        shape (timesteps, len(cells)) or (timesteps, len(cells), 3),
+        NaN where cells is -1
+
+    """
+
+    cells = np.asarray(cells)
+    missing = cells < 0
+    index = np.where(missing, 0, cells)
+
+    if isinstance(field, np.ndarray) and field.ndim >= 2:
+        # Every timestep at once
+        values = np.asarray(field[:, index], dtype=float)
+    else:
+        values = np.stack([np.asarray(np.asarray(timestep)[index], dtype=float) for timestep in field]) \
+            if len(field) > 0 else np.empty((0, len(cells)))
+    values[:, missing] = np.nan
+
+    return values
+
+
+def get_cell_locator(mesh) -> CellLocator:
+    """Get the CellLocator of a mesh, reusing it if possible
+
+    Locators are cached with the averagers of the mesh (see
+    get_axial_averager, post_processing_functions.py module), so the
+    KD-tree is only built once for all the queries on a mesh.
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh or case_store.StoredMesh
+        Mesh with cell_centres already read
+
+    Returns
+    -------
+    CellLocator
+
+    """
+
+    return post_processing_functions._cached_averager(mesh, ("locator",),
+                                                      lambda: CellLocator.from_mesh(mesh))
+
+
+def _region_cells(  data: dict,
+                    field: str,
+                    points: np.ndarray,
+                    max_distance: float = None
+                ) -> np.ndarray:
+    """Nearest cell of the mesh of a field to every point, -1 for the
+    points closer to a cell of the other region"""
+
+    mesh_key = case_store.field_keys(field)[1]
+    cells, distances = get_cell_locator(data[mesh_key]).nearest_cells(points, max_distance)
+
+    other_mesh = data.get(_OTHER_MESH[mesh_key]) if hasattr(data, "get") else None
+    if other_mesh is not None:
+        _, other_distances = get_cell_locator(other_mesh).nearest_cells(points, max_distance)
+        cells[other_distances < distances] = -1
+
+    return cells
+
+
+def probe_field(    data: dict,
+                    field: str,
+                    points: np.ndarray,
+                    max_distance: float = None
+                ) -> np.ndarray:
+    """Function for getting the values of a field at some points
+
+    The value at each point is the value of the cell of the region of
+    the field whose centre is nearest. Points closer to a cell of the
+    other region (solid for the fields of the fluid, and vice versa)
+    are NaN.
+
+    T_probes = probe_field( data, "FluidTemperature", thermocouples )
+    plt.plot(data["ThermalTimesteps"], T_probes[:, 0])
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    field : str
+        Name of the field, e.g. "FluidTemperature" or
+        "VelocityField"
+    points : numpy.ndarray
+        Cartesian coordinates of the points, shape (points, 3)
+    max_distance : float
+        Points farther than max_distance from the centres of all the
+        cells are NaN (e.g. points outside of the reactor). By
+        default (None), no limit.
+
+    Returns
+    -------
+    values : numpy.ndarray
+        Value of the field at every point for every timestep of the
+        field, shape (timesteps, points), or (timesteps, points, 3)
+        for the velocity.
+
+    """
+
+    cells = _region_cells(data, field, points, max_distance)
+
+    return take_cells(data[field], cells)
+
+
+def sample_line(    data: dict,
+                    field: str,
+                    start: tuple[float, float, float],
+                    end: tuple[float, float, float],
+                    num_points: int = 100,
+                    max_distance: float = None
+                ):
+    """Function for getting the values of a field along a line
+
+    The line from start to end is sampled at num_points equally
+    spaced points, as in probe_field.
+
+    s, T_axis = sample_line( data, "FluidTemperature", (0, 0, z_min), (0, 0, z_max) )
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    field : str
+        Name of the field
+    start, end : tuple[float, float, float]
+        Cartesian coordinates of the ends of the line
+    num_points : int
+        Number of points of the line, ends included
+    max_distance : float
+        As in probe_field
+
+    Returns
+    -------
+    s : numpy.ndarray
+        Distance from start to every point, length num_points
+
+    values : numpy.ndarray
+        Value of the field at every point for every timestep of the
+        field, shape (timesteps, num_points) (or (timesteps,
+        num_points, 3)). NaN outside of the region of the field.
+
+    """
+
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    t = np.linspace(0.0, 1.0, num_points)
+    points = start + t[:, None]*(end - start)
+
+    return t*np.linalg.norm(end - start), probe_field(data, field, points, max_distance)
+
+
+def sample_plane(   data: dict,
+                    field: str,
+                    z: float,
+                    num_points: tuple[int, int] = (100, 100),
+                    x_range: tuple[float, float] = None,
+                    y_range: tuple[float, float] = None,
+                    max_distance: float = None
+                ):
+    """Function for getting the values of a field on a cross section
+
+    The plane of constant z is sampled at a regular grid of points,
+    as in probe_field. Points in the other region (e.g. the walls of
+    the channels for the fields of the fluid) are NaN, and so are the
+    points outside of the reactor if max_distance is given.
+
+    x, y, T_section = sample_plane( data, "FluidTemperature", 0.1, max_distance=1e-3 )
+    plt.pcolormesh(x, y, T_section[-1])
+
+    Parameters
+    ----------
+    data : dict
+        dictionary with the results from the simulation (or a
+        SimulationData)
+    field : str
+        Name of the field
+    z : float
+        z-coordinate of the plane
+    num_points : tuple[int, int]
+        Number of points of the grid in x and y
+    x_range, y_range : tuple[float, float]
+        (min, max) of the grid. By default, the minimum and maximum
+        coordinate of the cell centres of the mesh of the field.
+    max_distance : float
+        As in probe_field
+
+    Returns
+    -------
+    x, y : numpy.ndarray
+        Coordinates of the grid, lengths num_points[0] and
+        num_points[1]
+
+    values : numpy.ndarray
+        Value of the field at every point of the grid for every
+        timestep of the field, shape (timesteps, num_points[1],
+        num_points[0]) (or (..., 3) for the velocity)
+
+    """
+
+    cell_centres = get_cell_locator(data[case_store.field_keys(field)[1]]).tree.data
+    if x_range is None:
+        x_range = (cell_centres[:, 0].min(), cell_centres[:, 0].max())
+    if y_range is None:
+        y_range = (cell_centres[:, 1].min(), cell_centres[:, 1].max())
+    x = np.linspace(x_range[0], x_range[1], num_points[0])
+    y = np.linspace(y_range[0], y_range[1], num_points[1])
+
+    grid_x, grid_y = np.meshgrid(x, y)
+    points = np.stack((grid_x.ravel(), grid_y.ravel(), np.full(grid_x.size, float(z))), axis=1)
+    values = probe_field(data, field, points, max_distance)
+
+    return x, y, values.reshape((len(values), len(y), len(x)) + values.shape[2:])
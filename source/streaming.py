@@ -0,0 +1,347 @@
+"""Streaming reductions module
+
+This module defines a pipeline to reduce the fields of a simulation
+timestep by timestep, straight from the OpenFOAM case directory,
+without ever holding more than one timestep of a field in memory.
+
+For long transients we usually want the axial profiles (or the
+minimum, maximum, mean...) of the fields over time, not the raw
+fields. iter_field_timesteps yields (timestep, values) pairs, one
+field file at a time, and reduce_stream / reduce_case apply a set of
+reducers to each of them and only keep their outputs.
+
+A reducer is any function reducer(values) -> result, where values is
+the value of the field at every cell for one timestep. Reducers can
+be given as functions or by the name they were registered with
+(register_reducer). "min", "max" and "mean" are registered by
+default; they work per component for vector fields.
+
+This module requires numpy. It also uses os
+
+"""
+
+import os
+
+import numpy as np
+
+import case_store
+import data_handling_functions
+import decomposed_case
+import field_reader
+from post_processing_functions import get_axial_averager
+from chunked_averaging import column_range
+
+# Reducers that can be referred to by name:
+REDUCERS = {}
+
+
+def register_reducer(name: str, reducer=None):
+    """Register a reducer with a name
+
+    Can also be used as a decorator, @register_reducer("name").
+
+    Parameters
+    ----------
+    name : str
+        Name of the reducer
+    reducer : callable
+        Function reducer(values) -> result
+
+    """
+
+    if reducer is None:
+        return lambda function: register_reducer(name, function)
+
+    REDUCERS[name] = reducer
+    return reducer
+
+
+register_reducer("min", lambda values: np.min(values, axis=0))
+register_reducer("max", lambda values: np.max(values, axis=0))
+register_reducer("mean", lambda values: np.mean(values, axis=0))
+
+
+def volume_mean_reducer(cell_volumes: np.ndarray):
+    """Reducer with the volume-weighted mean of a field
+
+    Parameters
+    ----------
+    cell_volumes : numpy.ndarray
+        Volume of every cell of the mesh of the field
+
+    Returns
+    -------
+    callable
+        reducer(values) -> volume-weighted mean (per component for
+        vector fields)
+
+    """
+
+    weights = np.asarray(cell_volumes, dtype=float)
+    weights = weights/weights.sum()
+
+    return lambda values: weights @ np.asarray(values, dtype=float)
+
+
+def axial_average_reducer(  mesh,
+                            num_zdots: int,
+                            z_range: tuple[float, float] = None,
+                            chunk_size: int = None
+                        ):
+    """Reducer with the axial profile of a field
+
+    The profile is the same as the one of the getAvg_* functions
+    (post_processing_functions.py module), using the cached
+    AxialAverager of the mesh.
+
+    Parameters
+    ----------
+    mesh : Ofpp.mesh_parser.FoamMesh
+        Mesh with cell_centres and cell_volumes already read
+    num_zdots : int
+        Number of points to divide the lenght of the reactor in.
+    z_range : tuple[float, float]
+        (min_z, max_z) of the z_dots. By default, the minimum and
+        maximum z-coordinate of the cells of the mesh.
+    chunk_size : int
+        Number of cells averaged at a time, as in get_axial_averager.
+        By default, all at once.
+
+    Returns
+    -------
+    callable
+        reducer(values) -> average of the field around each z_dot,
+        shape (num_zdots,)
+
+    """
+
+    averager = get_axial_averager(mesh, num_zdots, z_range, chunk_size)
+
+    return lambda values: averager.average(values)[0]
+
+
+def default_reducers(   fluidmesh,
+                        solidmesh,
+                        num_zdots: int = 100,
+                        chunk_size: int = None
+                    ) -> dict:
+    """Standard reducers for the fields of a case
+
+    The axial profiles are the same as the ones of getAvg_p_rgh
+    ("StaticPressure": "axial"), getAvg_T_justFluid
+    ("FluidTemperature": "axial") and getAvg_T ("FluidTemperature"
+    and "SolidTemperature": "axial_catalyst"). Every field also gets
+    its minimum, maximum and volume-weighted mean.
+
+    Parameters
+    ----------
+    fluidmesh, solidmesh : Ofpp.mesh_parser.FoamMesh
+        Meshes of the fluid and solid regions, with cell_centres and
+        cell_volumes already read
+    num_zdots : int
+        Number of points to divide the lenght of the reactor in.
+    chunk_size : int
+        As in axial_average_reducer
+
+    Returns
+    -------
+    reducers : dict
+        {field: {name: reducer}}, as used by reduce_case
+
+    """
+
+    catalyst_range = column_range(np.asarray(solidmesh.cell_centres), 2, chunk_size)
+
+    def summary(mesh):
+        return {"min": "min", "max": "max", "mean": volume_mean_reducer(mesh.cell_volumes)}
+
+    return {
+        "FluidTemperature": {"axial": axial_average_reducer(fluidmesh, num_zdots, chunk_size=chunk_size),
+                             "axial_catalyst": axial_average_reducer(fluidmesh, num_zdots, catalyst_range,
+                                                                     chunk_size),
+                             **summary(fluidmesh)},
+        "SolidTemperature": {"axial_catalyst": axial_average_reducer(solidmesh, num_zdots, catalyst_range,
+                                                                     chunk_size),
+                             **summary(solidmesh)},
+        "StaticPressure": {"axial": axial_average_reducer(fluidmesh, num_zdots, chunk_size=chunk_size),
+                           **summary(fluidmesh)},
+        "VelocityField": summary(fluidmesh),
+    }
+
+
+def iter_field_timesteps(   case_path: str,
+                            field: str,
+                            fluid_region_name: str = 'FluidRegion/',
+                            solid_region_name: str = 'CatalystRegion/',
+                            momentum_simulation_folder: str = 'MomentumSolution/',
+                            mode: str = 'all',
+                            num_cell: int = None
+                        ):
+    """Read the timesteps of a field one at a time
+
+    Parameters
+    ----------
+    case_path : str
+        Relative path to the case folder
+    field : str
+        "FluidTemperature", "SolidTemperature", "StaticPressure",
+        "VelocityField" or any other field file as '<region>/<file
+        name>' (see case_store.field_region)
+    fluid_region_name, solid_region_name, momentum_simulation_folder
+        As in read_simulation_data
+    mode : str
+        As in read_simulation_data, but 'all' by default.
+    num_cell : int
+        Number of cells of the mesh of the field, to which uniform 
+        timesteps are expanded. By default, it is counted from the 
+        owner and neighbour files of the mesh.
+
+    Yields
+    ------
+    timestep : str
+        Name of the timestep folder
+    values : numpy.ndarray
+        Value of the field at every cell in that timestep, as in
+        case_store.normalise_field (None if the field file does not
+        exist)
+
+    """
+
+    field_timesteps, field_files = data_handling_functions._select_case_files(
+        case_path, fluid_region_name, solid_region_name, momentum_simulation_folder, mode, fields=[field],
+        verbose=False
+    )
+    timesteps_key, mesh_key = case_store.field_keys(field)
+    timesteps = field_timesteps[timesteps_key]
+
+    if num_cell is None and timesteps:
+        num_cell = _num_cell(case_path, fluid_region_name if mesh_key == "FluidMesh" else solid_region_name)
+
+    for ts, fn in zip(timesteps, field_files[field]):
+        values, uniform = decomposed_case.read_field(fn, return_uniform=True)
+        yield ts, case_store.normalise_field(values, num_cell, uniform=uniform)
+
+
+def _num_cell(case_path: str, region_name: str) -> int:
+    """Number of cells of the mesh of a region, from its owner and
+    neighbour files (without parsing the rest of the mesh)"""
+
+    mesh_path = os.path.join(case_path, 'constant', region_name, 'polyMesh')
+    return 1 + max(int(field_reader.read_label_list(os.path.join(mesh_path, name)).max())
+                   for name in ('owner', 'neighbour'))
+
+
+def reduce_stream(stream, reducers: dict) -> dict:
+    """Apply reducers to every timestep of a stream
+
+    Parameters
+    ----------
+    stream : iterable
+        (timestep, values) pairs, e.g. from iter_field_timesteps
+    reducers : dict
+        {name: reducer}, with reducers given as functions or by their
+        registered name
+
+    Returns
+    -------
+    reduced : dict
+        "timesteps" with the list of timesteps (skipping the ones
+        without values), and for every reducer its output for every
+        timestep (stacked in an array if possible, shape (timesteps,
+        ...))
+
+    """
+
+    reducers = {name: REDUCERS[reducer] if isinstance(reducer, str) else reducer
+                for name, reducer in reducers.items()}
+
+    timesteps = []
+    outputs = {name: [] for name in reducers}
+    for ts, values in stream:
+        # Field files that do not exist are read as None:
+        if values is None:
+            continue
+        timesteps.append(ts)
+        for name, reducer in reducers.items():
+            outputs[name].append(reducer(values))
+        # Only the reduced outputs are kept:
+        del values
+
+    reduced = {"timesteps": timesteps}
+    for name, output in outputs.items():
+        try:
+            reduced[name] = np.asarray(output)
+        except ValueError:
+            reduced[name] = output
+
+    return reduced
+
+
+def reduce_case(    case_path: str,
+                    reducers: dict = None,
+                    num_zdots: int = 100,
+                    fluid_region_name: str = 'FluidRegion/',
+                    solid_region_name: str = 'CatalystRegion/',
+                    momentum_simulation_folder: str = 'MomentumSolution/',
+                    mode: str = 'all',
+                    mesh_cache_dir: str = None,
+                    chunk_size: int = None
+                ) -> dict:
+    """Reduce the fields of a case, one timestep at a time
+
+    Peak memory is about the meshes plus one timestep of one field,
+    regardless of the number of timesteps.
+
+    reduced = reduce_case( case_path )
+    plt.plot(reduced["z_dots"]["axial"], reduced["FluidTemperature"]["axial"][-1])
+
+    Parameters
+    ----------
+    case_path : str
+        Relative path to the case folder
+    reducers : dict
+        {field: {name: reducer}}. Only the fields in it are read. By
+        default, default_reducers(fluidmesh, solidmesh, num_zdots).
+    num_zdots : int
+        Number of points of the default axial profiles.
+    fluid_region_name, solid_region_name, momentum_simulation_folder
+        As in read_simulation_data
+    mode : str
+        As in read_simulation_data, but 'all' by default.
+    mesh_cache_dir : str
+        As in read_simulation_data. Meshes are only read for the 
+        default reducers.
+    chunk_size : int
+        Number of cells averaged at a time by the default axial 
+        reducers, for meshes larger than the memory (see 
+        get_axial_averager). By default, all at once.
+
+    Returns
+    -------
+    reduced : dict
+        {field: output of reduce_stream}. With the default reducers,
+        also "z_dots": {"axial": z_dots of the whole fluid region,
+        "axial_catalyst": z_dots of the catalyst}.
+
+    """
+
+    reduced = {}
+    num_cell = {}
+    if reducers is None:
+        fluidmesh = data_handling_functions._read_mesh(case_path, fluid_region_name, mesh_cache_dir)
+        solidmesh = data_handling_functions._read_mesh(case_path, solid_region_name, mesh_cache_dir)
+        reducers = default_reducers(fluidmesh, solidmesh, num_zdots, chunk_size)
+        num_cell = {"FluidMesh": fluidmesh.num_cell, "SolidMesh": solidmesh.num_cell}
+        catalyst_range = column_range(np.asarray(solidmesh.cell_centres), 2, chunk_size)
+        reduced["z_dots"] = {
+            "axial": get_axial_averager(fluidmesh, num_zdots, chunk_size=chunk_size).z_dots,
+            "axial_catalyst": get_axial_averager(solidmesh, num_zdots, catalyst_range, chunk_size).z_dots,
+        }
+
+    for field, field_reducers in reducers.items():
+        stream = iter_field_timesteps(case_path, field, fluid_region_name, solid_region_name,
+                                      momentum_simulation_folder, mode,
+                                      num_cell.get(case_store.field_keys(field)[1]))
+        reduced[field] = reduce_stream(stream, field_reducers)
+
+    return reduced
@@ -0,0 +1,405 @@
+"""Watch module
+
+This module defines the post-processing of a simulation while it is
+still running (chtMultiRegionFoam, pimpleFoam...), to follow the
+convergence of its axial profiles.
+
+A CaseWatcher polls the case folder, its momentum simulation folder
+and their processor directories for new timestep folders, and reduces
+each new timestep of the watched fields (axial profiles, minimum,
+maximum and mean, as streaming.py module does) as soon as it is
+complete. A timestep is complete when the solver has already started
+a later one, or when all its files end with the closing line that
+OpenFOAM writes and none of them has been modified for settle_time
+seconds; timesteps still being written are left for the next poll.
+Only the new timesteps are ever read.
+
+The outputs of all the timesteps processed so far are kept in
+<case>/<output_name>.joblib, so a watcher started again later goes
+on from where the previous one stopped, and the outputs of every new
+timestep are also appended as one line of JSON to
+<case>/<output_name>.jsonl, which can be followed with tail -f or
+read by a plotting script while the simulation runs.
+
+To share the node with the solver, the watcher sleeps between polls,
+can process a limited number of timesteps per poll, and can lower its
+own priority (nice).
+
+Run from the command line with:
+    python watch.py <case_path> [--interval S] [--num-zdots N] [--nice N]
+
+This module requires numpy. It also uses os, json, time, argparse,
+warnings, joblib
+
+"""
+
+import os
+import json
+import time
+import argparse
+import warnings
+
+import numpy as np
+import joblib
+
+import case_store
+import data_handling_functions
+import decomposed_case
+import streaming
+from post_processing_functions import get_axial_averager
+
+WATCHED_FIELDS = ("FluidTemperature", "StaticPressure")
+
+# OpenFOAM ends every file it writes with this line:
+_END_DIVIDER = b'// ****'
+
+
+def _has_end_divider(fn: str) -> bool:
+    """Check if an OpenFOAM file has been written to the end"""
+
+    with open(fn, 'rb') as f:
+        f.seek(max(os.path.getsize(fn) - 256, 0))
+        return _END_DIVIDER in f.read()
+
+
+def _to_json(value):
+    """Value of a reducer output that can be written as JSON"""
+
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
+
+
+class CaseWatcher:
+    """Post-processing of a running simulation, as timesteps land.
+
+    watcher = CaseWatcher( case_path )
+    watcher.run( interval=30 )
+
+    Attributes
+    ----------
+    case_path : str
+        Relative path to the case folder
+    fields : list[str]
+        Watched fields
+    reducers : dict
+        {field: {name: reducer}}, as used by streaming.reduce_stream
+    z_dots : dict
+        z-coordinates of the axial profiles, {"axial": z_dots of the
+        whole fluid region, "axial_catalyst": z_dots of the catalyst}
+    outputs : dict
+        {field: {"timesteps": list[str], name: list}} with the
+        outputs of every reducer for every timestep processed so far
+    state_file, stream_file : str
+        Paths of the joblib file with the outputs and of the JSON
+        lines file the outputs of every new timestep are appended to
+
+    Methods
+    -------
+    poll -> int
+        Process the timesteps completed since the last poll
+    run -> dict
+        Poll until the simulation stops writing timesteps
+    results -> dict
+        Outputs so far, as returned by streaming.reduce_stream
+
+    """
+
+    def __init__(   self,
+                    case_path: str,
+                    fields: list[str] = WATCHED_FIELDS,
+                    num_zdots: int = 100,
+                    reducers: dict = None,
+                    fluid_region_name: str = 'FluidRegion/',
+                    solid_region_name: str = 'CatalystRegion/',
+                    momentum_simulation_folder: str = 'MomentumSolution/',
+                    settle_time: float = 10.0,
+                    max_timesteps_per_poll: int = None,
+                    output_name: str = 'WatchProfiles',
+                    mesh_cache_dir: str = None
+                ):
+        """
+        Read the meshes of a case and the outputs already saved.
+
+        Parameters
+        ----------
+        case_path : str
+            Relative path to the case folder
+        fields : list[str]
+            Fields to watch, as in read_simulation_data. By default
+            the fluid temperature and the static pressure.
+        num_zdots : int
+            Number of points of the axial profiles
+        reducers : dict
+            {field: {name: reducer}} for the watched fields. By
+            default, streaming.default_reducers (minimum, maximum and
+            volume-weighted mean for other fields).
+        fluid_region_name, solid_region_name,
+        momentum_simulation_folder, mesh_cache_dir
+            As in read_simulation_data
+        settle_time : float
+            Time without modifications after which the files of the
+            last timestep are taken as complete [s]
+        max_timesteps_per_poll : int
+            Maximum number of timesteps of each field processed in
+            each poll. By default (None), all the complete ones.
+        output_name : str
+            Name of the output files in the case folder
+        """
+        self.case_path = case_path
+        self.fields = list(fields)
+        self.num_zdots = num_zdots
+        self.fluid_region_name = fluid_region_name
+        self.solid_region_name = solid_region_name
+        self.momentum_simulation_folder = momentum_simulation_folder
+        self.settle_time = settle_time
+        self.max_timesteps_per_poll = max_timesteps_per_poll
+        self.state_file = os.path.join(case_path, output_name + '.joblib')
+        self.stream_file = os.path.join(case_path, output_name + '.jsonl')
+
+        meshes = {"FluidMesh": data_handling_functions._read_mesh(case_path, fluid_region_name, mesh_cache_dir),
+                  "SolidMesh": data_handling_functions._read_mesh(case_path, solid_region_name, mesh_cache_dir)}
+        if reducers is None:
+            default = streaming.default_reducers(meshes["FluidMesh"], meshes["SolidMesh"], num_zdots)
+            reducers = {}
+            for field in self.fields:
+                mesh = meshes[case_store.field_keys(field)[1]]
+                reducers[field] = default.get(field) or {
+                    "min": "min", "max": "max", "mean": streaming.volume_mean_reducer(mesh.cell_volumes)
+                }
+        self.reducers = {field: {name: streaming.REDUCERS[reducer] if isinstance(reducer, str) else reducer
+                                 for name, reducer in reducers[field].items()}
+                         for field in self.fields}
+
+        # To expand uniform timesteps:
+        self._num_cell = {key: mesh.num_cell for key, mesh in meshes.items()}
+
+        z_cen_solid = np.asarray(meshes["SolidMesh"].cell_centres)[:, 2]
+        self.z_dots = {
+            "axial": get_axial_averager(meshes["FluidMesh"], num_zdots).z_dots,
+            "axial_catalyst": get_axial_averager(meshes["SolidMesh"], num_zdots,
+                                                 (z_cen_solid.min(), z_cen_solid.max())).z_dots,
+        }
+
+        self.outputs = self._load_state()
+        # Timesteps without values (missing field file), never
+        # recorded in the outputs:
+        self._skipped = {field: set() for field in self.fields}
+
+    def _new_outputs(self) -> dict:
+        return {field: {"timesteps": [], **{name: [] for name in self.reducers[field]}}
+                for field in self.fields}
+
+    def _load_state(self) -> dict:
+        """Outputs saved by a previous watcher of the case, if they are
+        from the same reducers (otherwise it starts over)"""
+
+        outputs = self._new_outputs()
+        if os.path.isfile(self.state_file):
+            state = joblib.load(self.state_file)
+            if state.get("num_zdots") == self.num_zdots:
+                for field in self.fields:
+                    saved = state["outputs"].get(field, {})
+                    if set(saved) == set(outputs[field]):
+                        outputs[field] = saved
+                return outputs
+
+        # New stream: start with the coordinates of the profiles
+        self._append_stream({"z_dots": {name: z.tolist() for name, z in self.z_dots.items()},
+                             "num_zdots": self.num_zdots})
+        return outputs
+
+    def _save_state(self):
+        """Save the outputs, replacing the old file only once the new
+        one is complete"""
+
+        tmp_name = self.state_file + '.tmp'
+        joblib.dump({"num_zdots": self.num_zdots, "z_dots": self.z_dots, "outputs": self.outputs},
+                    tmp_name)
+        os.replace(tmp_name, self.state_file)
+
+    def _append_stream(self, record: dict):
+        with open(self.stream_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def _is_complete(self, source, is_last: bool, now: float) -> bool:
+        """Check if the files of a timestep have been completely written"""
+
+        if not is_last:
+            # The solver is already writing a later timestep
+            return True
+
+        files = decomposed_case.source_files(source)
+        if not all(os.path.isfile(fn) for fn in files):
+            return False
+        if max(os.stat(fn).st_mtime for fn in files) > now - self.settle_time:
+            return False
+
+        field_files = source.files if isinstance(source, decomposed_case.DecomposedField) else [source]
+        return all(_has_end_divider(fn) for fn in field_files)
+
+    def _field_files(self, field: str) -> tuple[list[str], list]:
+        """Timesteps of a field written so far and their files"""
+
+        try:
+            with warnings.catch_warnings():
+                # No timesteps yet
+                warnings.simplefilter('ignore')
+                field_timesteps, field_files = data_handling_functions._select_case_files(
+                    self.case_path, self.fluid_region_name, self.solid_region_name,
+                    self.momentum_simulation_folder, 'all', fields=[field], verbose=False
+                )
+        except FileNotFoundError:
+            # The simulation folder does not exist yet
+            return [], []
+
+        return field_timesteps[case_store.field_keys(field)[0]], field_files[field]
+
+    def poll(self) -> int:
+        """Process the timesteps completed since the last poll
+
+        Returns
+        -------
+        int
+            Number of new timesteps processed (of all the fields)
+
+        """
+
+        now = time.time()
+        processed = 0
+        for field in self.fields:
+            timesteps, files = self._field_files(field)
+            done = set(self.outputs[field]["timesteps"]) | self._skipped[field]
+            count = 0
+            for i, (ts, source) in enumerate(zip(timesteps, files)):
+                if ts in done or not self._is_complete(source, i == len(timesteps) - 1, now):
+                    continue
+                if self.max_timesteps_per_poll is not None and count >= self.max_timesteps_per_poll:
+                    break
+
+                try:
+                    values, uniform = decomposed_case.read_field(source, return_uniform=True)
+                except (ValueError, IndexError, OSError) as error:
+                    # Still being written after all, try again later
+                    warnings.warn(f"Could not read {field} at {ts} yet: {error}")
+                    continue
+                count += 1
+                if values is None:
+                    self._skipped[field].add(ts)
+                    continue
+                values = case_store.normalise_field(values, self._num_cell[case_store.field_keys(field)[1]],
+                                                    uniform=uniform)
+
+                record = {"field": field, "timestep": ts, "time": float(ts)}
+                self.outputs[field]["timesteps"].append(ts)
+                for name, reducer in self.reducers[field].items():
+                    output = reducer(values)
+                    self.outputs[field][name].append(output)
+                    record[name] = _to_json(output)
+                del values
+                self._append_stream(record)
+            processed += count
+
+        if processed > 0:
+            self._save_state()
+
+        return processed
+
+    def run(    self,
+                interval: float = 30.0,
+                idle_timeout: float = None,
+                max_polls: int = None,
+                nice: int = None
+            ) -> dict:
+        """Poll the case until the simulation stops writing timesteps
+
+        Stops after idle_timeout seconds without new timesteps, after
+        max_polls polls, or on Ctrl+C.
+
+        Parameters
+        ----------
+        interval : float
+            Time between polls [s]
+        idle_timeout : float
+            Time without new timesteps after which it stops [s]. By
+            default (None), it never stops by itself.
+        max_polls : int
+            Maximum number of polls. By default (None), no limit.
+        nice : int
+            Lower the priority of this process by this increment
+            (os.nice, where available)
+
+        Returns
+        -------
+        dict
+            Outputs of all the timesteps processed, as results()
+
+        """
+
+        if nice is not None and hasattr(os, 'nice'):
+            os.nice(nice)
+
+        last_new = time.time()
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                if self.poll() > 0:
+                    last_new = time.time()
+                    print("Processed up to: ",
+                          {field: output["timesteps"][-1] for field, output in self.outputs.items()
+                           if output["timesteps"]})
+                elif idle_timeout is not None and time.time() - last_new > idle_timeout:
+                    break
+                polls += 1
+                if max_polls is None or polls < max_polls:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+        return self.results()
+
+    def results(self) -> dict:
+        """Outputs of all the timesteps processed so far
+
+        Returns
+        -------
+        dict
+            {field: {"timesteps": list[str], name: numpy.ndarray}}, as
+            returned by streaming.reduce_stream, and "z_dots"
+
+        """
+
+        results = {"z_dots": self.z_dots}
+        for field, outputs in self.outputs.items():
+            results[field] = {"timesteps": list(outputs["timesteps"])}
+            for name, output in outputs.items():
+                if name == "timesteps":
+                    continue
+                try:
+                    results[field][name] = np.asarray(output)
+                except ValueError:
+                    results[field][name] = output
+
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-process a running simulation as its timesteps are written.")
+    parser.add_argument('case_path', help="case folder")
+    parser.add_argument('--fields', nargs='+', default=list(WATCHED_FIELDS), help="fields to watch")
+    parser.add_argument('--num-zdots', type=int, default=100, help="number of points of the axial profiles")
+    parser.add_argument('--interval', type=float, default=30.0, help="time between polls [s]")
+    parser.add_argument('--settle-time', type=float, default=10.0,
+                        help="time without changes after which the last timestep is complete [s]")
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help="stop after this time without new timesteps [s]")
+    parser.add_argument('--nice', type=int, default=10, help="priority decrement of the watcher")
+    args = parser.parse_args()
+
+    watcher = CaseWatcher(os.path.join(args.case_path, ''), args.fields, args.num_zdots,
+                          settle_time=args.settle_time)
+    watcher.run(args.interval, args.idle_timeout, nice=args.nice)
+
+
+if __name__ == '__main__':
+    main()